@@ -1,7 +1,10 @@
 from django.contrib import admin
 
 from django.contrib.auth import get_user_model
-from .models import DeliveryRequest, Assignment, Payment, Tracking
+from .models import (
+    DeliveryRequest, Assignment, Payment, Tracking, Tariff, TariffDistanceBand, TariffSurcharge, OutboundEmail,
+    DeliveryEvent, EventConsumerOffset, ReconciliationRun, PaymentDiscrepancy, DailyDeliveryRollup, DailyDriverRollup,
+)
 
 User = get_user_model()
 # Register the User model with custom admin if needed
@@ -9,4 +12,21 @@ admin.site.register(User)
 admin.site.register(DeliveryRequest)    
 admin.site.register(Assignment)
 admin.site.register(Payment)
-admin.site.register(Tracking)
\ No newline at end of file
+admin.site.register(Tracking)
+admin.site.register(Tariff)
+admin.site.register(TariffDistanceBand)
+admin.site.register(TariffSurcharge)
+admin.site.register(DeliveryEvent)
+admin.site.register(EventConsumerOffset)
+admin.site.register(ReconciliationRun)
+admin.site.register(PaymentDiscrepancy)
+admin.site.register(DailyDeliveryRollup)
+admin.site.register(DailyDriverRollup)
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    # Bodies can hold temporary passwords, so staff only see the envelope
+    exclude = ['body']
+    list_display = ['id', 'subject', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status']
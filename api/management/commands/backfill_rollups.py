@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils import analytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the analytics rollups from the delivery table, window by window. Safe to run while "
+        "the analytics consumer is live; use it once after deploying and whenever the rollups drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=analytics.WINDOW, help="Deliveries per transaction.")
+        parser.add_argument('--reset', action='store_true', help="Empty the rollups first and rebuild them.")
+
+    def handle(self, *args, **options):
+        if options['window'] < 1:
+            raise CommandError("--window must be positive.")
+
+        total = 0
+        for last_id, changed in analytics.backfill(options['window'], reset=options['reset']):
+            total += changed
+            if options['verbosity'] > 1 and last_id is not None:
+                self.stdout.write(f"Counted up to delivery #{last_id}: {total} changed.")
+        self.stdout.write(self.style.SUCCESS(f"Rollups updated for {total} deliveries."))
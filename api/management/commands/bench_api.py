@@ -0,0 +1,215 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.models import User, DeliveryRequest, Assignment
+from api.utils import benchmark
+
+PASSWORD = 'bench-password'
+
+
+class Fixtures:
+    """Deterministic users and deliveries, recreated for every run in a throwaway test database."""
+
+    def __init__(self, rows, seed):
+        self.random = random.Random(seed)
+        self.admin = User.objects.create_user(
+            username='bench-admin', email='admin@bench.test', password=PASSWORD, role=User.ADMIN, is_staff=True
+        )
+        self.customer = User.objects.create_user(
+            username='bench-customer', email='customer@bench.test', password=PASSWORD, role=User.CUSTOMER
+        )
+        self.driver = User.objects.create_user(
+            username='bench-driver', email='driver@bench.test', password=PASSWORD, role=User.DRIVER
+        )
+        self.deliveries = self.create_deliveries(rows)
+        Assignment.objects.bulk_create([
+            Assignment(delivery_request=delivery, driver=self.driver, status=Assignment.ACCEPTED)
+            for delivery in self.deliveries[::2]
+        ])
+
+    def payload(self):
+        return {
+            'customer': self.customer.id,
+            'pickup_address': 'Pickup',
+            'dropoff_address': 'Dropoff',
+            'pickup_lat': -1.95 + self.random.uniform(-0.05, 0.05),
+            'pickup_lng': 30.06 + self.random.uniform(-0.05, 0.05),
+            'dropoff_lat': -1.95 + self.random.uniform(-0.05, 0.05),
+            'dropoff_lng': 30.06 + self.random.uniform(-0.05, 0.05),
+            'package_type': self.random.choice(DeliveryRequest.PACKAGE_TYPE_CHOICES)[0],
+        }
+
+    def create_deliveries(self, count, status=DeliveryRequest.PENDING):
+        deliveries = [DeliveryRequest(status=status, **{**self.payload(), 'customer': self.customer})
+                      for _ in range(count)]
+        DeliveryRequest.populate_derived_fields(deliveries)
+        return DeliveryRequest.objects.bulk_create(deliveries)
+
+    def create_assignments(self, count, status=Assignment.ASSIGNED):
+        delivery_status = DeliveryRequest.IN_PROGRESS if status == Assignment.ACCEPTED else DeliveryRequest.ASSIGNED
+        return Assignment.objects.bulk_create([
+            Assignment(delivery_request=delivery, driver=self.driver, status=status)
+            for delivery in self.create_deliveries(count, status=delivery_status)
+        ])
+
+    def client(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        return client
+
+
+def expect(response, status_code):
+    if response.status_code != status_code:
+        raise CommandError(f"{response.request['PATH_INFO']} returned {response.status_code}: {response.content[:300]!r}")
+
+
+# name -> (default iterations, setup(fixtures, total) returning the timed call)
+SCENARIOS = {}
+
+
+def scenario(name, iterations):
+    def register(setup):
+        SCENARIOS[name] = (iterations, setup)
+        return setup
+    return register
+
+
+@scenario('login', 20)
+def login(fixtures, total):
+    client = fixtures.client()
+    data = {'username': fixtures.customer.email, 'password': PASSWORD}
+    return lambda i: expect(client.post('/api/login/', data, format='json'), 200)
+
+
+@scenario('delivery_create', 200)
+def delivery_create(fixtures, total):
+    client = fixtures.client(fixtures.customer)
+    payloads = [fixtures.payload() for _ in range(total)]
+    return lambda i: expect(client.post('/api/delivery-requests/', payloads[i], format='json'), 201)
+
+
+@scenario('tracking_ingest', 300)
+def tracking_ingest(fixtures, total):
+    client = fixtures.client(fixtures.driver)
+    delivery = fixtures.deliveries[0]
+
+    def call(i):
+        point = {'delivery_request': delivery.id, 'driver': fixtures.driver.id,
+                 'latitude': -1.95 + i * 1e-5, 'longitude': 30.06}
+        expect(client.post('/api/tracking/', point, format='json'), 201)
+    return call
+
+
+@scenario('tracking_bulk_100', 50)
+def tracking_bulk(fixtures, total):
+    client = fixtures.client(fixtures.driver)
+    delivery = fixtures.deliveries[0]
+
+    def call(i):
+        points = [{'delivery_request': delivery.id, 'driver': fixtures.driver.id,
+                   'latitude': -1.95 + n * 1e-5, 'longitude': 30.06} for n in range(100)]
+        expect(client.post('/api/tracking/bulk/', {'points': points}, format='json'), 201)
+    return call
+
+
+def delivery_list(role):
+    def setup(fixtures, total):
+        client = fixtures.client(getattr(fixtures, role))
+        return lambda i: expect(client.get('/api/delivery-requests/'), 200)
+    return setup
+
+
+for role in ('admin', 'customer', 'driver'):
+    scenario(f'delivery_list_{role}', 200)(delivery_list(role))
+
+
+@scenario('assignment_accept', 200)
+def assignment_accept(fixtures, total):
+    client = fixtures.client(fixtures.driver)
+    assignments = fixtures.create_assignments(total)
+    return lambda i: expect(client.patch(f'/api/assignments/{assignments[i].id}/accept/'), 200)
+
+
+@scenario('assignment_reject', 200)
+def assignment_reject(fixtures, total):
+    client = fixtures.client(fixtures.driver)
+    assignments = fixtures.create_assignments(total)
+    data = {'reason': 'Too far'}
+    return lambda i: expect(client.patch(f'/api/assignments/{assignments[i].id}/reject/', data, format='json'), 200)
+
+
+@scenario('assignment_complete', 200)
+def assignment_complete(fixtures, total):
+    client = fixtures.client(fixtures.driver)
+    assignments = fixtures.create_assignments(total, status=Assignment.ACCEPTED)
+    return lambda i: expect(client.patch(f'/api/assignments/{assignments[i].id}/complete/'), 200)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the API hot paths through the full request stack against a throwaway test "
+        "database, reporting throughput and p50/p95/p99, optionally compared with a saved baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', help=f"Comma separated subset of: {', '.join(SCENARIOS)}.")
+        parser.add_argument('--iterations', type=int, help="Override the per-scenario iteration count.")
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--rows', type=int, default=1000, help="Delivery requests seeded before the run.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--baseline', help="JSON file of a previous run to compare against.")
+        parser.add_argument('--save-baseline', help="Write this run's results to a JSON file.")
+        parser.add_argument('--tolerance', type=float, default=benchmark.DEFAULT_TOLERANCE,
+                            help="Allowed relative p95 slowdown before a scenario counts as a regression.")
+
+    def handle(self, *args, **options):
+        names = options['scenarios'].split(',') if options['scenarios'] else list(SCENARIOS)
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(unknown)}.")
+        baseline = benchmark.load_baseline(options['baseline']) if options['baseline'] else None
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = self.run(names, options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'scenario':<22} {'iter':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, summary in results.items():
+            self.stdout.write(
+                f"{name:<22} {summary['iterations']:>5} {summary['throughput']:>9.1f} "
+                f"{summary['p50_ms']:>9.2f} {summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f}"
+            )
+
+        if options['save_baseline']:
+            benchmark.save_baseline(options['save_baseline'], results)
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['save_baseline']}."))
+
+        if baseline is not None:
+            rows, regressions = benchmark.compare(results, baseline, tolerance=options['tolerance'])
+            self.stdout.write(f"\n{'scenario':<22} {'base p95':>9} {'p95':>9} {'change':>8}")
+            for name, previous, current, change in rows:
+                line = f"{name:<22} {previous:>9.2f} {current:>9.2f} {change:>+8.1%}"
+                self.stdout.write(self.style.ERROR(line) if name in regressions else line)
+            if regressions:
+                raise CommandError(f"p95 regressed by more than {options['tolerance']:.0%}: {', '.join(regressions)}.")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def run(self, names, options):
+        fixtures = Fixtures(options['rows'], options['seed'])
+        results = {}
+        for name in names:
+            iterations, setup = SCENARIOS[name]
+            iterations = options['iterations'] or iterations
+            call = setup(fixtures, iterations + options['warmup'])
+            samples = benchmark.measure(call, iterations, warmup=options['warmup'])
+            results[name] = benchmark.summarize(samples)
+        return results
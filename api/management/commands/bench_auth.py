@@ -0,0 +1,65 @@
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import User
+from api.utils import benchmark, metrics
+from api.utils.authentication import CachedJWTAuthentication, user_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark per-request JWT authentication overhead, simplejwt's JWTAuthentication "
+        "against CachedJWTAuthentication, in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Distinct users sending requests.")
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--warmup', type=int, default=200)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'backend':<26} {'req/s':>10} {'p50 us':>8} {'p95 us':>8} {'p99 us':>8} {'queries/req':>12}")
+        for name, (summary, queries) in results.items():
+            self.stdout.write(
+                f"{name:<26} {summary['throughput']:>10.0f} {summary['p50_ms'] * 1000:>8.1f} "
+                f"{summary['p95_ms'] * 1000:>8.1f} {summary['p99_ms'] * 1000:>8.1f} {queries:>12.3f}"
+            )
+
+    def run(self, options):
+        password = make_password('password')
+        User.objects.bulk_create([
+            User(username=f'driver-{index}', email=f'driver-{index}@bench.test', password=password, role=User.DRIVER)
+            for index in range(options['users'])
+        ])
+        factory = RequestFactory()
+        requests = [
+            factory.get('/api/delivery-requests/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+            for user in User.objects.all()
+        ]
+
+        results = {}
+        for backend in (JWTAuthentication(), CachedJWTAuthentication()):
+            user_cache.clear()
+
+            def call(index):
+                backend.authenticate(requests[index % len(requests)])
+
+            queries = metrics.QueryTimer()
+            with connection.execute_wrapper(queries):
+                samples = benchmark.measure(call, options['requests'], warmup=options['warmup'])
+            total = options['requests'] + options['warmup']
+            results[type(backend).__name__] = (benchmark.summarize(samples), queries.count / total)
+        return results
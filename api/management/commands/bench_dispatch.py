@@ -0,0 +1,67 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from api.utils import batch_dispatch
+
+SOLVERS = {
+    'scipy': batch_dispatch.solve_assignment,
+    'numpy': batch_dispatch.hungarian,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark batch dispatch: solve time versus N, and total deadhead distance "
+        "of the optimal assignment versus sequential nearest-driver assignment."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='50,100,200,500,1000',
+                            help="Comma separated numbers of drivers (= pending requests).")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--center', default='-1.9441,30.0619', help="lat,lng of the simulated city.")
+        parser.add_argument('--spread', type=float, default=0.08, help="Std deviation of positions in degrees.")
+        parser.add_argument('--radius', type=float, default=batch_dispatch.SEARCH_RADIUS_KM)
+        parser.add_argument('--solver', choices=SOLVERS, default='scipy',
+                            help="'numpy' runs the reference Hungarian instead of SciPy's solver.")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        lat, lng = (float(value) for value in options['center'].split(','))
+        solver = SOLVERS[options['solver']]
+
+        self.stdout.write(f"solver: {options['solver']}")
+        header = f"{'N':>6} {'matrix ms':>10} {'solve ms':>10} {'greedy ms':>10} " \
+                 f"{'greedy km':>11} {'optimal km':>11} {'saved':>7}"
+        self.stdout.write(header)
+        for size in (int(value) for value in options['sizes'].split(',')):
+            drivers = rng.normal((lat, lng), options['spread'], size=(size, 2))
+            requests = rng.normal((lat, lng), options['spread'], size=(size, 2))
+
+            started = time.perf_counter()
+            costs = batch_dispatch.cost_matrix(drivers, requests, max_radius_km=options['radius'])
+            matrix_ms = (time.perf_counter() - started) * 1000
+
+            solve_times, greedy_times = [], []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                rows, cols = batch_dispatch.solve_sparse(costs, solver=solver)
+                solve_times.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                greedy_rows, greedy_cols = batch_dispatch.solve_greedy(costs)
+                greedy_times.append(time.perf_counter() - started)
+
+            optimal_km = costs[rows, cols].sum()
+            greedy_km = costs[greedy_rows, greedy_cols].sum()
+            saved = (1 - optimal_km / greedy_km) * 100 if greedy_km else 0.0
+            if len(rows) != len(greedy_rows):
+                saved_label = f"{len(rows) - len(greedy_rows):+d} asg"
+            else:
+                saved_label = f"{saved:6.1f}%"
+            self.stdout.write(
+                f"{size:>6} {matrix_ms:>10.1f} {min(solve_times) * 1000:>10.1f} {min(greedy_times) * 1000:>10.1f} "
+                f"{greedy_km:>11.1f} {optimal_km:>11.1f} {saved_label:>7}"
+            )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils import revocation
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired outstanding and blacklisted refresh tokens in small batches and rebuild "
+        "the revocation filter. Run it periodically, e.g. nightly from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Token ids deleted per transaction.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        deleted = revocation.purge_expired(batch_size=options['batch_size'])
+        # Other processes rebuild on their own once their filter saturates
+        revocation.registry.clear()
+        revocation.registry.sync(force=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted['outstanding']} expired tokens, {deleted['blacklisted']} of them blacklisted."
+        ))
@@ -0,0 +1,61 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils import events
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver delivery lifecycle events to the configured sinks (EVENT_SINKS, EVENT_WEBHOOK_URLS) "
+        "in ordered batches, at least once, tracking one offset per consumer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumers', help="Comma separated subset of the configured consumers.")
+        parser.add_argument('--batch-size', type=int, default=events.BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new events.")
+        parser.add_argument('--interval', type=float, default=1, help="Seconds between polls when idle.")
+        parser.add_argument('--keep-days', type=int, default=30,
+                            help="Delete events all consumers processed more than this many days ago.")
+
+    def handle(self, *args, **options):
+        sinks = events.configured_sinks()
+        if options['consumers']:
+            names = options['consumers'].split(',')
+            unknown = [name for name in names if name not in sinks]
+            if unknown:
+                raise CommandError(f"Unknown consumers: {', '.join(unknown)}. Configured: {', '.join(sinks)}.")
+            sinks = {name: sinks[name] for name in names}
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        purged = events.purge_consumed(list(events.configured_sinks()), timedelta(days=options['keep_days']))
+        if purged:
+            self.stdout.write(f"Purged {purged} processed events.")
+        try:
+            while True:
+                delivered = sum(self.drain(name, sink, options['batch_size']) for name, sink in sinks.items())
+                if not options['loop']:
+                    break
+                if not delivered:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def drain(self, name, sink, batch_size):
+        total = 0
+        while True:
+            try:
+                delivered = events.dispatch(name, sink, batch_size)
+            except Exception as error:
+                # Offset stays put; the batch is retried on the next poll
+                self.stderr.write(f"{name}: {type(error).__name__}: {error}")
+                break
+            total += delivered
+            if delivered < batch_size:
+                break
+        if total:
+            self.stdout.write(f"{name}: {total} events")
+        return total
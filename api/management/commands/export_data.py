@@ -0,0 +1,42 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils import exporter
+
+
+class Command(BaseCommand):
+    help = "Stream deliveries or tracking points to NDJSON or CSV in constant memory, optionally gzipped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(exporter.DATASETS))
+        parser.add_argument('--format', dest='fmt', choices=exporter.FORMATS, default=exporter.NDJSON)
+        parser.add_argument('--output', help="File to write; standard output by default.")
+        parser.add_argument('--start', type=date.fromisoformat, help="First day included (YYYY-MM-DD).")
+        parser.add_argument('--end', type=date.fromisoformat, help="Last day included (YYYY-MM-DD).")
+        parser.add_argument('--status', help="Comma separated delivery statuses.")
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--page-size', type=int, default=exporter.PAGE_SIZE, help="Rows fetched per query.")
+
+    def handle(self, *args, **options):
+        if options['page_size'] < 1:
+            raise CommandError("--page-size must be positive.")
+        statuses = [value for value in (options['status'] or '').split(',') if value]
+        try:
+            chunks = exporter.export(
+                options['dataset'], options['fmt'], options['start'], options['end'], statuses,
+                compress=options['gzip'], page_size=options['page_size'],
+            )
+        except exporter.ExportError as error:
+            raise CommandError(str(error))
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
@@ -0,0 +1,250 @@
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api.models import User, DeliveryRequest, Assignment, Payment, Tracking
+from api.utils.distance import KM_PER_DEGREE, METHODS
+
+# Share of generated requests per status
+STATUS_WEIGHTS = {
+    DeliveryRequest.COMPLETED: 0.70,
+    DeliveryRequest.PENDING: 0.10,
+    DeliveryRequest.ASSIGNED: 0.05,
+    DeliveryRequest.IN_PROGRESS: 0.07,
+    DeliveryRequest.CANCELLED: 0.08,
+}
+PACKAGE_WEIGHTS = {
+    DeliveryRequest.PARCEL: 0.45,
+    DeliveryRequest.FOOD: 0.25,
+    DeliveryRequest.FRAGILE: 0.08,
+    DeliveryRequest.HOUSEHOLD_ITEMS: 0.10,
+    DeliveryRequest.OFFICE_EQUIPMENT: 0.07,
+    DeliveryRequest.OTHER: 0.05,
+}
+PAYMENT_WEIGHTS = {
+    Payment.MOBILE_MONEY: 0.45,
+    Payment.CARD: 0.25,
+    Payment.ON_DELIVERY: 0.25,
+    Payment.PAYPAL: 0.05,
+}
+# Chance that a driver rejected the request before the one who took it
+REJECTION_RATE = 0.1
+# Median trip length; lengths are log-normal around it
+MEDIAN_TRIP_KM = 5.0
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let bulk_create keep the generated values of auto_now/auto_now_add fields."""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _field(model, name):
+    return model._meta.get_field(name)
+
+
+def _next_id(model):
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+
+def _reset_sequences(*models):
+    """
+    Move the id sequences past the explicit ids; a no-op on MySQL and SQLite,
+    whose auto increment already follows the highest id.
+    """
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def _choice(rng, weights, size):
+    keys = list(weights)
+    probabilities = np.array([weights[key] for key in keys], dtype=float)
+    return np.array(keys, dtype=object)[rng.choice(len(keys), size=size, p=probabilities / probabilities.sum())]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users, delivery requests, assignments, payments and tracking points "
+        "in chunked bulk inserts, with distance and price computed in bulk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--deliveries', type=int, default=100000)
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--drivers', type=int, default=200)
+        parser.add_argument('--tracking-points', type=int, default=5,
+                            help="Points per started delivery (in progress or completed).")
+        parser.add_argument('--days', type=int, default=90, help="Spread creation dates over this many past days.")
+        parser.add_argument('--hubs', default='-1.9441,30.0619;-1.6992,29.2566;-2.5967,29.7394',
+                            help="Semicolon separated lat,lng city centres pickups cluster around.")
+        parser.add_argument('--spread', type=float, default=0.05, help="Std deviation around a hub in degrees.")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--method', choices=METHODS, help="Distance formula, defaults to settings.DISTANCE_METHOD.")
+        parser.add_argument('--password', default='password', help="Password of every generated user.")
+
+    def handle(self, *args, **options):
+        try:
+            self.hubs = np.array([[float(value) for value in hub.split(',')] for hub in options['hubs'].split(';')])
+        except ValueError:
+            raise CommandError("--hubs must look like 'lat,lng;lat,lng'.")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive.")
+
+        self.options = options
+        self.rng = np.random.default_rng(options['seed'])
+        self.now = timezone.now()
+        started = time.perf_counter()
+
+        customer_ids = self.create_users(User.CUSTOMER, options['customers'])
+        driver_ids = self.create_users(User.DRIVER, options['drivers'])
+        _reset_sequences(User)
+        if not len(customer_ids) or not len(driver_ids):
+            raise CommandError("At least one customer and one driver are needed.")
+
+        timestamps = (
+            _field(DeliveryRequest, 'created_at'), _field(DeliveryRequest, 'updated_at'),
+            _field(Assignment, 'assigned_at'), _field(Payment, 'created_at'), _field(Tracking, 'timestamp'),
+        )
+        totals = {'deliveries': 0, 'assignments': 0, 'payments': 0, 'tracking': 0}
+        next_id = _next_id(DeliveryRequest)
+        remaining = options['deliveries']
+        with explicit_timestamps(*timestamps):
+            while remaining > 0:
+                size = min(options['chunk_size'], remaining)
+                counts = self.create_chunk(next_id, size, customer_ids, driver_ids)
+                for key, value in counts.items():
+                    totals[key] += value
+                next_id += size
+                remaining -= size
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"{totals['deliveries']} deliveries, {elapsed:.1f}s "
+                                  f"({totals['deliveries'] / elapsed:.0f}/s)")
+        _reset_sequences(DeliveryRequest)
+
+        elapsed = time.perf_counter() - started
+        summary = ', '.join(f"{value} {key}" for key, value in totals.items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(customer_ids)} customers, {len(driver_ids)} drivers, {summary} in {elapsed:.1f}s."
+        ))
+
+    def create_users(self, role, count):
+        # Hashing is deliberately slow, so every user shares one hash
+        password = make_password(self.options['password'])
+        first_id = _next_id(User)
+        ids = np.arange(first_id, first_id + count)
+        label = role.lower()
+        for start in range(0, count, self.options['chunk_size']):
+            User.objects.bulk_create([
+                User(id=user_id, username=f'{label}-{user_id}', email=f'{label}-{user_id}@example.com',
+                     password=password, role=role, phone_number=f'+25078{user_id % 10 ** 7:07d}')
+                for user_id in ids[start:start + self.options['chunk_size']].tolist()
+            ])
+        return ids
+
+    def coordinates(self, size):
+        """Pickups clustered around hubs, dropoffs a log-normal distance away in a random direction."""
+        hubs = self.hubs[self.rng.integers(len(self.hubs), size=size)]
+        pickups = hubs + self.rng.normal(0, self.options['spread'], size=(size, 2))
+        trip_km = self.rng.lognormal(np.log(MEDIAN_TRIP_KM), 0.6, size=size)
+        bearing = self.rng.uniform(0, 2 * np.pi, size=size)
+        d_lat = trip_km * np.cos(bearing) / KM_PER_DEGREE
+        d_lng = trip_km * np.sin(bearing) / (KM_PER_DEGREE * np.cos(np.radians(pickups[:, 0])))
+        dropoffs = pickups + np.column_stack([d_lat, d_lng])
+        return pickups, dropoffs
+
+    def create_chunk(self, first_id, size, customer_ids, driver_ids):
+        rng = self.rng
+        ids = np.arange(first_id, first_id + size)
+        pickups, dropoffs = self.coordinates(size)
+        statuses = _choice(rng, STATUS_WEIGHTS, size)
+        package_types = _choice(rng, PACKAGE_WEIGHTS, size)
+        customers = customer_ids[rng.integers(len(customer_ids), size=size)]
+        age = rng.uniform(0, self.options['days'] * 86400, size=size)
+        created = [self.now - timedelta(seconds=seconds) for seconds in age.tolist()]
+
+        deliveries = [
+            DeliveryRequest(
+                id=delivery_id, customer_id=customer_id, status=status, package_type=package_type,
+                pickup_address=f'Pickup {delivery_id}', dropoff_address=f'Dropoff {delivery_id}',
+                pickup_lat=pickup[0], pickup_lng=pickup[1], dropoff_lat=dropoff[0], dropoff_lng=dropoff[1],
+                is_paid=status == DeliveryRequest.COMPLETED, created_at=created_at, updated_at=created_at,
+            )
+            for delivery_id, customer_id, status, package_type, pickup, dropoff, created_at in zip(
+                ids.tolist(), customers.tolist(), statuses, package_types,
+                pickups.tolist(), dropoffs.tolist(), created
+            )
+        ]
+        DeliveryRequest.populate_derived_fields(deliveries, method=self.options['method'])
+
+        assignments, payments, tracking = [], [], []
+        drivers = driver_ids[rng.integers(len(driver_ids), size=size)].tolist()
+        rejected_by = driver_ids[rng.integers(len(driver_ids), size=size)].tolist()
+        rejections = (rng.random(size) < REJECTION_RATE).tolist()
+        payment_methods = _choice(rng, PAYMENT_WEIGHTS, size)
+        points = self.options['tracking_points']
+
+        for index, delivery in enumerate(deliveries):
+            if delivery.status in (DeliveryRequest.PENDING, DeliveryRequest.CANCELLED):
+                continue
+            assigned_at = delivery.created_at + timedelta(minutes=2)
+            if rejections[index] and rejected_by[index] != drivers[index]:
+                assignments.append(Assignment(
+                    delivery_request_id=delivery.id, driver_id=rejected_by[index], status=Assignment.REJECTED,
+                    rejection_reason='Too far', assigned_at=delivery.created_at + timedelta(minutes=1),
+                ))
+            accepted = delivery.status != DeliveryRequest.ASSIGNED
+            assignments.append(Assignment(
+                delivery_request_id=delivery.id, driver_id=drivers[index], assigned_at=assigned_at,
+                status=Assignment.ACCEPTED if accepted else Assignment.ASSIGNED,
+            ))
+            if not accepted:
+                continue
+
+            completed = delivery.status == DeliveryRequest.COMPLETED
+            payments.append(Payment(
+                delivery_request_id=delivery.id, amount=delivery.price or Decimal('0'),
+                payment_method=payment_methods[index], created_at=assigned_at,
+                status=Payment.SUCCESS if completed else Payment.PENDING,
+                transaction_id=f'gen-{delivery.id}' if completed else None,
+            ))
+
+            # Fixes along the straight line from pickup to dropoff, with GPS noise
+            steps = np.linspace(0, 1 if completed else 0.5, points)
+            lats = delivery.pickup_lat + steps * (delivery.dropoff_lat - delivery.pickup_lat)
+            lngs = delivery.pickup_lng + steps * (delivery.dropoff_lng - delivery.pickup_lng)
+            noise = rng.normal(0, 0.0002, size=(points, 2))
+            for step, (lat, lng) in enumerate(zip((lats + noise[:, 0]).tolist(), (lngs + noise[:, 1]).tolist())):
+                tracking.append(Tracking(
+                    delivery_request_id=delivery.id, driver_id=drivers[index], latitude=lat, longitude=lng,
+                    timestamp=assigned_at + timedelta(minutes=5 + 3 * step),
+                ))
+
+        with transaction.atomic():
+            DeliveryRequest.objects.bulk_create(deliveries)
+            Assignment.objects.bulk_create(assignments)
+            Payment.objects.bulk_create(payments)
+            Tracking.objects.bulk_create(tracking, batch_size=self.options['chunk_size'])
+        return {
+            'deliveries': len(deliveries), 'assignments': len(assignments),
+            'payments': len(payments), 'tracking': len(tracking),
+        }
@@ -0,0 +1,36 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils import importer
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV or NDJSON manifest of delivery requests into the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Manifest file to import.")
+        parser.add_argument('--customer', required=True, help="Id or email of the owning customer.")
+        parser.add_argument('--format', choices=importer.FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=importer.DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        lookup = {'pk': options['customer']} if options['customer'].isdigit() else {'email': options['customer']}
+        try:
+            customer = User.objects.get(role=User.CUSTOMER, **lookup)
+        except User.DoesNotExist:
+            raise CommandError(f"Customer {options['customer']} does not exist.")
+
+        fmt = options['format'] or importer.detect_format(options['path'])
+        with open(options['path'], 'rb') as stream:
+            result = importer.import_deliveries(
+                stream, customer=customer, fmt=fmt, chunk_size=options['chunk_size']
+            )
+
+        for error in result.errors:
+            self.stderr.write(json.dumps(error))
+        message = f"Imported {result.created} delivery requests, {result.failed} rows failed."
+        self.stdout.write(self.style.SUCCESS(message) if not result.failed else self.style.WARNING(message))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import ReconciliationRun
+from api.utils import reconciliation
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that every delivery marked paid has exactly one successful payment of its price, and "
+        "the reverse. Streams both tables window by window in constant memory; meant to run nightly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=reconciliation.WINDOW,
+                            help="Deliveries checked between checkpoints.")
+        parser.add_argument('--chunk-size', type=int, default=reconciliation.CHUNK_SIZE,
+                            help="Rows fetched per round trip.")
+        parser.add_argument('--output', help="Append discrepancies to this NDJSON file instead of the report table.")
+        parser.add_argument('--resume', action='store_true',
+                            help="Continue the last unfinished run from its checkpoint.")
+
+    def handle(self, *args, **options):
+        if options['window'] < 1 or options['chunk_size'] < 1:
+            raise CommandError("--window and --chunk-size must be positive.")
+
+        if options['resume']:
+            run = ReconciliationRun.objects.filter(finished_at__isnull=True).order_by('-id').first()
+            if run is None:
+                raise CommandError("There is no unfinished run to resume.")
+            if options['output'] and options['output'] != run.output:
+                raise CommandError(f"Run #{run.id} writes to {run.output or 'the report table'}.")
+            self.stdout.write(f"Resuming run #{run.id} after delivery #{run.last_delivery_id}.")
+        else:
+            run = ReconciliationRun.objects.create(output=options['output'] or '')
+
+        if run.output:
+            report = reconciliation.NDJSONReport(run, run.output)
+        else:
+            report = reconciliation.TableReport(run)
+        try:
+            for run in reconciliation.reconcile(run, report, options['window'], options['chunk_size']):
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"Checked up to delivery #{run.last_delivery_id}: {run.discrepancies} found.")
+        finally:
+            report.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Run #{run.id}: checked {run.checked} deliveries, {run.discrepancies} discrepancies."
+        ))
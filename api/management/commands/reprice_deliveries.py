@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.models import DeliveryRequest
+from api.utils.distance import METHODS
+
+
+class Command(BaseCommand):
+    help = "Recompute distance_km, price and geohashes of delivery requests in vectorized chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Only requests created on this day (YYYY-MM-DD).")
+        parser.add_argument('--status', choices=[choice for choice, _ in DeliveryRequest.STATUS_CHOICES])
+        parser.add_argument('--method', choices=METHODS, help="Distance formula, defaults to settings.DISTANCE_METHOD.")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        queryset = DeliveryRequest.objects.only(
+            'id', 'distance_km', 'price', 'created_at', *DeliveryRequest.PRICING_FIELDS
+        ).order_by('id')
+
+        if options['date']:
+            day = parse_date(options['date'])
+            if day is None:
+                raise CommandError("--date must be formatted as YYYY-MM-DD.")
+            queryset = queryset.filter(created_at__date=day)
+        if options['status']:
+            queryset = queryset.filter(status=options['status'])
+
+        started = time.perf_counter()
+        total = 0
+        last_id = 0
+        while True:
+            # Keyset chunks keep memory flat and avoid OFFSET scans
+            chunk = list(queryset.filter(id__gt=last_id)[:options['chunk_size']])
+            if not chunk:
+                break
+            DeliveryRequest.populate_derived_fields(chunk, method=options['method'])
+            DeliveryRequest.objects.bulk_update(chunk, ['distance_km', 'price', 'pickup_geohash', 'dropoff_geohash'])
+            last_id = chunk[-1].id
+            total += len(chunk)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Repriced {total} delivery requests in {elapsed:.2f}s."))
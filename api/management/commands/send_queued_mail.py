@@ -0,0 +1,52 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils import mailer
+
+
+class Command(BaseCommand):
+    help = (
+        "Send queued outbound emails in batches over one backend connection, retrying failures "
+        "with exponential backoff. Runs once, or continuously with --loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help="Keep polling for queued email.")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds between polls when idle.")
+        parser.add_argument('--keep-days', type=int, default=7,
+                            help="Delete sent emails older than this many days.")
+        parser.add_argument('--status', action='store_true', help="Only print the outbox status.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+        if options['status']:
+            self.report()
+            return
+
+        purged = mailer.purge_sent(timedelta(days=options['keep_days']))
+        if purged:
+            self.stdout.write(f"Purged {purged} sent emails.")
+        try:
+            while True:
+                counts = mailer.send_batch(options['batch_size'])
+                if any(counts.values()):
+                    self.stdout.write(', '.join(f"{value} {key}" for key, value in counts.items()))
+                # A full batch suggests more are due right away
+                if sum(counts.values()) == options['batch_size']:
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.report()
+
+    def report(self):
+        counts = mailer.status_counts()
+        self.stdout.write(self.style.SUCCESS(
+            "Outbox: " + ', '.join(f"{value} {key.lower()}" for key, value in counts.items())
+        ))
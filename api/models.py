@@ -1,7 +1,14 @@
+from decimal import Decimal
+
+import numpy as np
 from django.contrib.auth.models import AbstractUser
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.conf import settings
-from geopy.distance import geodesic
+from django.utils import timezone
+
+from api.utils.distance import distance_km
+from api.utils import geohash, pricing
 
 
 class User(AbstractUser):
@@ -68,6 +75,12 @@ class DeliveryRequest(models.Model):
     
     distance_km = models.FloatField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # Derived from the coordinates, used for radius queries (see api.utils.geohash)
+    pickup_geohash = models.CharField(max_length=12, blank=True, null=True, editable=False)
+    dropoff_geohash = models.CharField(max_length=12, blank=True, null=True, editable=False, db_index=True)
+    # Marks the rows of one import chunk, so their ids can be read back where bulk inserts
+    # do not return them (see api.utils.importer)
+    import_batch = models.UUIDField(blank=True, null=True, editable=False, db_index=True)
     is_paid = models.BooleanField(default=False)
     
     status = models.CharField(
@@ -99,28 +112,155 @@ class DeliveryRequest(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
+
+    class Meta:
+        indexes = [
+            # Nearby open deliveries: status equality, then a geohash prefix range
+            models.Index(fields=['status', 'pickup_geohash'], name='delivery_status_pickup_gh'),
+            models.Index(fields=['status', 'created_at'], name='delivery_status_created'),
+            models.Index(fields=['customer', 'created_at'], name='delivery_customer_created'),
+            models.Index(fields=['created_at', 'id'], name='delivery_created_id'),
+        ]
+
+    COORDINATE_FIELDS = ('pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng')
+    PRICING_FIELDS = COORDINATE_FIELDS + ('package_type',)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the stored distance/price were computed from, unless
+        # some inputs were deferred (reading them would cost a query).
+        if all(name in instance.__dict__ for name in cls.PRICING_FIELDS):
+            instance._priced_inputs = instance.pricing_inputs
+        return instance
+
+    @property
+    def coordinates(self):
+        return (self.pickup_lat, self.pickup_lng, self.dropoff_lat, self.dropoff_lng)
+
+    @property
+    def pricing_inputs(self):
+        return self.coordinates + (self.package_type,)
+
+    def has_coordinates(self):
+        return all(value is not None for value in self.coordinates)
+
+    def needs_pricing(self):
+        if not self.has_coordinates():
+            return False
+        if self.distance_km is None or self.price is None or self.pickup_geohash is None:
+            return True
+        return self.pricing_inputs != getattr(self, '_priced_inputs', None)
+
+    @classmethod
+    def populate_derived_fields(cls, deliveries, method=None):
+        """
+        Compute distance_km, price and the geohashes for many delivery
+        requests in a single vectorized pass. Used by save() and by every bulk
+        write path. Surcharges use the hour the request was created (now for
+        new ones).
+        """
+        deliveries = [delivery for delivery in deliveries if delivery.has_coordinates()]
+        if not deliveries:
+            return
+        coordinates = np.array([delivery.coordinates for delivery in deliveries], dtype=float)
+        distances = distance_km(
+            coordinates[:, 0], coordinates[:, 1], coordinates[:, 2], coordinates[:, 3], method=method
+        )
+        now = timezone.now()
+        hours = [timezone.localtime(delivery.created_at or now).hour for delivery in deliveries]
+        prices = pricing.engine.quote_many(distances, [delivery.package_type for delivery in deliveries], hours)
+        pickup_hashes = geohash.encode_many(coordinates[:, 0], coordinates[:, 1])
+        dropoff_hashes = geohash.encode_many(coordinates[:, 2], coordinates[:, 3])
+        for delivery, distance, price, pickup_hash, dropoff_hash in zip(
+            deliveries, distances.tolist(), prices.tolist(), pickup_hashes, dropoff_hashes
+        ):
+            delivery.distance_km = distance
+            delivery.price = Decimal(f'{price:.2f}')
+            delivery.pickup_geohash = pickup_hash
+            delivery.dropoff_geohash = dropoff_hash
+            delivery._priced_inputs = delivery.pricing_inputs
+
     def save(self, *args, **kwargs):
-        if self.pickup_lat and self.pickup_lng and self.dropoff_lat and self.dropoff_lng:
-            pickup = (self.pickup_lat, self.pickup_lng)
-            dropoff = (self.dropoff_lat, self.dropoff_lng)
-            self.distance_km = geodesic(pickup, dropoff).km
-            self.price = round(self.distance_km * 1.5, 2)
+        # Status-only updates keep the stored distance and price
+        if self.needs_pricing():
+            DeliveryRequest.populate_derived_fields([self])
         super().save(*args, **kwargs)
     
     def __str__(self):
         return f"DeliveryRequest #{self.id} - {self.customer.username} ({self.status})"
 
 
+class Tariff(models.Model):
+    """Price rule for one package type. Types without a tariff pay the default per-km rate."""
+    package_type = models.CharField(
+        max_length=30,
+        choices=DeliveryRequest.PACKAGE_TYPE_CHOICES,
+        unique=True
+    )
+    base_fare = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    price_per_km = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('1.50'))
+    minimum_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Tariff {self.package_type} ({self.price_per_km}/km)"
+
+
+class TariffDistanceBand(models.Model):
+    """Per-km rate applied to the part of a trip beyond ``from_km``."""
+    tariff = models.ForeignKey(
+        Tariff,
+        on_delete=models.CASCADE,
+        related_name='distance_bands'
+    )
+    from_km = models.FloatField(validators=[MinValueValidator(0)])
+    price_per_km = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        ordering = ['tariff', 'from_km']
+        constraints = [
+            models.UniqueConstraint(fields=['tariff', 'from_km'], name='unique_tariff_band_start'),
+        ]
+
+    def __str__(self):
+        return f"{self.tariff.package_type} from {self.from_km} km: {self.price_per_km}/km"
+
+
+class TariffSurcharge(models.Model):
+    """
+    Time-of-day multiplier for hours in [start_hour, end_hour), wrapping past
+    midnight when end_hour <= start_hour. Applies to every package type when
+    package_type is empty; overlapping surcharges use the largest multiplier.
+    Ignored while the package type only has inactive tariffs.
+    """
+    package_type = models.CharField(
+        max_length=30,
+        choices=DeliveryRequest.PACKAGE_TYPE_CHOICES,
+        blank=True,
+        null=True
+    )
+    start_hour = models.PositiveSmallIntegerField(validators=[MaxValueValidator(23)])
+    end_hour = models.PositiveSmallIntegerField(validators=[MaxValueValidator(24)])
+    multiplier = models.DecimalField(max_digits=5, decimal_places=2)
+
+    def __str__(self):
+        return f"x{self.multiplier} {self.start_hour:02d}-{self.end_hour:02d}h ({self.package_type or 'all'})"
+
+
 class Assignment(models.Model):
     ASSIGNED = 'ASSIGNED'
     ACCEPTED = 'ACCEPTED'
     REJECTED = 'REJECTED'
+    # Superseded by a newer assignment of the same delivery
+    CANCELLED = 'CANCELLED'
 
     STATUS_CHOICES = [
         (ASSIGNED, 'Assigned'),
         (ACCEPTED, 'Accepted'),
         (REJECTED, 'Rejected'),
+        (CANCELLED, 'Cancelled'),
     ]
 
     driver = models.ForeignKey(
@@ -140,6 +280,13 @@ class Assignment(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=ASSIGNED)
     rejection_reason = models.TextField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['driver', 'status'], name='assignment_driver_status'),
+            models.Index(fields=['delivery_request', 'status'], name='assignment_delivery_status'),
+            models.Index(fields=['assigned_at', 'id'], name='assignment_assigned_id'),
+        ]
+
     def __str__(self):
         return f"Assignment #{self.id} - Driver: {self.driver.username} for DeliveryRequest #{self.delivery_request.id}"
     
@@ -183,14 +330,26 @@ class Payment(models.Model):
         choices=PAYMENT_METHOD_CHOICES
     )
     
+    # Who reported transaction_id: a key of PAYMENT_WEBHOOK_SECRETS, or 'manual'
+    provider = models.CharField(max_length=30, blank=True, default='')
     transaction_id = models.CharField(max_length=255, blank=True, null=True)
     status = models.CharField(
         max_length=10,
         choices=STATUS_CHOICES,
-        default=PENDING
+        default=PENDING,
+        db_index=True
     )
     
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='payment_created_id'),
+        ]
+        constraints = [
+            # Deduplicates provider callbacks; NULL transaction ids never collide
+            models.UniqueConstraint(fields=['provider', 'transaction_id'], name='unique_payment_provider_transaction'),
+        ]
     
     def __str__(self):
         return f"Payment #{self.id} - {self.delivery_request.id} ({self.status})"
@@ -214,5 +373,188 @@ class Tracking(models.Model):
     longitude = models.FloatField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['delivery_request', 'timestamp'], name='tracking_delivery_time'),
+            models.Index(fields=['driver', 'timestamp'], name='tracking_driver_time'),
+            models.Index(fields=['timestamp', 'id'], name='tracking_timestamp_id'),
+        ]
+
+    def __str__(self):
+        return f"Tracking Update: Delivery #{self.delivery_request.id} by {self.driver.username} at {self.timestamp}"
+
+
+class OutboundEmail(models.Model):
+    """Queued email, delivered by the send_queued_mail worker."""
+    PENDING = 'PENDING'
+    SENDING = 'SENDING'
+    SENT = 'SENT'
+    FAILED = 'FAILED'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    # Bodies carrying credentials are cleared once the email is sent or given up on
+    sensitive = models.BooleanField(default=False)
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Earliest next delivery attempt; for SENDING rows, when the claim expires
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due'),
+        ]
+
+    def __str__(self):
+        return f"OutboundEmail #{self.id} to {', '.join(self.to)} ({self.status})"
+
+
+class DeliveryEvent(models.Model):
+    """
+    Append-only log of delivery lifecycle changes, written in the same
+    transaction as the change and drained by the dispatch_events worker.
+    """
+    ASSIGNMENT_CREATED = 'assignment.created'
+    ASSIGNMENT_ACCEPTED = 'assignment.accepted'
+    ASSIGNMENT_REJECTED = 'assignment.rejected'
+    DELIVERY_CREATED = 'delivery.created'
+    DELIVERY_UPDATED = 'delivery.updated'
+    DELIVERY_DELETED = 'delivery.deleted'
+    DELIVERY_COMPLETED = 'delivery.completed'
+    PAYMENT_UPDATED = 'payment.updated'
+
+    TYPE_CHOICES = [
+        (DELIVERY_CREATED, 'Delivery created'),
+        (DELIVERY_UPDATED, 'Delivery updated'),
+        (DELIVERY_DELETED, 'Delivery deleted'),
+        (ASSIGNMENT_CREATED, 'Assignment created'),
+        (ASSIGNMENT_ACCEPTED, 'Assignment accepted'),
+        (ASSIGNMENT_REJECTED, 'Assignment rejected'),
+        (DELIVERY_COMPLETED, 'Delivery completed'),
+        (PAYMENT_UPDATED, 'Payment updated'),
+    ]
+
+    event_type = models.CharField(max_length=40, choices=TYPE_CHOICES)
+    # Plain id rather than a foreign key: events outlive deleted deliveries
+    delivery_request_id = models.BigIntegerField()
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"DeliveryEvent #{self.id} {self.event_type} for DeliveryRequest #{self.delivery_request_id}"
+
+
+class EventConsumerOffset(models.Model):
+    """Id of the last DeliveryEvent a consumer has processed."""
+    consumer = models.CharField(max_length=50, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    # [first id, last id, skipped at (epoch seconds)] of gaps below last_event_id still watched for late commits
+    skipped = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.consumer} at event #{self.last_event_id}"
+
+
+class ReconciliationRun(models.Model):
+    """One pass of reconcile_payments; last_delivery_id is its resume checkpoint."""
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_delivery_id = models.BigIntegerField(default=0)
+    checked = models.BigIntegerField(default=0)
+    discrepancies = models.BigIntegerField(default=0)
+    # NDJSON file the discrepancies went to; empty when stored as PaymentDiscrepancy rows
+    output = models.CharField(max_length=255, blank=True)
+
+    def __str__(self):
+        return f"ReconciliationRun #{self.id} at delivery #{self.last_delivery_id} ({self.discrepancies} discrepancies)"
+
+
+class PaymentDiscrepancy(models.Model):
+    PAID_WITHOUT_PAYMENT = 'PAID_WITHOUT_PAYMENT'
+    PAYMENT_NOT_RECORDED = 'PAYMENT_NOT_RECORDED'
+    AMOUNT_MISMATCH = 'AMOUNT_MISMATCH'
+    DUPLICATE_PAYMENT = 'DUPLICATE_PAYMENT'
+
+    KIND_CHOICES = [
+        (PAID_WITHOUT_PAYMENT, 'Marked paid without a successful payment'),
+        (PAYMENT_NOT_RECORDED, 'Successful payment not marked paid'),
+        (AMOUNT_MISMATCH, 'Payment amount differs from price'),
+        (DUPLICATE_PAYMENT, 'Several successful payments'),
+    ]
+
+    run = models.ForeignKey(ReconciliationRun, on_delete=models.CASCADE, related_name='discrepancy_rows')
+    delivery_request_id = models.BigIntegerField()
+    payment_id = models.BigIntegerField(null=True, blank=True)
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    detail = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"{self.kind} on DeliveryRequest #{self.delivery_request_id} (run #{self.run_id})"
+
+
+class DeliveryRollupState(models.Model):
+    """
+    What the analytics rollups currently count for one delivery, so a change
+    can be applied as the difference from it (see api.utils.analytics).
+    """
+    delivery_request_id = models.BigIntegerField(primary_key=True)
+    day = models.DateField()
+    status = models.CharField(max_length=15)
+    package_type = models.CharField(max_length=30)
+    distance_km = models.FloatField(null=True, blank=True)
+    revenue = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    driver_id = models.BigIntegerField(null=True, blank=True)
+    completed_on = models.DateField(null=True, blank=True)
+
+    def __str__(self):
+        return f"DeliveryRequest #{self.delivery_request_id} counted as {self.status}"
+
+
+class DailyDeliveryRollup(models.Model):
+    """Deliveries booked on ``day`` by current status and package type."""
+    day = models.DateField()
+    status = models.CharField(max_length=15)
+    package_type = models.CharField(max_length=30)
+    deliveries = models.BigIntegerField(default=0)
+    # Sum and count of the deliveries that have a distance, for averages
+    distance_km = models.FloatField(default=0)
+    measured = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status', 'package_type'], name='unique_daily_delivery_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.status} {self.package_type}: {self.deliveries}"
+
+
+class DailyDriverRollup(models.Model):
+    """Deliveries each driver completed on ``day``."""
+    day = models.DateField()
+    driver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_rollups')
+    completed = models.BigIntegerField(default=0)
+    distance_km = models.FloatField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'driver'], name='unique_daily_driver_rollup'),
+        ]
+
     def __str__(self):
-        return f"Tracking Update: Delivery #{self.delivery_request.id} by {self.driver.username} at {self.timestamp}"
\ No newline at end of file
+        return f"{self.day} driver #{self.driver_id}: {self.completed}"
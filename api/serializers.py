@@ -4,8 +4,10 @@ from .models import DeliveryRequest, Assignment, Payment, Tracking
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import authenticate
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer as BaseTokenRefreshSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.tokens import default_token_generator
+from api.utils.revocation import RevocableRefreshToken
 User = get_user_model()
 
 # --------------------
@@ -64,12 +66,29 @@ class DeliveryRequestSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'distance_km', 'price', 'created_at', 'updated_at', 'customer']
 
 
+class DeliveryQuoteSerializer(serializers.ModelSerializer):
+    """Prices a prospective delivery request without saving it."""
+
+    class Meta:
+        model = DeliveryRequest
+        fields = [
+            'package_type', 'pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng',
+            'distance_km', 'price'
+        ]
+        read_only_fields = ['distance_km', 'price']
+
+    def create(self, validated_data):
+        delivery = DeliveryRequest(**validated_data)
+        DeliveryRequest.populate_derived_fields([delivery])
+        return delivery
+
+
 # --------------------
 # Assignment Serializer
 # --------------------
 class AssignmentSerializer(serializers.ModelSerializer):
     driver_name = serializers.CharField(source='driver.username', read_only=True)
-    delivery_request_id = serializers.IntegerField(source='delivery_request.id', read_only=True)
+    delivery_request_id = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Assignment
@@ -85,8 +104,9 @@ class AssignmentSerializer(serializers.ModelSerializer):
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
-        fields = ['id', 'delivery_request', 'amount', 'currency', 'payment_method', 'transaction_id', 'status', 'created_at']
-        read_only_fields = ['id', 'status', 'transaction_id', 'created_at']
+        fields = ['id', 'delivery_request', 'amount', 'currency', 'payment_method', 'provider', 'transaction_id',
+                  'status', 'created_at']
+        read_only_fields = ['id', 'status', 'provider', 'transaction_id', 'created_at']
 
     def create(self, validated_data):
         payment = Payment.objects.create(**validated_data)
@@ -107,6 +127,79 @@ class TrackingSerializer(serializers.ModelSerializer):
         fields = ['id', 'delivery_request', 'driver', 'latitude', 'longitude', 'timestamp']
         read_only_fields = ['id', 'timestamp']
 
+    def validate(self, attrs):
+        request = self.context.get('request')
+        if request is not None and attrs['driver'].id != request.user.id:
+            raise serializers.ValidationError({'driver': ["You can only report your own position."]})
+        if not _active_pairs({(attrs['driver'].id, attrs['delivery_request'].id)}):
+            raise serializers.ValidationError(
+                {'delivery_request': ["This delivery is not actively assigned to this driver."]}
+            )
+        return attrs
+
+
+def _active_pairs(pairs):
+    """The (driver, delivery request) pairs among ``pairs`` backed by an open assignment, in one query."""
+    driver_ids = {driver_id for driver_id, _ in pairs}
+    delivery_ids = {delivery_id for _, delivery_id in pairs}
+    return set(
+        Assignment.objects.filter(
+            driver_id__in=driver_ids, delivery_request_id__in=delivery_ids,
+            status__in=[Assignment.ASSIGNED, Assignment.ACCEPTED],
+        ).values_list('driver_id', 'delivery_request_id')
+    ) & set(pairs)
+
+
+# Upper bound on points accepted by a single bulk tracking call
+TRACKING_BULK_MAX_POINTS = 1000
+
+
+class TrackingPointSerializer(serializers.Serializer):
+    delivery_request = serializers.IntegerField()
+    driver = serializers.IntegerField()
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+
+
+class TrackingBulkSerializer(serializers.Serializer):
+    """
+    Batch of buffered GPS fixes from the calling driver. The (driver,
+    delivery request) pairs are checked against open assignments with one
+    query per batch instead of once per point, and the rows are written with
+    a single bulk_create.
+    """
+    points = TrackingPointSerializer(many=True, allow_empty=False, max_length=TRACKING_BULK_MAX_POINTS)
+
+    def validate(self, attrs):
+        points = attrs['points']
+        request = self.context.get('request')
+        active = _active_pairs({(point['driver'], point['delivery_request']) for point in points})
+
+        errors = []
+        for point in points:
+            point_errors = {}
+            if request is not None and point['driver'] != request.user.id:
+                point_errors['driver'] = ["You can only report your own position."]
+            elif (point['driver'], point['delivery_request']) not in active:
+                point_errors['delivery_request'] = ["This delivery is not actively assigned to this driver."]
+            errors.append(point_errors)
+
+        if any(errors):
+            raise serializers.ValidationError({'points': errors})
+        return attrs
+
+    def create(self, validated_data):
+        points = [
+            Tracking(
+                delivery_request_id=point['delivery_request'],
+                driver_id=point['driver'],
+                latitude=point['latitude'],
+                longitude=point['longitude'],
+            )
+            for point in validated_data['points']
+        ]
+        return Tracking.objects.bulk_create(points)
+
 # --------------------
 # Auth Serializer
 # --------------------
@@ -171,7 +264,7 @@ class CustomTokenObtainPairSerializer(serializers.Serializer):
             raise serializers.ValidationError("User account is disabled.")
 
         # Generate tokens manually
-        refresh = RefreshToken.for_user(user)
+        refresh = RevocableRefreshToken.for_user(user)
         return {
             'refresh': str(refresh),
             'access': str(refresh.access_token),
@@ -181,7 +274,13 @@ class CustomTokenObtainPairSerializer(serializers.Serializer):
                 'email': user.email
             }
         }
-        
+
+
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    # Checks the blacklist through the revocation registry's Bloom filter
+    token_class = RevocableRefreshToken
+
+
 class LogoutSerializer(serializers.Serializer):
     refresh = serializers.CharField()
 
@@ -191,7 +290,7 @@ class LogoutSerializer(serializers.Serializer):
 
     def save(self, **kwargs):
         try:
-            token = RefreshToken(self.token)
+            token = RevocableRefreshToken(self.token)
             token.blacklist()
         except Exception as e:
             raise serializers.ValidationError("Invalid or expired token")
@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.models import Tariff, TariffDistanceBand, TariffSurcharge, User
+from api.utils import pricing
+from api.utils.authentication import user_cache
+
+
+@receiver([post_save, post_delete], sender=Tariff)
+@receiver([post_save, post_delete], sender=TariffDistanceBand)
+@receiver([post_save, post_delete], sender=TariffSurcharge)
+def invalidate_pricing(sender, **kwargs):
+    pricing.invalidate()
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Covers role changes, deactivation and password changes; queryset
+    # update() bypasses signals and is only picked up when the TTL expires.
+    user_cache.invalidate_on_commit(str(instance.pk))
@@ -1,3 +1,1659 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import hmac
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import permutations
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import IntegrityError, OperationalError, connection
+from django.db.models import Max
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.serializers import ListSerializer, Serializer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import (
+    User, DeliveryRequest, Assignment, Payment, Tracking, OutboundEmail, DeliveryEvent, ReconciliationRun,
+    PaymentDiscrepancy, DailyDeliveryRollup, DailyDriverRollup, EventConsumerOffset, Tariff, TariffDistanceBand,
+    TariffSurcharge,
+)
+from .serializers import UserSerializer
+from .utils import (
+    analytics, batch_dispatch, benchmark, dispatch, distance, eta, events, exporter, geohash, importer, live, mailer,
+    metrics, nearby, payments, pricing, reconciliation, revocation, routing, state_machine, tracking_cache,
+)
+from .utils.authentication import CachedJWTAuthentication, user_cache
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Endpoints must run a bounded number of queries whatever the size of the
+    result. Each test fails if the budget is exceeded, and list endpoints are
+    checked again after adding more rows to catch N+1 regressions.
+    """
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        # Savepoints stand in for the BEGIN/COMMIT of a real request; they are not counted
+        captured = [query for query in context.captured_queries if 'SAVEPOINT' not in query['sql']]
+        executed = len(captured)
+        if executed > budget:
+            queries = '\n'.join(query['sql'] for query in captured)
+            self.fail(f"{executed} queries executed, budget is {budget}:\n{queries}")
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@orion.test', password='pw', role=User.ADMIN, is_staff=True
+        )
+        cls.customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        cls.other_customer = User.objects.create_user(username='other', email='other@orion.test', password='pw')
+        cls.driver = User.objects.create_user(
+            username='driver', email='driver@orion.test', password='pw', role=User.DRIVER
+        )
+        cls.add_deliveries(5)
+
+    @classmethod
+    def add_deliveries(cls, count):
+        deliveries = [
+            DeliveryRequest(
+                customer=cls.customer if index % 2 else cls.other_customer,
+                pickup_address='Pickup', dropoff_address='Dropoff',
+                pickup_lat=-1.95 + index * 0.001, pickup_lng=30.06,
+                dropoff_lat=-1.94, dropoff_lng=30.07 + index * 0.001,
+            )
+            for index in range(count)
+        ]
+        DeliveryRequest.populate_derived_fields(deliveries)
+        deliveries = DeliveryRequest.objects.bulk_create(deliveries)
+        Assignment.objects.bulk_create([
+            Assignment(delivery_request=delivery, driver=cls.driver, status=Assignment.ACCEPTED)
+            for delivery in deliveries
+        ])
+        Payment.objects.bulk_create([
+            Payment(delivery_request=delivery, amount=delivery.price, payment_method=Payment.CARD)
+            for delivery in deliveries
+        ])
+        Tracking.objects.bulk_create([
+            Tracking(delivery_request=delivery, driver=cls.driver, latitude=-1.95, longitude=30.06)
+            for delivery in deliveries
+        ])
+        return deliveries
+
+    def assertListBudget(self, user, url, budget):
+        client = self.client_for(user)
+        with self.assertMaxQueries(budget) as small:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        self.add_deliveries(20)
+        with self.assertMaxQueries(budget) as large:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_delivery_list_admin(self):
+        self.assertListBudget(self.admin, '/api/delivery-requests/', 1)
+
+    def test_delivery_list_customer(self):
+        self.assertListBudget(self.customer, '/api/delivery-requests/', 1)
+
+    def test_delivery_list_driver(self):
+        self.assertListBudget(self.driver, '/api/delivery-requests/', 1)
+
+    def test_delivery_detail_driver(self):
+        delivery = Assignment.objects.filter(driver=self.driver).first().delivery_request
+        with self.assertMaxQueries(1):
+            response = self.client_for(self.driver).get(f'/api/delivery-requests/{delivery.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_delivery_detail_customer(self):
+        delivery = DeliveryRequest.objects.filter(customer=self.customer).first()
+        with self.assertMaxQueries(1):
+            response = self.client_for(self.customer).get(f'/api/delivery-requests/{delivery.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_delivery_detail_other_customer_is_hidden(self):
+        delivery = DeliveryRequest.objects.filter(customer=self.other_customer).first()
+        response = self.client_for(self.customer).get(f'/api/delivery-requests/{delivery.id}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_payment_list(self):
+        self.assertListBudget(self.admin, '/api/payments/', 1)
+
+    def test_payment_list_customer(self):
+        self.assertListBudget(self.customer, '/api/payments/', 1)
+        self.assertSeesOwnDeliveries('/api/payments/')
+
+    def test_payment_list_driver(self):
+        self.assertListBudget(self.driver, '/api/payments/', 1)
+
+    def test_payment_detail_other_customer_is_hidden(self):
+        payment = Payment.objects.filter(delivery_request__customer=self.other_customer).first()
+        response = self.client_for(self.customer).get(f'/api/payments/{payment.id}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_tracking_list(self):
+        self.assertListBudget(self.admin, '/api/tracking/', 1)
+
+    def test_tracking_list_customer(self):
+        self.assertListBudget(self.customer, '/api/tracking/', 1)
+        self.assertSeesOwnDeliveries('/api/tracking/')
+
+    def test_tracking_list_driver(self):
+        self.assertListBudget(self.driver, '/api/tracking/', 1)
+
+    def test_unassigned_driver_sees_no_payments_or_tracking(self):
+        idle = User.objects.create_user(username='idle', email='idle@orion.test', password='pw', role=User.DRIVER)
+        client = self.client_for(idle)
+        for url in ('/api/payments/', '/api/tracking/'):
+            self.assertEqual(client.get(url).json()['results'], [])
+
+    def assertSeesOwnDeliveries(self, url):
+        response = self.client_for(self.customer).get(f'{url}?page_size=500')
+        delivery_ids = {row['delivery_request'] for row in response.json()['results']}
+        self.assertEqual(delivery_ids, set(
+            DeliveryRequest.objects.filter(customer=self.customer).values_list('id', flat=True)
+        ))
+
+    def test_assignment_list(self):
+        self.assertListBudget(self.admin, '/api/assignments/', 1)
+
+    def test_assignment_list_driver(self):
+        self.assertListBudget(self.driver, '/api/assignments/', 1)
+
+    def test_assignment_list_customer(self):
+        self.assertListBudget(self.customer, '/api/assignments/', 1)
+        response = self.client_for(self.customer).get('/api/assignments/?page_size=500')
+        delivery_ids = {row['delivery_request'] for row in response.json()['results']}
+        self.assertEqual(delivery_ids, set(
+            DeliveryRequest.objects.filter(customer=self.customer).values_list('id', flat=True)
+        ))
+
+    def test_user_list(self):
+        self.assertListBudget(self.admin, '/api/users/', 1)
+
+    def test_accept_assignment(self):
+        assignment = Assignment.objects.filter(driver=self.driver).first()
+        Assignment.objects.filter(pk=assignment.pk).update(status=Assignment.ASSIGNED)
+        DeliveryRequest.objects.filter(pk=assignment.delivery_request_id).update(status=DeliveryRequest.ASSIGNED)
+        with self.assertMaxQueries(4):
+            response = self.client_for(self.driver).patch(f'/api/assignments/{assignment.id}/accept/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_complete_assignment(self):
+        assignment = Assignment.objects.filter(driver=self.driver).first()
+        DeliveryRequest.objects.filter(pk=assignment.delivery_request_id).update(status=DeliveryRequest.IN_PROGRESS)
+        with self.assertMaxQueries(4):
+            response = self.client_for(self.driver).patch(f'/api/assignments/{assignment.id}/complete/')
+        self.assertEqual(response.status_code, 200)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.admin = User.objects.create_user(
+            username='admin', email='admin@orion.test', password='pw', role=User.ADMIN, is_staff=True
+        )
+
+    def test_histogram_percentiles_within_bucket_precision(self):
+        histogram = metrics.Histogram(scale=1_000_000)
+        values = [index / 1000 for index in range(1, 10001)]
+        for value in values:
+            histogram.record(value)
+        for quantile in metrics.QUANTILES:
+            expected = values[int(quantile * len(values)) - 1]
+            self.assertAlmostEqual(histogram.percentile(quantile), expected, delta=expected / metrics.SUB_BUCKETS)
+
+    def test_metrics_endpoint_reports_routes(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        client.get('/api/delivery-requests/')
+
+        response = client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('orion_request_duration_seconds_count{view="deliveryrequest-list",method="GET"} 1', body)
+        self.assertIn('orion_db_queries_sum{view="deliveryrequest-list",method="GET"} 1', body)
+        self.assertIn('orion_requests_total{view="deliveryrequest-list",method="GET",status="200"} 1', body)
+
+    def test_serializer_time_is_recorded_per_view(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        client.get('/api/users/')
+        client.get(f'/api/users/{self.admin.id}/')
+
+        body = client.get('/api/metrics/').content.decode()
+        self.assertIn('orion_serializer_duration_seconds_count{view="user-list",method="GET"} 1', body)
+        self.assertIn('orion_serializer_duration_seconds_count{view="user-detail",method="GET"} 1', body)
+
+    def test_timed_serializer_output_is_unchanged(self):
+        timed = metrics.timed_serializer(UserSerializer)
+        self.assertEqual(timed(self.admin).data, UserSerializer(self.admin).data)
+        self.assertEqual(timed([self.admin], many=True).data, UserSerializer([self.admin], many=True).data)
+        self.assertEqual(timed.__name__, 'UserSerializer')
+        self.assertIs(metrics.timed_serializer(UserSerializer), timed)
+
+        spent = [0.0]
+        token = metrics.serializer_time.set(spent)
+        try:
+            timed([self.admin], many=True).data
+        finally:
+            metrics.serializer_time.reset(token)
+        self.assertGreater(spent[0], 0)
+
+    def test_drf_serializers_are_not_patched(self):
+        spent = [0.0]
+        token = metrics.serializer_time.set(spent)
+        try:
+            UserSerializer(self.admin).data
+            UserSerializer([self.admin], many=True).data
+        finally:
+            metrics.serializer_time.reset(token)
+        self.assertEqual(spent, [0.0])
+        self.assertEqual(Serializer.__dict__['data'].fget.__module__, 'rest_framework.serializers')
+        self.assertEqual(ListSerializer.__dict__['data'].fget.__module__, 'rest_framework.serializers')
+
+    def test_metrics_endpoint_is_admin_only(self):
+        customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        client = APIClient()
+        client.force_authenticate(customer)
+        self.assertEqual(client.get('/api/metrics/').status_code, 403)
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(
+            username='driver', email='driver@orion.test', password='pw', role=User.DRIVER
+        )
+        self.request = RequestFactory().get(
+            '/api/delivery-requests/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}'
+        )
+        self.backend = CachedJWTAuthentication()
+
+    def test_repeated_requests_skip_the_user_query(self):
+        with self.assertNumQueries(1):
+            self.backend.authenticate(self.request)
+        with self.assertNumQueries(0):
+            user, _ = self.backend.authenticate(self.request)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_cached_user_is_a_copy(self):
+        first, _ = self.backend.authenticate(self.request)
+        first.role = User.ADMIN
+        second, _ = self.backend.authenticate(self.request)
+        self.assertEqual(second.role, User.DRIVER)
+
+    def test_role_change_invalidates(self):
+        self.backend.authenticate(self.request)
+        self.user.role = User.ADMIN
+        self.user.save()
+        user, _ = self.backend.authenticate(self.request)
+        self.assertEqual(user.role, User.ADMIN)
+
+    def test_deactivation_invalidates(self):
+        self.backend.authenticate(self.request)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.backend.authenticate(self.request)
+
+
+class RevocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='customer', email='customer@orion.test', password='pw', role=User.CUSTOMER
+        )
+        self.registry = revocation.RevocationRegistry(capacity=1000, sync_interval=3600)
+
+    def test_unrevoked_token_needs_no_query(self):
+        for _ in range(50):
+            revocation.RevocableRefreshToken.for_user(self.user).blacklist()
+        token = revocation.RevocableRefreshToken.for_user(self.user)
+        self.registry.sync(force=True)
+        with self.assertNumQueries(0):
+            self.assertFalse(self.registry.is_revoked(token['jti']))
+
+    def test_revoked_token_is_confirmed(self):
+        token = revocation.RevocableRefreshToken.for_user(self.user)
+        token.blacklist()
+        self.registry.sync(force=True)
+        self.assertTrue(self.registry.is_revoked(token['jti']))
+
+    def test_refresh_after_logout_is_rejected(self):
+        refresh = str(revocation.RevocableRefreshToken.for_user(self.user))
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.post('/api/token/refresh/', {'refresh': refresh}, format='json').status_code, 200)
+        self.assertEqual(client.post('/api/logout/', {'refresh': refresh}, format='json').status_code, 200)
+        self.assertEqual(client.post('/api/token/refresh/', {'refresh': refresh}, format='json').status_code, 401)
+
+    def test_purge_expired_keeps_live_tokens(self):
+        live = revocation.RevocableRefreshToken.for_user(self.user)
+        live.blacklist()
+        expired = revocation.RevocableRefreshToken.for_user(self.user)
+        expired.blacklist()
+        OutstandingToken.objects.filter(jti=expired['jti']).update(expires_at=timezone.now() - timedelta(days=1))
+        deleted = revocation.purge_expired(batch_size=1)
+        self.assertEqual(deleted, {'outstanding': 1, 'blacklisted': 1})
+        self.assertEqual(list(BlacklistedToken.objects.values_list('token__jti', flat=True)), [live['jti']])
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError("mail server unavailable")
+
+
+class MailerTests(TestCase):
+    def setUp(self):
+        User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+
+    def test_forgot_password_only_enqueues(self):
+        response = APIClient().post('/api/forgot-password/', {'email': 'customer@orion.test'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.to, email.status), (['customer@orion.test'], OutboundEmail.PENDING))
+
+    def test_worker_sends_batch(self):
+        for index in range(3):
+            mailer.enqueue('Subject', f'Body {index}', ['customer@orion.test'])
+        self.assertEqual(mailer.send_batch(), {'sent': 3, 'retrying': 0, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.SENT).count(), 3)
+        self.assertEqual(mailer.send_batch(), {'sent': 0, 'retrying': 0, 'failed': 0})
+
+    def test_temporary_password_is_wiped_after_sending(self):
+        APIClient().post('/api/forgot-password/', {'email': 'customer@orion.test'}, format='json')
+        self.assertIn('temporary password', OutboundEmail.objects.get().body)
+        mailer.send_batch()
+        self.assertIn('temporary password', mail.outbox[0].body)
+        self.assertEqual(OutboundEmail.objects.get().body, '')
+
+    @override_settings(EMAIL_BACKEND='api.tests.FailingEmailBackend')
+    def test_failures_back_off_then_fail(self):
+        email = mailer.enqueue('Subject', 'Body', ['customer@orion.test'])
+        self.assertEqual(mailer.send_batch(), {'sent': 0, 'retrying': 1, 'failed': 0})
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        # Not due again until the backoff has passed
+        self.assertEqual(mailer.send_batch(), {'sent': 0, 'retrying': 0, 'failed': 0})
+
+        OutboundEmail.objects.update(attempts=mailer.MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+        self.assertEqual(mailer.send_batch(), {'sent': 0, 'retrying': 0, 'failed': 1})
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.FAILED)
+        self.assertIn('mail server unavailable', email.last_error)
+
+
+class EventOutboxTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.driver = User.objects.create_user(
+            username='driver', email='driver@orion.test', password='pw', role=User.DRIVER
+        )
+        self.delivery = DeliveryRequest.objects.create(
+            customer=self.customer, pickup_address='Pickup', dropoff_address='Dropoff',
+            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07,
+            status=DeliveryRequest.ASSIGNED,
+        )
+        self.assignment = Assignment.objects.create(delivery_request=self.delivery, driver=self.driver)
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def test_transitions_record_events_in_order(self):
+        self.client.patch(f'/api/assignments/{self.assignment.id}/accept/')
+        self.client.patch(f'/api/assignments/{self.assignment.id}/complete/')
+        self.assertEqual(
+            list(DeliveryEvent.objects.order_by('id').values_list('event_type', 'payload__status')),
+            [(DeliveryEvent.ASSIGNMENT_ACCEPTED, DeliveryRequest.IN_PROGRESS),
+             (DeliveryEvent.DELIVERY_COMPLETED, DeliveryRequest.COMPLETED)],
+        )
+
+    def test_dispatch_advances_offset_only_after_sink(self):
+        for _ in range(3):
+            events.record_event(DeliveryEvent.PAYMENT_UPDATED, self.delivery.id, payment_status='SUCCESS')
+        received = []
+
+        def failing(batch):
+            raise ConnectionError("sink down")
+
+        with self.assertRaises(ConnectionError):
+            events.dispatch('test', failing, batch_size=2)
+        self.assertEqual(events.dispatch('test', received.extend, batch_size=2), 2)
+        self.assertEqual(events.dispatch('test', received.extend, batch_size=2), 1)
+        self.assertEqual(events.dispatch('test', received.extend, batch_size=2), 0)
+        self.assertEqual([event.id for event in received], sorted(event.id for event in received))
+        self.assertEqual(len(received), 3)
+
+    def test_recent_gap_holds_back_later_events(self):
+        first = events.record_event(DeliveryEvent.PAYMENT_UPDATED, self.delivery.id)
+        second = events.record_event(DeliveryEvent.PAYMENT_UPDATED, self.delivery.id)
+        later = events.record_event(DeliveryEvent.PAYMENT_UPDATED, self.delivery.id)
+        # As if the second insert had not committed yet
+        second.delete()
+        self.assertEqual(events.pending(first.id - 1, now=later.created_at), [first])
+        horizon = later.created_at + timedelta(seconds=events.GAP_TIMEOUT + 1)
+        self.assertEqual(events.pending(first.id - 1, now=horizon), [first, later])
+
+    def test_late_commit_inside_a_skipped_gap_is_delivered(self):
+        first, second, third = [events.record_event(DeliveryEvent.PAYMENT_UPDATED, self.delivery.id) for _ in range(3)]
+        missing = second.id
+        second.delete()
+        DeliveryEvent.objects.update(created_at=timezone.now() - timedelta(seconds=events.GAP_TIMEOUT + 1))
+        received = []
+        self.assertEqual(events.dispatch('test', received.extend), 2)
+        offset = EventConsumerOffset.objects.get(consumer='test')
+        self.assertEqual(offset.last_event_id, third.id)
+        self.assertEqual([gap[:2] for gap in offset.skipped], [[missing, missing]])
+
+        # The long transaction commits after the offset moved past it
+        DeliveryEvent.objects.create(id=missing, event_type=DeliveryEvent.PAYMENT_UPDATED,
+                                     delivery_request_id=self.delivery.id)
+        self.assertEqual(events.dispatch('test', received.extend), 1)
+        self.assertEqual([event.id for event in received], [first.id, third.id, missing])
+        self.assertEqual(EventConsumerOffset.objects.get(consumer='test').skipped, [])
+        self.assertEqual(events.dispatch('test', received.extend), 0)
+
+    def test_old_gaps_are_given_up(self):
+        EventConsumerOffset.objects.create(consumer='test', last_event_id=10,
+                                           skipped=[[4, 6, time.time() - events.GAP_RETENTION - 1]])
+        self.assertEqual(events.dispatch('test', list), 0)
+        self.assertEqual(EventConsumerOffset.objects.get(consumer='test').skipped, [])
+
+
+class StaleAssignmentTests(TestCase):
+    def setUp(self):
+        customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.first, self.second = [
+            User.objects.create_user(username=name, email=f'{name}@orion.test', password='pw', role=User.DRIVER)
+            for name in ('first', 'second')
+        ]
+        self.delivery = DeliveryRequest.objects.create(
+            customer=customer, pickup_address='Pickup', dropoff_address='Dropoff',
+            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07,
+        )
+        self.stale = state_machine.assign(self.delivery.id, self.first.id)
+
+    def reassign(self):
+        DeliveryRequest.objects.filter(pk=self.delivery.pk).update(status=DeliveryRequest.CANCELLED)
+        return state_machine.assign(self.delivery.id, self.second.id, state_machine.ADMIN_ASSIGNABLE)
+
+    def test_reassign_closes_earlier_assignments(self):
+        state_machine.accept(self.stale)
+        current = self.reassign()
+        self.assertEqual(Assignment.objects.get(pk=self.stale.pk).status, Assignment.CANCELLED)
+        with self.assertRaises(state_machine.IllegalTransition):
+            state_machine.complete(self.stale)
+        state_machine.accept(current)
+        state_machine.complete(current)
+        self.assertEqual(DeliveryRequest.objects.get(pk=self.delivery.pk).status, DeliveryRequest.COMPLETED)
+
+    def test_stale_driver_cannot_accept(self):
+        self.reassign()
+        with self.assertRaises(state_machine.IllegalTransition):
+            state_machine.accept(self.stale)
+        self.assertEqual(DeliveryRequest.objects.get(pk=self.delivery.pk).status, DeliveryRequest.ASSIGNED)
+
+    def test_only_newest_assignment_moves_the_delivery(self):
+        # Open assignments left behind by older code are still refused
+        Assignment.objects.create(delivery_request=self.delivery, driver=self.second)
+        with self.assertRaises(state_machine.IllegalTransition):
+            state_machine.accept(self.stale)
+        Assignment.objects.filter(pk=self.stale.pk).update(status=Assignment.ACCEPTED)
+        DeliveryRequest.objects.filter(pk=self.delivery.pk).update(status=DeliveryRequest.IN_PROGRESS)
+        with self.assertRaises(state_machine.IllegalTransition):
+            state_machine.complete(self.stale)
+
+
+class ConcurrentTransitionTests(TransactionTestCase):
+    """
+    Fires conflicting transitions from many threads, each on its own
+    connection. Every race must have exactly one winner and leave the
+    assignment, the delivery and the event log consistent.
+    """
+    THREADS = 8
+    ROUNDS = 20
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.drivers = [
+            User.objects.create_user(username=f'driver{i}', email=f'driver{i}@orion.test', password='pw',
+                                     role=User.DRIVER)
+            for i in range(self.THREADS)
+        ]
+
+    def hammer(self, calls):
+        """Run the calls concurrently; returns True for each that won and False for each IllegalTransition."""
+        start = threading.Barrier(min(len(calls), self.THREADS))
+
+        def run(call):
+            try:
+                start.wait(timeout=5)
+            except threading.BrokenBarrierError:
+                pass
+            try:
+                # Lock timeouts and deadlocks are retried like a client would
+                for attempt in range(50):
+                    try:
+                        call()
+                        return True
+                    except OperationalError:
+                        time.sleep(0.01 * (attempt + 1))
+                raise AssertionError("transition kept failing with lock errors")
+            except state_machine.IllegalTransition:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            return list(pool.map(run, calls))
+
+    def create_delivery(self, status, assignment_status=None, driver=None):
+        delivery = DeliveryRequest.objects.create(
+            customer=self.customer, pickup_address='Pickup', dropoff_address='Dropoff',
+            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07, status=status,
+        )
+        if assignment_status is None:
+            return delivery, None
+        assignment = Assignment.objects.create(
+            delivery_request=delivery, driver=driver or self.drivers[0], status=assignment_status
+        )
+        return delivery, assignment
+
+    def test_accept_and_reject_race(self):
+        for _ in range(self.ROUNDS):
+            delivery, assignment = self.create_delivery(DeliveryRequest.ASSIGNED, Assignment.ASSIGNED)
+            calls = [lambda: state_machine.accept(assignment), lambda: state_machine.reject(assignment, 'Too far')]
+            results = self.hammer(calls * (self.THREADS // 2))
+            self.assertEqual(results.count(True), 1)
+
+            assignment.refresh_from_db()
+            delivery.refresh_from_db()
+            expected = {Assignment.ACCEPTED: DeliveryRequest.IN_PROGRESS, Assignment.REJECTED: DeliveryRequest.PENDING}
+            self.assertEqual(delivery.status, expected[assignment.status])
+        self.assertEqual(DeliveryEvent.objects.count(), self.ROUNDS)
+
+    def test_concurrent_assignment_has_one_winner(self):
+        for _ in range(self.ROUNDS):
+            delivery, _ = self.create_delivery(DeliveryRequest.PENDING)
+            results = self.hammer([
+                lambda driver=driver: state_machine.assign(delivery.id, driver.id) for driver in self.drivers
+            ])
+            self.assertEqual(results.count(True), 1)
+            self.assertEqual(Assignment.objects.filter(delivery_request=delivery).count(), 1)
+
+    def test_repeated_complete_counts_once(self):
+        for _ in range(self.ROUNDS):
+            delivery, assignment = self.create_delivery(DeliveryRequest.IN_PROGRESS, Assignment.ACCEPTED)
+            results = self.hammer([lambda: state_machine.complete(assignment)] * self.THREADS)
+            self.assertEqual(results.count(True), 1)
+            delivery.refresh_from_db()
+            self.assertEqual(delivery.status, DeliveryRequest.COMPLETED)
+        self.assertEqual(DeliveryEvent.objects.filter(event_type=DeliveryEvent.DELIVERY_COMPLETED).count(), self.ROUNDS)
+
+
+class PaymentWebhookTests(TestCase):
+    def setUp(self):
+        self.secrets, payments.SECRETS = payments.SECRETS, {'acme': 'secret'}
+        customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.deliveries = DeliveryRequest.objects.bulk_create([
+            DeliveryRequest(customer=customer, pickup_address='Pickup', dropoff_address='Dropoff',
+                            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07)
+            for _ in range(3)
+        ])
+        Payment.objects.bulk_create([
+            Payment(delivery_request=delivery, amount=10, payment_method=Payment.CARD) for delivery in self.deliveries
+        ])
+        self.payments = list(Payment.objects.order_by('id'))
+
+    def tearDown(self):
+        payments.SECRETS = self.secrets
+
+    def post(self, payload, secret='secret'):
+        body = json.dumps(payload).encode()
+        signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return APIClient().post('/api/webhooks/payments/acme/', body, content_type='application/json',
+                                HTTP_X_WEBHOOK_SIGNATURE=signature)
+
+    def batch(self, status=Payment.SUCCESS):
+        return {'events': [
+            {'payment_id': payment.id, 'transaction_id': f'tx-{payment.id}', 'status': status}
+            for payment in self.payments
+        ]}
+
+    def test_bad_signature_is_refused(self):
+        self.assertEqual(self.post(self.batch(), secret='wrong').status_code, 403)
+        self.assertFalse(Payment.objects.filter(status=Payment.SUCCESS).exists())
+
+    def test_batch_is_applied_once(self):
+        with self.assertNumQueries(7):
+            response = self.post(self.batch())
+        self.assertEqual(response.json(), {'applied': 3, 'duplicates': 0, 'ignored': 0})
+        self.assertEqual(DeliveryRequest.objects.filter(is_paid=True).count(), 3)
+        self.assertEqual(DeliveryEvent.objects.count(), 3)
+
+        # A retry reads the payments and writes nothing
+        with self.assertNumQueries(2):
+            response = self.post(self.batch())
+        self.assertEqual(response.json(), {'applied': 0, 'duplicates': 3, 'ignored': 0})
+        self.assertEqual(DeliveryEvent.objects.count(), 3)
+
+    def test_illegal_transitions_are_ignored(self):
+        self.post(self.batch())
+        response = self.post({'payment_id': self.payments[0].id, 'transaction_id': 'tx-late', 'status': Payment.FAILED})
+        self.assertEqual(response.json(), {'applied': 0, 'duplicates': 0, 'ignored': 1})
+        self.assertEqual(Payment.objects.get(pk=self.payments[0].pk).status, Payment.SUCCESS)
+
+    def test_transaction_id_of_another_payment_is_ignored(self):
+        first, second = self.payments[:2]
+        self.post({'payment_id': first.id, 'transaction_id': 'tx-1', 'status': Payment.FAILED})
+        response = self.post({'payment_id': second.id, 'transaction_id': 'tx-1', 'status': Payment.SUCCESS})
+        self.assertEqual(response.json()['ignored'], 1)
+        self.assertEqual(Payment.objects.get(pk=second.pk).status, Payment.PENDING)
+
+    def test_status_must_be_a_string(self):
+        response = self.post({'payment_id': self.payments[0].id, 'transaction_id': 'tx-1', 'status': {'a': 1}})
+        self.assertEqual(response.status_code, 400)
+
+    def test_concurrent_insert_counts_as_duplicate(self):
+        apply = payments._apply_callbacks
+
+        def raced(provider, callbacks):
+            # An identical retry commits first and our UPDATE hits the unique constraint
+            payments._apply_callbacks = apply
+            apply(provider, callbacks)
+            raise IntegrityError('Duplicate entry')
+
+        payments._apply_callbacks = raced
+        try:
+            response = self.post(self.batch())
+        finally:
+            payments._apply_callbacks = apply
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'applied': 0, 'duplicates': 3, 'ignored': 0})
+        self.assertEqual(DeliveryEvent.objects.count(), 3)
+
+    def test_manual_status_keeps_its_old_contract(self):
+        admin = User.objects.create_user(
+            username='admin', email='admin@orion.test', password='pw', role=User.ADMIN, is_staff=True
+        )
+        client = APIClient()
+        client.force_authenticate(admin)
+        payment = self.payments[0]
+        url = f'/api/payments/{payment.id}/status/'
+
+        self.assertEqual(client.patch(url, {'status': Payment.SUCCESS}, format='json').status_code, 200)
+        self.assertTrue(DeliveryRequest.objects.get(pk=payment.delivery_request_id).is_paid)
+        # Any transition, back to PENDING included, and no transaction id needed
+        self.assertEqual(client.patch(url, {'status': Payment.PENDING}, format='json').status_code, 200)
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, Payment.PENDING)
+        self.assertFalse(DeliveryRequest.objects.get(pk=payment.delivery_request_id).is_paid)
+
+        response = client.patch(url, {'status': ['SUCCESS']}, format='json')
+        self.assertEqual(response.json(), {'error': 'Invalid status'})
+        response = client.patch(url, {'status': Payment.SUCCESS, 'transaction_id': 'tx-1'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.patch(f'/api/payments/{self.payments[2].id}/status/',
+                                      {'status': Payment.SUCCESS, 'transaction_id': 'tx-1'}, format='json').status_code,
+                         400)
+
+
+class ReconciliationTests(TestCase):
+    def setUp(self):
+        customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.deliveries = DeliveryRequest.objects.bulk_create([
+            DeliveryRequest(customer=customer, pickup_address='Pickup', dropoff_address='Dropoff', price=10,
+                            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07)
+            for _ in range(6)
+        ])
+        ok, unpaid_flag, no_payment, wrong_amount, twice, pending = self.deliveries
+        DeliveryRequest.objects.filter(pk__in=[ok.pk, no_payment.pk, wrong_amount.pk, twice.pk]).update(is_paid=True)
+        Payment.objects.bulk_create([
+            Payment(delivery_request=ok, amount=10, status=Payment.SUCCESS),
+            Payment(delivery_request=unpaid_flag, amount=10, status=Payment.SUCCESS),
+            Payment(delivery_request=wrong_amount, amount=8, status=Payment.SUCCESS),
+            Payment(delivery_request=twice, amount=10, status=Payment.SUCCESS),
+            Payment(delivery_request=twice, amount=10, status=Payment.SUCCESS),
+            Payment(delivery_request=pending, amount=10),
+        ])
+
+    def expected(self):
+        _, unpaid_flag, no_payment, wrong_amount, twice, _ = self.deliveries
+        return sorted([
+            (unpaid_flag.pk, PaymentDiscrepancy.PAYMENT_NOT_RECORDED),
+            (no_payment.pk, PaymentDiscrepancy.PAID_WITHOUT_PAYMENT),
+            (wrong_amount.pk, PaymentDiscrepancy.AMOUNT_MISMATCH),
+            (twice.pk, PaymentDiscrepancy.DUPLICATE_PAYMENT),
+        ])
+
+    def test_report_table(self):
+        run = ReconciliationRun.objects.create()
+        # Windows of 4 deliveries: two checkpoints
+        checkpoints = [
+            step.last_delivery_id
+            for step in reconciliation.reconcile(run, reconciliation.TableReport(run), window=4, chunk_size=2)
+        ]
+        self.assertEqual(checkpoints, [self.deliveries[3].pk, self.deliveries[5].pk])
+        found = sorted(run.discrepancy_rows.values_list('delivery_request_id', 'kind'))
+        self.assertEqual(found, self.expected())
+        self.assertEqual((run.checked, run.discrepancies), (6, 4))
+        self.assertIsNotNone(run.finished_at)
+
+    def test_resume_from_checkpoint(self):
+        run = ReconciliationRun.objects.create()
+        steps = reconciliation.reconcile(run, reconciliation.TableReport(run), window=3)
+        next(steps)
+        # Interrupted after the first window; a fresh process picks up the checkpoint
+        run = ReconciliationRun.objects.get(pk=run.pk)
+        self.assertEqual(run.last_delivery_id, self.deliveries[2].pk)
+        list(reconciliation.reconcile(run, reconciliation.TableReport(run), window=3))
+        found = sorted(run.discrepancy_rows.values_list('delivery_request_id', 'kind'))
+        self.assertEqual(found, self.expected())
+        self.assertEqual(run.checked, 6)
+
+    def test_cash_on_delivery_is_settled_on_completion(self):
+        pending = self.deliveries[-1]
+        driver = User.objects.create_user(username='driver', email='driver@orion.test', password='pw', role=User.DRIVER)
+        assignment = Assignment.objects.create(delivery_request=pending, driver=driver, status=Assignment.ACCEPTED)
+        DeliveryRequest.objects.filter(pk=pending.pk).update(status=DeliveryRequest.IN_PROGRESS)
+        Payment.objects.filter(delivery_request=pending).update(payment_method=Payment.ON_DELIVERY)
+
+        state_machine.complete(assignment)
+        payment = Payment.objects.get(delivery_request=pending)
+        self.assertEqual((payment.status, payment.provider), (Payment.SUCCESS, payments.ON_DELIVERY))
+        self.assertTrue(DeliveryRequest.objects.get(pk=pending.pk).is_paid)
+        self.assertTrue(DeliveryEvent.objects.filter(
+            delivery_request_id=pending.pk, event_type=DeliveryEvent.PAYMENT_UPDATED
+        ).exists())
+
+        # Reconciliation accepts the collected cash
+        run = ReconciliationRun.objects.create()
+        list(reconciliation.reconcile(run, reconciliation.TableReport(run)))
+        self.assertEqual(sorted(run.discrepancy_rows.values_list('delivery_request_id', 'kind')), self.expected())
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username='admin', email='admin@orion.test', password='pw', role=User.ADMIN, is_staff=True
+        )
+        self.customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.driver = User.objects.create_user(
+            username='driver', email='driver@orion.test', password='pw', role=User.DRIVER
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        for package_type in [DeliveryRequest.PARCEL, DeliveryRequest.PARCEL, DeliveryRequest.FOOD]:
+            self.client.post('/api/delivery-requests/', {
+                'pickup_address': 'Pickup', 'dropoff_address': 'Dropoff', 'package_type': package_type,
+                'pickup_lat': -1.95, 'pickup_lng': 30.06, 'dropoff_lat': -1.94, 'dropoff_lng': 30.07,
+                'customer': self.customer.id,
+            }, format='json')
+        self.deliveries = list(DeliveryRequest.objects.order_by('id'))
+
+    def drain(self):
+        while events.dispatch(analytics.CONSUMER, analytics.rollup_sink):
+            pass
+
+    def rollups(self):
+        return (
+            sorted(DailyDeliveryRollup.objects.filter(deliveries__gt=0).values_list(
+                'status', 'package_type', 'deliveries', 'revenue'
+            )),
+            list(DailyDriverRollup.objects.filter(completed__gt=0).values_list('driver_id', 'completed')),
+        )
+
+    def complete(self, delivery):
+        assignment = state_machine.assign(delivery.id, self.driver.id)
+        state_machine.accept(assignment)
+        state_machine.complete(assignment)
+        payment = Payment.objects.create(delivery_request=delivery, amount=delivery.price)
+        payments.apply_callbacks(payments.MANUAL, [
+            {'payment_id': payment.id, 'transaction_id': f'tx-{payment.id}', 'status': Payment.SUCCESS}
+        ])
+
+    def test_events_keep_rollups_current(self):
+        self.drain()
+        self.assertEqual(self.rollups()[0], [
+            (DeliveryRequest.PENDING, DeliveryRequest.FOOD, 1, 0),
+            (DeliveryRequest.PENDING, DeliveryRequest.PARCEL, 2, 0),
+        ])
+
+        delivery = self.deliveries[0]
+        self.complete(delivery)
+        self.drain()
+        deliveries, drivers = self.rollups()
+        self.assertIn((DeliveryRequest.COMPLETED, DeliveryRequest.PARCEL, 1, delivery.price), deliveries)
+        self.assertIn((DeliveryRequest.PENDING, DeliveryRequest.PARCEL, 1, 0), deliveries)
+        self.assertEqual(drivers, [(self.driver.id, 1)])
+
+        # Repeated events change nothing
+        analytics.rollup_sink(list(DeliveryEvent.objects.all()))
+        self.assertEqual(self.rollups(), (deliveries, drivers))
+
+        self.client.delete(f'/api/delivery-requests/{self.deliveries[2].id}/')
+        self.drain()
+        self.assertNotIn(DeliveryRequest.FOOD, [row[1] for row in self.rollups()[0]])
+
+    def test_backfill_matches_incremental(self):
+        self.complete(self.deliveries[1])
+        self.drain()
+        incremental = self.rollups()
+        list(analytics.backfill(window=2, reset=True))
+        self.assertEqual(self.rollups(), incremental)
+        # Without reset nothing is counted twice
+        self.assertEqual(sum(changed for _, changed in analytics.backfill(window=2)), 0)
+
+    def test_reports_read_only_rollups(self):
+        self.complete(self.deliveries[0])
+        self.drain()
+        admin = APIClient()
+        admin.force_authenticate(self.admin)
+        with self.assertNumQueries(1):
+            response = admin.get('/api/analytics/drivers/')
+        self.assertEqual(response.json()['results'][0]['completed'], 1)
+        response = admin.get('/api/analytics/package-types/')
+        self.assertEqual([row['deliveries'] for row in response.json()['results']], [1, 2])
+        self.assertEqual(admin.get('/api/analytics/revenue/?start=2020-01-02&end=2020-01-01').status_code, 400)
+        self.assertEqual(self.client.get('/api/analytics/statuses/').status_code, 403)
+
+
+class EtaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.driver = User.objects.create_user(
+            username='driver', email='driver@orion.test', password='pw', role=User.DRIVER
+        )
+        self.delivery = DeliveryRequest.objects.create(
+            customer=self.customer, pickup_address='Pickup', dropoff_address='Dropoff',
+            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.85, dropoff_lng=30.06,
+            status=DeliveryRequest.IN_PROGRESS,
+        )
+        self.start = timezone.now() - timedelta(minutes=10)
+
+    def fix(self, seconds, latitude):
+        return Tracking(delivery_request=self.delivery, driver=self.driver, latitude=latitude, longitude=30.06,
+                        timestamp=self.start + timedelta(seconds=seconds))
+
+    def test_speed_is_smoothed_over_fixes(self):
+        # 0.01 degrees of latitude a minute is about 66.7 km/h
+        with self.assertNumQueries(1):
+            eta.record_positions([self.fix(0, -1.95), self.fix(60, -1.94)])
+        with self.assertNumQueries(0):
+            eta.record_positions([self.fix(120, -1.93)])
+        estimate = eta.estimate(self.delivery.id, now=self.start + timedelta(seconds=120))
+        self.assertAlmostEqual(estimate['speed_kmh'], 66.7, delta=0.5)
+        self.assertAlmostEqual(estimate['remaining_km'], 8.896 * eta.ROUTE_FACTOR, delta=0.05)
+        self.assertAlmostEqual(estimate['eta_seconds'], estimate['remaining_km'] / 66.7 * 3600, delta=60)
+
+    def test_buffered_fixes_and_jumps_do_not_skew_speed(self):
+        # Uploaded together: server timestamps a few milliseconds apart
+        eta.record_positions([self.fix(0, -1.95), self.fix(0.001, -1.949), self.fix(0.002, -1.948)])
+        self.assertIsNone(eta.estimate(self.delivery.id)['speed_kmh'])
+        eta.record_positions([self.fix(60, -1.94)])
+        speed = eta.estimate(self.delivery.id)['speed_kmh']
+        eta.record_positions([self.fix(120, -1.0)])
+        self.assertEqual(eta.estimate(self.delivery.id)['speed_kmh'], speed)
+
+    def test_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        self.assertEqual(client.get(f'/api/delivery-requests/{self.delivery.id}/eta/').status_code, 404)
+        Assignment.objects.create(delivery_request=self.delivery, driver=self.driver, status=Assignment.ACCEPTED)
+        driver = APIClient()
+        driver.force_authenticate(self.driver)
+        driver.post('/api/tracking/', {
+            'delivery_request': self.delivery.id, 'driver': self.driver.id, 'latitude': -1.95, 'longitude': 30.06,
+        }, format='json')
+        with self.assertNumQueries(1):
+            response = client.get(f'/api/delivery-requests/{self.delivery.id}/eta/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['speed_kmh'], None)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username='admin', email='admin@orion.test', password='pw', role=User.ADMIN, is_staff=True
+        )
+        customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        DeliveryRequest.objects.bulk_create([
+            DeliveryRequest(customer=customer, pickup_address=f'Pickup {index}', dropoff_address='Dropoff',
+                            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07, price='12.50',
+                            status=DeliveryRequest.COMPLETED if index % 2 else DeliveryRequest.PENDING)
+            for index in range(7)
+        ])
+        # Ties on created_at must not lose or repeat rows across pages
+        DeliveryRequest.objects.update(created_at=timezone.make_aware(datetime(2025, 3, 1, 12)))
+        DeliveryRequest.objects.filter(pk=DeliveryRequest.objects.order_by('id').last().pk).update(
+            created_at=timezone.make_aware(datetime(2025, 3, 5, 12))
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def read(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_pages_walk_every_row_once(self):
+        with self.assertNumQueries(4):
+            body = b''.join(exporter.export('deliveries', exporter.NDJSON, page_size=2))
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], sorted(DeliveryRequest.objects.values_list('id', flat=True)))
+        self.assertEqual(rows[0]['price'], '12.50')
+
+    def test_filters_and_gzip(self):
+        response = self.client.get('/api/exports/deliveries.csv?start=2025-03-01&end=2025-03-01&status=COMPLETED&gzip=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(self.read(response)).decode())))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual({row['status'] for row in rows}, {DeliveryRequest.COMPLETED})
+
+    def test_tracking_and_errors(self):
+        self.assertEqual(self.read(self.client.get('/api/exports/tracking.ndjson')), b'')
+        self.assertEqual(self.client.get('/api/exports/deliveries.xml').status_code, 400)
+        self.assertEqual(self.client.get('/api/exports/deliveries.csv?status=LOST').status_code, 400)
+        customer = APIClient()
+        customer.force_authenticate(User.objects.get(username='customer'))
+        self.assertEqual(customer.get('/api/exports/deliveries.csv').status_code, 403)
+
+    def test_accept_header_does_not_block_the_download(self):
+        for path, accept in (('deliveries.csv', 'text/csv'), ('tracking.ndjson', 'application/x-ndjson'),
+                             ('deliveries.csv', 'application/gzip')):
+            response = self.client.get(f'/api/exports/{path}', HTTP_ACCEPT=accept)
+            self.assertEqual(response.status_code, 200, accept)
+            self.assertEqual(response['Content-Type'], exporter.CONTENT_TYPES[path.split('.')[1]])
+        # Errors are still JSON whatever the client asked for
+        response = self.client.get('/api/exports/deliveries.xml', HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unsupported format', response.json()['detail'])
+
+
+class TrackingIngestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.driver, self.other_driver = [
+            User.objects.create_user(username=name, email=f'{name}@orion.test', password='pw', role=User.DRIVER)
+            for name in ('driver', 'other')
+        ]
+        self.active, self.closed = DeliveryRequest.objects.bulk_create([
+            DeliveryRequest(customer=customer, pickup_address='Pickup', dropoff_address='Dropoff',
+                            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07)
+            for _ in range(2)
+        ])
+        Assignment.objects.create(delivery_request=self.active, driver=self.driver, status=Assignment.ACCEPTED)
+        Assignment.objects.create(delivery_request=self.closed, driver=self.driver, status=Assignment.REJECTED)
+        Assignment.objects.create(delivery_request=self.closed, driver=self.other_driver, status=Assignment.ACCEPTED)
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def point(self, delivery, driver=None):
+        return {'delivery_request': delivery.id, 'driver': (driver or self.driver).id,
+                'latitude': -1.95, 'longitude': 30.06}
+
+    def test_bulk_accepts_active_pairs(self):
+        response = self.client.post('/api/tracking/bulk/', {'points': [self.point(self.active)] * 3}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Tracking.objects.count(), 3)
+
+    def test_bulk_rejects_inactive_pairs(self):
+        response = self.client.post('/api/tracking/bulk/', {
+            'points': [self.point(self.active), self.point(self.closed)]
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['points']
+        self.assertEqual(errors[0], {})
+        self.assertIn('delivery_request', errors[1])
+        self.assertFalse(Tracking.objects.exists())
+
+    def test_positions_of_other_drivers_are_rejected(self):
+        response = self.client.post('/api/tracking/bulk/', {
+            'points': [self.point(self.closed, driver=self.other_driver)]
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('driver', response.json()['points'][0])
+        response = self.client.post('/api/tracking/', self.point(self.closed, driver=self.other_driver), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Tracking.objects.exists())
+
+
+class ImportTests(TestCase):
+    HEADER = b'pickup_address,dropoff_address,pickup_lat,pickup_lng,dropoff_lat,dropoff_lng,package_type\n'
+    ROW = b'Pickup,Dropoff,-1.95,30.06,-1.94,30.07,PARCEL\n'
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def upload(self, name, content):
+        return self.client.post('/api/delivery-requests/import/', {'file': SimpleUploadedFile(name, content)},
+                                format='multipart')
+
+    def test_bad_lines_are_row_errors(self):
+        content = (
+            b'\xef\xbb\xbf' + self.HEADER + self.ROW
+            + b'Pick\xffup,Dropoff,-1.95,30.06,-1.94,30.07,PARCEL\n'
+            + b'"' + b'x' * (csv.field_size_limit() + 1) + b'",Dropoff,-1.95,30.06,-1.94,30.07,PARCEL\n'
+            + b'"Multi\nline\xff",Dropoff,-1.95,30.06,-1.94,30.07,PARCEL\n'
+            + self.ROW
+        )
+        response = self.upload('manifest.csv', content)
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body['created'], body['failed']), (2, 3))
+        self.assertEqual([error['line'] for error in body['errors']], [3, 4, 6])
+        self.assertEqual(body['errors'][0]['errors'], {'non_field_errors': ['Not valid UTF-8.']})
+        self.assertIn('Malformed CSV', body['errors'][1]['errors']['non_field_errors'][0])
+
+    def test_ndjson_bad_lines_are_row_errors(self):
+        row = {'pickup_address': 'Pickup', 'dropoff_address': 'Dropoff', 'pickup_lat': -1.95, 'pickup_lng': 30.06,
+               'dropoff_lat': -1.94, 'dropoff_lng': 30.07}
+        content = json.dumps(row).encode() + b'\n\xff\xfe\n[1]\n' + json.dumps(row).encode() + b'\n'
+        body = self.upload('manifest.ndjson', content).json()
+        self.assertEqual((body['created'], body['failed']), (2, 2))
+        self.assertEqual([error['line'] for error in body['errors']], [2, 3])
+
+    def test_created_events_name_the_imported_rows(self):
+        self.upload('manifest.csv', self.HEADER + self.ROW * 3)
+        imported = sorted(DeliveryRequest.objects.values_list('id', flat=True))
+        created = DeliveryEvent.objects.filter(event_type=DeliveryEvent.DELIVERY_CREATED)
+        self.assertEqual(sorted(created.values_list('delivery_request_id', flat=True)), imported)
+
+        # Without returned keys (MySQL) the chunk is found by its marker, not as the newest rows
+        batch = DeliveryRequest.objects.get(pk=imported[0]).import_batch
+        DeliveryRequest.objects.create(customer=self.customer, pickup_address='Pickup', dropoff_address='Dropoff',
+                                       pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07)
+        chunk = [DeliveryRequest(customer=self.customer, import_batch=batch) for _ in imported]
+        self.assertEqual(importer._created_ids(chunk), imported)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        deliveries = DeliveryRequest.objects.bulk_create([
+            DeliveryRequest(customer=self.customer, pickup_address='Pickup', dropoff_address='Dropoff',
+                            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07)
+            for _ in range(8)
+        ])
+        # Ties on created_at are ordered by id
+        now = timezone.now()
+        DeliveryRequest.objects.filter(pk__in=[delivery.pk for delivery in deliveries[:6]]).update(created_at=now)
+        DeliveryRequest.objects.filter(pk__in=[delivery.pk for delivery in deliveries[6:]]).update(
+            created_at=now - timedelta(hours=1)
+        )
+        self.expected = [delivery.pk for delivery in deliveries[5::-1]] + [deliveries[7].pk, deliveries[6].pk]
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def walk(self, url, link):
+        seen = []
+        while url:
+            body = self.client.get(url).json()
+            seen.append([row['id'] for row in body['results']])
+            url = body[link]
+        return seen
+
+    def test_pages_follow_the_whole_sort_key(self):
+        pages = self.walk('/api/delivery-requests/?page_size=3', 'next')
+        self.assertEqual(pages, [self.expected[:3], self.expected[3:6], self.expected[6:]])
+
+        # Walking back from the last page ends on the first one
+        last = self.client.get('/api/delivery-requests/?page_size=3').json()
+        last = self.client.get(self.client.get(last['next']).json()['next']).json()
+        back = self.walk(last['previous'], 'previous')
+        self.assertEqual(back, [self.expected[3:6], self.expected[:3]])
+
+    def test_cursor_filters_on_every_field(self):
+        first = self.client.get('/api/delivery-requests/?page_size=3').json()
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(first['next'])
+        page_query = context.captured_queries[-1]['sql']
+        self.assertNotIn('OFFSET', page_query.upper())
+        self.assertIn('"created_at" <', page_query)
+        self.assertIn('"id" <', page_query)
+
+    def test_bad_cursor_is_not_found(self):
+        for cursor in ['not-base64!', 'eyJwIjpbMV19', 'eyJwIjpbIngiLCJ5Il19']:
+            response = self.client.get(f'/api/delivery-requests/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404, cursor)
+
+
+class LiveStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        cls.delivery = DeliveryRequest.objects.create(
+            customer=cls.customer, pickup_address='Pickup', dropoff_address='Dropoff',
+            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07,
+        )
+        cls.headers = {'Authorization': f'Bearer {AccessToken.for_user(cls.customer)}', 'Accept': 'text/event-stream'}
+
+    def test_wsgi_requests_are_refused(self):
+        response = self.client.get(f'/api/delivery-requests/{self.delivery.id}/events/', headers=self.headers)
+        self.assertEqual(response.status_code, 501)
+
+    async def test_published_event_reaches_the_stream(self):
+        response = await AsyncClient().get(f'/api/delivery-requests/{self.delivery.id}/events/', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        stream = aiter(response.streaming_content)
+        first = asyncio.ensure_future(anext(stream))
+        try:
+            while not live.hub.subscriber_count(self.delivery.id):
+                await asyncio.sleep(0.01)
+            # Views publish from worker threads
+            await sync_to_async(live.publish_status, thread_sensitive=False)(self.delivery.id, DeliveryRequest.COMPLETED)
+            chunk = await asyncio.wait_for(first, timeout=5)
+        finally:
+            first.cancel()
+        self.assertEqual(chunk.decode(), live.format_event('status', {
+            'delivery_request': self.delivery.id, 'status': DeliveryRequest.COMPLETED,
+        }))
+
+
+class DistanceTests(SimpleTestCase):
+    def assertMatchesGeodesic(self, lat1, lng1, lat2, lng2):
+        np.testing.assert_allclose(
+            distance.vincenty_km(lat1, lng1, lat2, lng2), distance.geodesic_km(lat1, lng1, lat2, lng2), atol=1e-6
+        )
+
+    def test_coincident_points_are_zero(self):
+        self.assertEqual(float(distance.vincenty_km(-1.95, 30.06, -1.95, 30.06)), 0.0)
+        self.assertEqual(float(distance.haversine_km(-1.95, 30.06, -1.95, 30.06)), 0.0)
+
+    def test_antipodal_points_fall_back_to_geodesic(self):
+        # Vincenty does not converge here; the unconverged rows are solved exactly
+        self.assertMatchesGeodesic([0, 10, 0], [0, 20, 0], [0, -10, 0.5], [180, -160, 179.7])
+        self.assertAlmostEqual(float(distance.vincenty_km(90, 0, -90, 0)), 20003.931, places=3)
+
+    def test_batch_matches_geodesic(self):
+        rng = np.random.default_rng(7)
+        lat1, lat2 = rng.uniform(-80, 80, size=(2, 200))
+        lng1, lng2 = rng.uniform(-180, 180, size=(2, 200))
+        self.assertMatchesGeodesic(lat1, lng1, lat2, lng2)
+        self.assertEqual(distance.vincenty_km(lat1, lng1, lat2, lng2).shape, (200,))
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        tariff = Tariff.objects.create(
+            package_type=DeliveryRequest.PARCEL, base_fare=2, price_per_km=1, minimum_price=5
+        )
+        TariffDistanceBand.objects.create(tariff=tariff, from_km=10, price_per_km=Decimal('0.5'))
+        TariffSurcharge.objects.create(package_type=DeliveryRequest.PARCEL, start_hour=22, end_hour=6, multiplier=2)
+        TariffSurcharge.objects.create(package_type=None, start_hour=17, end_hour=19, multiplier=Decimal('1.5'))
+        TariffSurcharge.objects.create(package_type=DeliveryRequest.PARCEL, start_hour=18, end_hour=20, multiplier=3)
+        self.table = pricing.load_table()
+
+    def quote(self, distances, package_type=DeliveryRequest.PARCEL, hour=12):
+        return self.table.quote(distances, [package_type] * len(distances), [hour] * len(distances)).tolist()
+
+    def test_band_boundaries(self):
+        # The minimum price, then 1/km up to the 10 km band start and 0.5/km beyond it
+        self.assertEqual(self.quote([0, 3, 9.99, 10, 20]), [5.0, 5.0, 11.99, 12.0, 17.0])
+
+    def test_surcharge_windows(self):
+        # 22 -> 6 wraps past midnight and ends before hour 6
+        self.assertEqual([self.quote([10], hour=hour)[0] for hour in (21, 22, 0, 5, 6)], [12, 24, 24, 24, 12])
+        # Where windows overlap the highest multiplier applies, type specific or general
+        self.assertEqual([self.quote([10], hour=hour)[0] for hour in (17, 18, 19, 20)], [18, 36, 36, 12])
+
+    def test_package_types_without_a_tariff(self):
+        self.assertEqual(self.quote([10], package_type=DeliveryRequest.FOOD), [15.0])
+        self.assertEqual(self.quote([10], package_type=DeliveryRequest.FOOD, hour=17), [22.5])
+        self.assertEqual(self.quote([10], package_type=DeliveryRequest.FOOD, hour=22), [15.0])
+
+    def test_surcharges_of_retired_tariffs_are_dropped(self):
+        Tariff.objects.create(
+            package_type=DeliveryRequest.FOOD, base_fare=1, price_per_km=1, minimum_price=1, is_active=False
+        )
+        TariffSurcharge.objects.create(package_type=DeliveryRequest.FOOD, start_hour=8, end_hour=10, multiplier=4)
+        TariffSurcharge.objects.create(package_type=DeliveryRequest.FRAGILE, start_hour=8, end_hour=10, multiplier=2)
+        self.table = pricing.load_table()
+        self.assertEqual(self.quote([10], package_type=DeliveryRequest.FOOD, hour=9), [15.0])
+        # General surcharges still apply to the type, and types priced by the default keep theirs
+        self.assertEqual(self.quote([10], package_type=DeliveryRequest.FOOD, hour=17), [22.5])
+        self.assertEqual(self.quote([10], package_type=DeliveryRequest.FRAGILE, hour=9), [30.0])
+
+
+class DriverIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = dispatch.DriverIndex(cell_degrees=0.01, max_age=60)
+
+    def test_no_drivers_in_range(self):
+        self.assertEqual(self.index.nearest(-1.95, 30.06), [])
+        # About 33 km away, outside a 25 km search
+        self.index.update(1, -1.65, 30.06)
+        self.assertEqual(self.index.nearest(-1.95, 30.06, max_radius_km=25), [])
+        self.assertEqual([driver for _, driver in self.index.nearest(-1.95, 30.06, max_radius_km=40)], [1])
+
+    def test_nearest_first_skipping_excluded_and_stale(self):
+        for driver, lat in enumerate([-1.951, -1.96, -1.99, -1.952], start=1):
+            self.index.update(driver, lat, 30.06)
+        self.index.update(5, -1.9505, 30.06, seen_at=time.time() - 120)
+        found = self.index.nearest(-1.95, 30.06, k=3, exclude={4})
+        self.assertEqual([driver for _, driver in found], [1, 2, 3])
+        self.assertAlmostEqual(found[0][0], 0.111, places=3)
+        # Stale positions are dropped from the grid
+        self.assertEqual(len(self.index), 4)
+
+
+class AutoAssignTests(TestCase):
+    def setUp(self):
+        self.index, dispatch.driver_index = dispatch.driver_index, dispatch.DriverIndex()
+        customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.driver = User.objects.create_user(
+            username='driver', email='driver@orion.test', password='pw', role=User.DRIVER
+        )
+        self.delivery = DeliveryRequest.objects.create(
+            customer=customer, pickup_address='Pickup', dropoff_address='Dropoff',
+            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07,
+        )
+
+    def tearDown(self):
+        dispatch.driver_index = self.index
+
+    def test_no_driver_in_range_leaves_the_delivery_pending(self):
+        dispatch.driver_index.update(self.driver.id, -2.5, 30.06)
+        self.assertIsNone(dispatch.auto_assign(self.delivery))
+        self.assertEqual(DeliveryRequest.objects.get(pk=self.delivery.pk).status, DeliveryRequest.PENDING)
+        self.assertFalse(Assignment.objects.exists())
+
+    def test_nearby_driver_is_assigned(self):
+        dispatch.driver_index.update(self.driver.id, -1.951, 30.06)
+        assignment = dispatch.auto_assign(self.delivery)
+        self.assertEqual(assignment.driver_id, self.driver.id)
+
+
+class AssignmentSolverTests(SimpleTestCase):
+    def optimum(self, costs):
+        """Brute force: cheapest way to match every row of a wide matrix."""
+        n, m = costs.shape
+        return min(sum(costs[row, col] for row, col in enumerate(cols)) for cols in permutations(range(m), n))
+
+    def assertOptimal(self, costs):
+        rows, cols = batch_dispatch.hungarian(costs)
+        self.assertEqual(len(rows), min(costs.shape))
+        self.assertEqual(len(set(rows.tolist())), len(rows))
+        self.assertEqual(len(set(cols.tolist())), len(cols))
+        wide = costs if costs.shape[0] <= costs.shape[1] else costs.T
+        self.assertAlmostEqual(costs[rows, cols].sum(), self.optimum(wide))
+
+    def test_rectangular_matrices(self):
+        rng = np.random.default_rng(3)
+        for shape in [(3, 5), (5, 3), (1, 4), (4, 1), (4, 4)]:
+            self.assertOptimal(rng.uniform(0, 20, size=shape))
+
+    def test_forbidden_pairs_are_left_unmatched(self):
+        forbidden = batch_dispatch.FORBIDDEN
+        costs = np.array([
+            [1.0, forbidden, forbidden],
+            [2.0, forbidden, forbidden],
+        ])
+        rows, cols = batch_dispatch.hungarian(costs)
+        self.assertEqual((rows.tolist(), cols.tolist()), ([0], [0]))
+        rows, cols = batch_dispatch.solve_sparse(costs, solver=batch_dispatch.hungarian)
+        self.assertEqual((rows.tolist(), cols.tolist()), ([0], [0]))
+
+    def test_scipy_solver_matches_the_reference(self):
+        rng = np.random.default_rng(5)
+        costs = rng.uniform(0, 30, size=(40, 50))
+        costs[costs > 25] = batch_dispatch.FORBIDDEN
+        rows, cols = batch_dispatch.solve_sparse(costs)
+        reference_rows, reference_cols = batch_dispatch.solve_sparse(costs, solver=batch_dispatch.hungarian)
+        self.assertEqual(len(rows), len(reference_rows))
+        self.assertAlmostEqual(costs[rows, cols].sum(), costs[reference_rows, reference_cols].sum())
+
+    def test_components_of_disjoint_blocks(self):
+        allowed = np.array([
+            [True, False, False],
+            [False, True, True],
+            [False, False, False],
+        ])
+        components = sorted((rows.tolist(), cols.tolist()) for rows, cols in batch_dispatch._components(allowed))
+        self.assertEqual(components, [([0], [0]), ([1], [1, 2])])
+
+    def test_empty_matrix(self):
+        rows, cols = batch_dispatch.hungarian(np.empty((0, 3)))
+        self.assertEqual((len(rows), len(cols)), (0, 0))
+
+
+class RouteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.driver = User.objects.create_user(
+            username='driver', email='driver@orion.test', password='pw', role=User.DRIVER
+        )
+        delivery = DeliveryRequest.objects.create(
+            customer=customer, pickup_address='Pickup', dropoff_address='Dropoff', status=DeliveryRequest.IN_PROGRESS,
+            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07,
+        )
+        Assignment.objects.create(delivery_request=delivery, driver=self.driver, status=Assignment.ACCEPTED)
+
+    def get_route(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(f'/api/assignments/route/?driver_id={self.driver.id}')
+
+    def test_admins_by_role_may_read_a_drivers_route(self):
+        admin = User.objects.create_user(username='admin', email='admin@orion.test', password='pw', role=User.ADMIN)
+        response = self.get_route(admin)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['stops']), 2)
+
+    def test_staff_flag_alone_is_not_admin(self):
+        staff = User.objects.create_user(
+            username='staff', email='staff@orion.test', password='pw', role=User.CUSTOMER, is_staff=True
+        )
+        self.assertEqual(self.get_route(staff).status_code, 403)
+
+
+class RoutePlannerTests(SimpleTestCase):
+    def planner(self, seed, deliveries=6, capacity=3):
+        rng = np.random.default_rng(seed)
+        stops = []
+        for delivery in range(deliveries):
+            for kind in (routing.PICKUP, routing.DROPOFF):
+                lat, lng = rng.uniform(-0.05, 0.05, size=2)
+                stops.append({'type': kind, 'delivery_request': delivery,
+                              'latitude': -1.95 + lat, 'longitude': 30.06 + lng})
+        return routing.RoutePlanner((-1.95, 30.06), stops, capacity=capacity)
+
+    def test_moves_never_worsen_the_route(self):
+        deadline = time.monotonic() + 60
+        for seed in range(20):
+            planner = self.planner(seed)
+            route = planner.nearest_neighbour()
+            self.assertTrue(planner.feasible(route))
+            for move in (planner._two_opt, planner._or_opt):
+                improved = move(route, deadline)
+                if improved is not None:
+                    self.assertTrue(planner.feasible(improved))
+                    self.assertLess(planner.cost(improved), planner.cost(route))
+
+            planned = planner.plan(time_budget=5)
+            self.assertTrue(planner.feasible(planned))
+            self.assertLessEqual(planner.cost(planned), planner.cost(route) + 1e-9)
+            self.assertEqual(sorted(planned), list(range(len(planner.stops))))
+
+    def test_pickup_precedes_dropoff_within_capacity(self):
+        planner = self.planner(1, deliveries=5, capacity=1)
+        route = planner.plan(time_budget=5)
+        kinds = [planner.stops[index]['type'] for index in route]
+        self.assertEqual(kinds, [routing.PICKUP, routing.DROPOFF] * 5)
+
+    def test_matrix_cache_is_safe_across_threads(self):
+        saved = routing._MATRIX_CACHE_SIZE
+        routing._MATRIX_CACHE_SIZE = 4
+        routing._matrix_cache.clear()
+
+        def lookup(index):
+            coordinates = [(-1.95 + index % 7 * 0.001, 30.06), (-1.94, 30.07)]
+            return routing.stop_matrix(coordinates)[0, 1]
+
+        try:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                distances = list(pool.map(lookup, range(2000)))
+            self.assertEqual(len(distances), 2000)
+            self.assertLessEqual(len(routing._matrix_cache), 4)
+        finally:
+            routing._MATRIX_CACHE_SIZE = saved
+            routing._matrix_cache.clear()
+
+
+class GeohashCoveringTests(SimpleTestCase):
+    def points_within(self, lat, lng, radius_km, count=300, seed=5):
+        """Random points up to ``radius_km`` away, on the sphere the distances use."""
+        rng = np.random.default_rng(seed)
+        angle = rng.uniform(0, 1, count) * radius_km / distance.EARTH_RADIUS_KM
+        bearing = rng.uniform(0, 2 * np.pi, count)
+        phi, lam = np.radians(lat), np.radians(lng)
+        lats = np.arcsin(np.sin(phi) * np.cos(angle) + np.cos(phi) * np.sin(angle) * np.cos(bearing))
+        lngs = lam + np.arctan2(
+            np.sin(bearing) * np.sin(angle) * np.cos(phi), np.cos(angle) - np.sin(phi) * np.sin(lats)
+        )
+        return np.degrees(lats), (np.degrees(lngs) + 180) % 360 - 180
+
+    def assertCovers(self, lat, lng, radius_km):
+        cells = geohash.covering_cells(lat, lng, radius_km)
+        self.assertLessEqual(len(cells), geohash.MAX_COVERING_CELLS)
+        lats, lngs = self.points_within(lat, lng, radius_km)
+        for point_hash in geohash.encode_many(lats, lngs):
+            self.assertTrue(any(point_hash.startswith(cell) for cell in cells), point_hash)
+        return cells
+
+    def test_cells_are_about_the_query_size(self):
+        cells = self.assertCovers(-1.95, 30.06, 5)
+        lat_size, lng_size = geohash.cell_size(len(cells[0]))
+        self.assertLess(lat_size * distance.KM_PER_DEGREE, 10)
+        self.assertLess(lng_size * distance.KM_PER_DEGREE, 10)
+
+    def test_near_the_poles(self):
+        for lat in (89.99, -89.99, 88.5):
+            self.assertCovers(lat, 10, 5)
+            self.assertCovers(lat, -170, 50)
+
+    def test_across_the_antimeridian(self):
+        for lng in (179.99, -179.99, 180.0):
+            cells = self.assertCovers(0.5, lng, 5)
+            # Cells on both sides of the line
+            centres = [geohash.decode(cell)[1] for cell in cells]
+            self.assertTrue(min(centres) < -179 and max(centres) > 179)
+
+    def test_whole_globe(self):
+        self.assertEqual(geohash.covering_cells(0, 0, 30000), [''])
+
+
+class NearbyTests(TestCase):
+    def setUp(self):
+        customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.driver = User.objects.create_user(
+            username='driver', email='driver@orion.test', password='pw', role=User.DRIVER
+        )
+        self.deliveries = []
+        for lat, lng in [(0.5, 179.99), (0.5, -179.99), (0.5, 179.5), (-1.95, 30.06)]:
+            self.deliveries.append(DeliveryRequest.objects.create(
+                customer=customer, pickup_address='Pickup', dropoff_address='Dropoff',
+                pickup_lat=lat, pickup_lng=lng, dropoff_lat=lat, dropoff_lng=lng,
+            ))
+
+    def test_radius_across_the_antimeridian(self):
+        found = nearby.nearby_pending(0.5, 179.999, radius_km=5)
+        self.assertEqual([delivery.pk for _, delivery in found], [self.deliveries[0].pk, self.deliveries[1].pk])
+
+    def test_candidates_are_capped(self):
+        cap, nearby.MAX_CANDIDATES = nearby.MAX_CANDIDATES, 1
+        try:
+            with CaptureQueriesContext(connection) as context:
+                found = nearby.nearby_pending(0.5, 179.999, radius_km=5)
+        finally:
+            nearby.MAX_CANDIDATES = cap
+        self.assertEqual(len(found), 1)
+        self.assertIn('LIMIT 1', context.captured_queries[0]['sql'])
+
+
+class TrackingCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user(username='customer', email='customer@orion.test', password='pw')
+        self.driver = User.objects.create_user(
+            username='driver', email='driver@orion.test', password='pw', role=User.DRIVER
+        )
+        self.delivery = DeliveryRequest.objects.create(
+            customer=self.customer, pickup_address='Pickup', dropoff_address='Dropoff',
+            status=DeliveryRequest.IN_PROGRESS, pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07,
+        )
+        self.assignment = Assignment.objects.create(
+            delivery_request=self.delivery, driver=self.driver, status=Assignment.ACCEPTED
+        )
+        self.driver_client = APIClient()
+        self.driver_client.force_authenticate(self.driver)
+        self.customer_client = APIClient()
+        self.customer_client.force_authenticate(self.customer)
+
+    def report(self, *latitudes):
+        points = [{'delivery_request': self.delivery.id, 'driver': self.driver.id, 'latitude': lat, 'longitude': 30.06}
+                  for lat in latitudes]
+        self.assertEqual(self.driver_client.post('/api/tracking/bulk/', {'points': points}, format='json').status_code,
+                         201)
+
+    def location(self):
+        return self.customer_client.get(f'/api/delivery-requests/{self.delivery.id}/location/')
+
+    def test_every_insert_writes_the_latest_position(self):
+        self.assertEqual(self.location().status_code, 404)
+        self.report(-1.95, -1.949)
+        self.assertEqual(self.location().json()['latitude'], -1.949)
+        self.report(-1.948)
+        self.assertEqual(tracking_cache.get_driver_position(self.driver.id)['latitude'], -1.948)
+
+    def test_reads_never_touch_the_tracking_table(self):
+        self.report(-1.95)
+        with CaptureQueriesContext(connection) as context:
+            response = self.location()
+        self.assertEqual(response.json()['latitude'], -1.95)
+        self.assertFalse([query for query in context.captured_queries if Tracking._meta.db_table in query['sql']])
+
+    def test_completion_drops_the_delivery_entry(self):
+        self.report(-1.95)
+        response = self.driver_client.patch(f'/api/assignments/{self.assignment.id}/complete/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(tracking_cache.get_delivery_position(self.delivery.id))
+        self.assertEqual(self.location().status_code, 404)
+        # The driver's own position stays known
+        self.assertIsNotNone(tracking_cache.get_driver_position(self.driver.id))
+
+    def test_cancellation_drops_the_delivery_entry(self):
+        self.report(-1.95)
+        admin = User.objects.create_user(
+            username='admin', email='admin@orion.test', password='pw', role=User.ADMIN, is_staff=True
+        )
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.patch(f'/api/delivery-requests/{self.delivery.id}/',
+                                {'status': DeliveryRequest.CANCELLED}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(tracking_cache.get_delivery_position(self.delivery.id))
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    baseline = {'list': {'p95_ms': 10.0}, 'export': {'p95_ms': 100.0}, 'empty': {'p95_ms': 0}}
+
+    def test_regression_beyond_tolerance_is_reported(self):
+        rows, regressions = benchmark.compare({'list': {'p95_ms': 12.5}, 'export': {'p95_ms': 110.0}}, self.baseline)
+        self.assertEqual(regressions, ['list'])
+        self.assertEqual([row[0] for row in rows], ['list', 'export'])
+        self.assertAlmostEqual(rows[0][3], 0.25)
+        self.assertAlmostEqual(rows[1][3], 0.1)
+
+    def test_tolerance_and_metric_are_configurable(self):
+        results = {'list': {'p95_ms': 12.5, 'p50_ms': 5.0}}
+        self.assertEqual(benchmark.compare(results, self.baseline, tolerance=0.3)[1], [])
+        self.assertEqual(benchmark.compare(results, {'list': {'p50_ms': 4.0}}, metric='p50_ms')[1], ['list'])
+
+    def test_faster_runs_are_not_regressions(self):
+        rows, regressions = benchmark.compare({'list': {'p95_ms': 5.0}}, self.baseline)
+        self.assertEqual(regressions, [])
+        self.assertAlmostEqual(rows[0][3], -0.5)
+
+    def test_scenarios_without_a_usable_baseline_are_skipped(self):
+        results = {'new': {'p95_ms': 50.0}, 'empty': {'p95_ms': 50.0}}
+        self.assertEqual(benchmark.compare(results, self.baseline), ([], []))
+
+    def test_summary_percentiles(self):
+        summary = benchmark.summarize([0.001 * value for value in range(1, 101)])
+        self.assertEqual(summary['iterations'], 100)
+        self.assertEqual(summary['p50_ms'], 50.5)
+        self.assertEqual(summary['p95_ms'], 95.05)
+        self.assertAlmostEqual(summary['mean_ms'], 50.5)
+
+
+class GenerateDataTests(TestCase):
+    options = {'deliveries': 30, 'customers': 3, 'drivers': 2, 'tracking_points': 2, 'chunk_size': 7, 'seed': 7}
+
+    def generate(self):
+        call_command('generate_data', stdout=io.StringIO(), **self.options)
+
+    def snapshot(self):
+        # Timestamps follow the clock and prices follow its hour, so neither is compared
+        return (
+            list(DeliveryRequest.objects.order_by('id').values_list(
+                'id', 'customer_id', 'status', 'package_type', 'pickup_lat', 'pickup_lng', 'dropoff_lat',
+                'dropoff_lng', 'distance_km', 'is_paid',
+            )),
+            list(Assignment.objects.order_by('id').values_list('delivery_request_id', 'driver_id', 'status')),
+            list(Payment.objects.order_by('id').values_list('delivery_request_id', 'payment_method', 'status')),
+            list(Tracking.objects.order_by('id').values_list('delivery_request_id', 'driver_id', 'latitude',
+                                                             'longitude')),
+        )
+
+    def test_same_seed_generates_the_same_rows(self):
+        self.generate()
+        first = self.snapshot()
+        self.assertEqual(len(first[0]), 30)
+        for model in (Tracking, Payment, Assignment, DeliveryRequest, User):
+            model.objects.all().delete()
+        self.generate()
+        self.assertEqual(self.snapshot(), first)
+
+    def test_distance_and_price_match_the_model(self):
+        self.generate()
+        generated = list(DeliveryRequest.objects.order_by('id'))
+        expected = [
+            DeliveryRequest(
+                pickup_lat=delivery.pickup_lat, pickup_lng=delivery.pickup_lng, dropoff_lat=delivery.dropoff_lat,
+                dropoff_lng=delivery.dropoff_lng, package_type=delivery.package_type, created_at=delivery.created_at,
+            )
+            for delivery in generated
+        ]
+        DeliveryRequest.populate_derived_fields(expected)
+        for delivery, reference in zip(generated, expected):
+            self.assertAlmostEqual(delivery.distance_km, reference.distance_km, places=6)
+            self.assertEqual(delivery.price, reference.price)
+            self.assertEqual(delivery.pickup_geohash, reference.pickup_geohash)
+
+    def test_ids_keep_working_after_explicit_inserts(self):
+        self.generate()
+        customer = User.objects.create_user(username='late', email='late@orion.test', password='pw')
+        self.assertGreater(customer.id, User.objects.exclude(id=customer.id).aggregate(last=Max('id'))['last'])
+        delivery = DeliveryRequest.objects.create(
+            customer=customer, pickup_address='Pickup', dropoff_address='Dropoff',
+            pickup_lat=-1.95, pickup_lng=30.06, dropoff_lat=-1.94, dropoff_lng=30.07,
+        )
+        last = DeliveryRequest.objects.exclude(id=delivery.id).aggregate(last=Max('id'))['last']
+        self.assertGreater(delivery.id, last)
@@ -5,7 +5,8 @@ from .views import (
     DeliveryRequestViewSet,
     AssignmentViewSet,
     PaymentViewSet,
-    TrackingViewSet, RegisterViewSet, LogoutView, ForgotPasswordView, CustomTokenObtainPairView, ProfileViewSet
+    TrackingViewSet, RegisterViewSet, LogoutView, ForgotPasswordView, CustomTokenObtainPairView, ProfileViewSet,
+    MetricsView, ProfileSamplesView, PaymentWebhookView, AnalyticsView, ExportView
 )
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
@@ -25,10 +26,19 @@ urlpatterns = [
     path('profile/', ProfileViewSet.as_view({'get': 'list'}), name='profile'),
     #update profile can be added similarly
     path('profile/<int:pk>/', ProfileViewSet.as_view({'patch': 'me'}), name='update-profile'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('metrics/profiles/', ProfileSamplesView.as_view(), name='metrics-profiles'),
+    path('analytics/<str:report>/', AnalyticsView.as_view(), name='analytics'),
+    path('exports/<slug:dataset>.<slug:fmt>', ExportView.as_view(), name='export'),
+    path('webhooks/payments/<str:provider>/', PaymentWebhookView.as_view(), name='payment-webhook'),
     
         
      # Custom routes for assignment actions
+    path('deliveries/dispatch/', AssignmentViewSet.as_view({'post': 'dispatch_pending'}), name='dispatch-pending'),
     path('deliveries/<int:pk>/assign/', AssignmentViewSet.as_view({'post': 'assign_driver'}), name='assign-driver'),
+    path('deliveries/<int:pk>/auto-assign/', AssignmentViewSet.as_view({'post': 'auto_assign'}), name='auto-assign-driver'),
+    path('assignments/', AssignmentViewSet.as_view({'get': 'list'}), name='assignment-list'),
+    path('assignments/route/', AssignmentViewSet.as_view({'get': 'route'}), name='assignment-route'),
     path('assignments/<int:pk>/accept/', AssignmentViewSet.as_view({'patch': 'accept'}), name='accept-assignment'),
     path('assignments/<int:pk>/reject/', AssignmentViewSet.as_view({'patch': 'reject'}), name='reject-assignment'),
     path('assignments/<int:pk>/complete/', AssignmentViewSet.as_view({'patch': 'complete'}), name='complete-assignment'),
@@ -0,0 +1,210 @@
+"""
+Analytics rollups.
+
+Dashboards read DailyDeliveryRollup (deliveries booked per day by current
+status and package type, with distance and paid revenue) and
+DailyDriverRollup (completions per driver per day), never the live tables,
+so a report costs O(days) whatever the number of deliveries.
+
+The 'analytics' event consumer keeps them current. Every event names a
+delivery, and refresh recounts just those deliveries: DeliveryRollupState
+holds what each delivery is counted as, so only the difference between that
+and the delivery's current row is added to the rollups. Repeated events
+change nothing, and edits that bypass the state machine are picked up with
+the delivery's next event. backfill_rollups runs the same refresh over every
+delivery, window by window.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from api.models import (
+    Assignment, DailyDeliveryRollup, DailyDriverRollup, DeliveryRequest, DeliveryRollupState, EventConsumerOffset,
+)
+from api.utils.reconciliation import window_end
+
+CONSUMER = 'analytics'
+WINDOW = 5000
+
+COUNTED_FIELDS = ('day', 'status', 'package_type', 'distance_km', 'revenue', 'driver_id', 'completed_on')
+
+
+def _state(row, previous, drivers):
+    delivery_id, created_at, updated_at, status, package_type, distance_km, is_paid, price = row
+    state = DeliveryRollupState(
+        delivery_request_id=delivery_id, day=timezone.localdate(created_at), status=status,
+        package_type=package_type, distance_km=distance_km,
+        revenue=price if is_paid and price is not None else Decimal(0),
+    )
+    if status == DeliveryRequest.COMPLETED:
+        state.driver_id = drivers.get(delivery_id)
+        # The completion day is fixed when it is first seen; later edits bump updated_at
+        if previous is not None and previous.completed_on is not None:
+            state.completed_on = previous.completed_on
+        else:
+            state.completed_on = timezone.localdate(updated_at)
+    return state
+
+
+def _count(delivery_deltas, driver_deltas, state, sign):
+    if state is None:
+        return
+    measured = state.distance_km is not None
+    distance = state.distance_km or 0
+    delta = delivery_deltas[(state.day, state.status, state.package_type)]
+    delta[0] += sign
+    delta[1] += sign * distance
+    delta[2] += sign * measured
+    delta[3] += sign * state.revenue
+    if state.completed_on is not None and state.driver_id is not None:
+        delta = driver_deltas[(state.completed_on, state.driver_id)]
+        delta[0] += sign
+        delta[1] += sign * distance
+        delta[2] += sign * state.revenue
+
+
+def _apply(delivery_deltas, driver_deltas):
+    for (day, status, package_type), (deliveries, distance, measured, revenue) in delivery_deltas.items():
+        if not (deliveries or distance or measured or revenue):
+            continue
+        if not DailyDeliveryRollup.objects.filter(day=day, status=status, package_type=package_type).update(
+            deliveries=F('deliveries') + deliveries, distance_km=F('distance_km') + distance,
+            measured=F('measured') + measured, revenue=F('revenue') + revenue,
+        ):
+            DailyDeliveryRollup.objects.create(
+                day=day, status=status, package_type=package_type,
+                deliveries=deliveries, distance_km=distance, measured=measured, revenue=revenue,
+            )
+    for (day, driver_id), (completed, distance, revenue) in driver_deltas.items():
+        if not (completed or distance or revenue):
+            continue
+        if not DailyDriverRollup.objects.filter(day=day, driver_id=driver_id).update(
+            completed=F('completed') + completed, distance_km=F('distance_km') + distance,
+            revenue=F('revenue') + revenue,
+        ):
+            DailyDriverRollup.objects.create(
+                day=day, driver_id=driver_id, completed=completed, distance_km=distance, revenue=revenue,
+            )
+
+
+def _refresh(deliveries, states):
+    """Recount the deliveries selected by ``deliveries`` against the matching ``states``."""
+    with transaction.atomic():
+        # One refresh at a time, so two of them never apply the same difference
+        EventConsumerOffset.objects.select_for_update().get_or_create(consumer=CONSUMER)
+        previous = {state.delivery_request_id: state for state in states}
+        rows = list(deliveries.values_list(
+            'id', 'created_at', 'updated_at', 'status', 'package_type', 'distance_km', 'is_paid', 'price'
+        ))
+        completed = [row[0] for row in rows if row[3] == DeliveryRequest.COMPLETED]
+        drivers = dict(
+            Assignment.objects.filter(delivery_request_id__in=completed, status=Assignment.ACCEPTED)
+            .values_list('delivery_request_id', 'driver_id')
+        ) if completed else {}
+        current = {row[0]: _state(row, previous.get(row[0]), drivers) for row in rows}
+
+        delivery_deltas = defaultdict(lambda: [0, 0.0, 0, Decimal(0)])
+        driver_deltas = defaultdict(lambda: [0, 0.0, Decimal(0)])
+        stale = []
+        for delivery_id in previous.keys() | current.keys():
+            old, new = previous.get(delivery_id), current.get(delivery_id)
+            if old is not None and new is not None and all(
+                getattr(old, field) == getattr(new, field) for field in COUNTED_FIELDS
+            ):
+                continue
+            _count(delivery_deltas, driver_deltas, old, -1)
+            _count(delivery_deltas, driver_deltas, new, 1)
+            stale.append(delivery_id)
+        if not stale:
+            return 0
+
+        _apply(delivery_deltas, driver_deltas)
+        DeliveryRollupState.objects.filter(delivery_request_id__in=stale).delete()
+        DeliveryRollupState.objects.bulk_create([current[delivery_id] for delivery_id in stale if delivery_id in current])
+    return len(stale)
+
+
+def refresh(delivery_ids):
+    """Bring the rollups up to date for ``delivery_ids``. Returns how many deliveries changed."""
+    delivery_ids = list(delivery_ids)
+    return _refresh(
+        DeliveryRequest.objects.filter(id__in=delivery_ids),
+        DeliveryRollupState.objects.filter(delivery_request_id__in=delivery_ids),
+    )
+
+
+def refresh_range(start, stop=None):
+    """refresh for delivery ids in (start, stop], or everything after ``start``."""
+    deliveries = DeliveryRequest.objects.filter(id__gt=start)
+    states = DeliveryRollupState.objects.filter(delivery_request_id__gt=start)
+    if stop is not None:
+        deliveries = deliveries.filter(id__lte=stop)
+        states = states.filter(delivery_request_id__lte=stop)
+    return _refresh(deliveries, states)
+
+
+def rollup_sink(events):
+    """Event sink keeping the rollups current; register it as the 'analytics' consumer."""
+    refresh({event.delivery_request_id for event in events})
+
+
+def backfill(window=WINDOW, reset=False):
+    """Recount every delivery, yielding (last delivery id, changed) after each window."""
+    if reset:
+        with transaction.atomic():
+            EventConsumerOffset.objects.select_for_update().get_or_create(consumer=CONSUMER)
+            DailyDeliveryRollup.objects.all().delete()
+            DailyDriverRollup.objects.all().delete()
+            DeliveryRollupState.objects.all().delete()
+    start = 0
+    while True:
+        stop = window_end(start, window)
+        # The last pass also drops states of deleted deliveries past the highest id
+        yield stop, refresh_range(start, stop)
+        if stop is None:
+            break
+        start = stop
+
+
+# --------------------
+# Reports; each reads only the rollups of the days asked for
+# --------------------
+def daily_revenue(start, end):
+    return list(
+        DailyDeliveryRollup.objects.filter(day__range=(start, end)).values('day')
+        .annotate(revenue=Sum('revenue'), deliveries=Sum('deliveries')).order_by('day')
+    )
+
+
+def status_counts(start, end):
+    return list(
+        DailyDeliveryRollup.objects.filter(day__range=(start, end)).values('status')
+        .annotate(deliveries=Sum('deliveries')).filter(deliveries__gt=0).order_by('status')
+    )
+
+
+def package_types(start, end):
+    rows = (
+        DailyDeliveryRollup.objects.filter(day__range=(start, end)).values('package_type')
+        .annotate(deliveries=Sum('deliveries'), distance_km=Sum('distance_km'), measured=Sum('measured'))
+        .filter(deliveries__gt=0).order_by('package_type')
+    )
+    return [
+        {
+            'package_type': row['package_type'],
+            'deliveries': row['deliveries'],
+            'average_distance_km': round(row['distance_km'] / row['measured'], 3) if row['measured'] else None,
+        }
+        for row in rows
+    ]
+
+
+def driver_completions(start, end):
+    return list(
+        DailyDriverRollup.objects.filter(day__range=(start, end)).values('driver', 'driver__username')
+        .annotate(completed=Sum('completed'), distance_km=Sum('distance_km'), revenue=Sum('revenue'))
+        .filter(completed__gt=0).order_by('-completed', 'driver')
+    )
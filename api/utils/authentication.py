@@ -1,6 +1,121 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# Process-local entries live for LOCAL_TTL seconds; that is also how long
+# another process may keep serving a user after it was changed. The optional
+# shared layer is dropped on every change, so it can live longer.
+LOCAL_TTL = getattr(settings, 'AUTH_USER_CACHE_TTL', 10)
+LOCAL_SIZE = getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000)
+SHARED = getattr(settings, 'AUTH_USER_CACHE_SHARED', False)
+SHARED_TTL = getattr(settings, 'AUTH_USER_CACHE_SHARED_TTL', 300)
+SHARED_KEY = 'auth:user:{}'
+
+
+class UserCache:
+    """Size-bounded LRU of users with a TTL, optionally backed by the Django cache."""
+
+    def __init__(self, size=LOCAL_SIZE, ttl=LOCAL_TTL, shared=SHARED, shared_ttl=SHARED_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, user_id):
+        if not self.ttl:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    # Callers may modify request.user, so never hand out the cached instance
+                    return copy.copy(entry[1])
+                del self._entries[user_id]
+
+        if self.shared:
+            user = cache.get(SHARED_KEY.format(user_id))
+            if user is not None:
+                self._store(user_id, copy.copy(user), now)
+                return user
+        return None
+
+    def set(self, user_id, user):
+        if not self.ttl:
+            return
+        self._store(user_id, copy.copy(user), time.monotonic())
+        if self.shared:
+            cache.set(SHARED_KEY.format(user_id), user, self.shared_ttl)
+
+    def _store(self, user_id, user, now):
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+        if self.shared:
+            cache.delete(SHARED_KEY.format(user_id))
+
+    def invalidate_on_commit(self, user_id):
+        # Drop now, and again once the change is visible to other connections,
+        # so a request reading the old row in between cannot re-cache it.
+        self.invalidate(user_id)
+        transaction.on_commit(lambda: self.invalidate(user_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication resolving the user through user_cache, so a token
+    seen recently costs no query. The active and revoked-token checks
+    still run on every request.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        # Claims may carry the id as int or str; signals invalidate by pk
+        user = user_cache.get(str(user_id))
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(str(user.pk), user)
+            return user
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
 
-class CookieJWTAuthentication(JWTAuthentication):
+class CookieJWTAuthentication(CachedJWTAuthentication):
     def authenticate(self, request):
         access_token = request.COOKIES.get("access_token")
         if not access_token:
@@ -0,0 +1,75 @@
+"""
+Timing, summary statistics and baseline comparison for the benchmark commands.
+"""
+import json
+import platform
+import time
+
+import numpy as np
+from django.db import connection
+
+PERCENTILES = (50, 95, 99)
+# A scenario regresses when its p95 grows by more than this fraction
+DEFAULT_TOLERANCE = 0.2
+
+
+def measure(func, iterations, warmup=0):
+    """Call ``func(i)`` ``warmup + iterations`` times, return the timed samples in seconds."""
+    for index in range(warmup):
+        func(index)
+    samples = []
+    for index in range(warmup, warmup + iterations):
+        started = time.perf_counter()
+        func(index)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def summarize(samples):
+    samples = np.asarray(samples, dtype=float)
+    total = samples.sum()
+    summary = {
+        'iterations': int(samples.size),
+        'throughput': round(samples.size / total, 2) if total else None,
+        'mean_ms': round(samples.mean() * 1000, 3),
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+        summary[f'p{percentile}_ms'] = round(float(value) * 1000, 3)
+    return summary
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'database': connection.vendor,
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as handle:
+        json.dump({'environment': environment(), 'results': results}, handle, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path) as handle:
+        return json.load(handle)['results']
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE, metric='p95_ms'):
+    """
+    ``(scenario, baseline, current, change)`` for every scenario present in
+    both runs, ``change`` being the relative difference of ``metric``, plus
+    the list of scenarios that got slower than ``tolerance`` allows.
+    """
+    rows, regressions = [], []
+    for scenario, current in results.items():
+        previous = baseline.get(scenario)
+        if not previous or not previous.get(metric):
+            continue
+        change = current[metric] / previous[metric] - 1
+        rows.append((scenario, previous[metric], current[metric], change))
+        if change > tolerance:
+            regressions.append(scenario)
+    return rows, regressions
@@ -0,0 +1,196 @@
+"""
+Automatic nearest-driver dispatch.
+
+Driver positions are kept in an in-process uniform grid fed by tracking
+ingestion, so a k-nearest query only looks at the few cells around the pickup
+point. Availability (active, not busy with another delivery) is checked with a
+single query over the candidates the grid returns.
+"""
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Max
+from django.utils import timezone
+
+from api.models import Assignment, DeliveryRequest, Tracking
+from api.utils import state_machine
+from api.utils.distance import KM_PER_DEGREE, haversine_km
+
+User = get_user_model()
+
+# ~1.1 km per cell at the equator
+GRID_CELL_DEGREES = getattr(settings, 'DISPATCH_GRID_CELL_DEGREES', 0.01)
+# Positions older than this are not trusted for dispatch
+MAX_POSITION_AGE = getattr(settings, 'DISPATCH_MAX_POSITION_AGE', 15 * 60)
+SEARCH_RADIUS_KM = getattr(settings, 'DISPATCH_SEARCH_RADIUS_KM', 25)
+CANDIDATES = getattr(settings, 'DISPATCH_CANDIDATES', 10)
+AUTO_REASSIGN = getattr(settings, 'DISPATCH_AUTO_REASSIGN', True)
+
+
+class DriverIndex:
+    """Uniform lat/lng grid of the latest known position of each driver."""
+
+    def __init__(self, cell_degrees=GRID_CELL_DEGREES, max_age=MAX_POSITION_AGE):
+        self.cell_degrees = cell_degrees
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._positions = {}
+        self._loaded = False
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees))
+
+    def _remove(self, driver_id):
+        previous = self._positions.pop(driver_id, None)
+        if previous is not None:
+            cell = self._cells.get(previous[0])
+            if cell is not None:
+                cell.pop(driver_id, None)
+                if not cell:
+                    del self._cells[previous[0]]
+
+    def update(self, driver_id, lat, lng, seen_at=None):
+        seen_at = time.time() if seen_at is None else seen_at
+        cell = self._cell(lat, lng)
+        with self._lock:
+            self._remove(driver_id)
+            self._positions[driver_id] = (cell, lat, lng, seen_at)
+            self._cells.setdefault(cell, {})[driver_id] = (lat, lng, seen_at)
+
+    def remove(self, driver_id):
+        with self._lock:
+            self._remove(driver_id)
+
+    def record_positions(self, points):
+        for point in points:
+            seen_at = point.timestamp.timestamp() if point.timestamp else None
+            self.update(point.driver_id, point.latitude, point.longitude, seen_at)
+
+    def snapshot(self):
+        """``(driver_id, lat, lng)`` for every driver with a fresh position."""
+        stale_before = time.time() - self.max_age
+        with self._lock:
+            return [
+                (driver_id, lat, lng)
+                for driver_id, (_, lat, lng, seen_at) in self._positions.items()
+                if seen_at >= stale_before
+            ]
+
+    def ensure_loaded(self):
+        """Seed the grid from recent tracking rows once per process."""
+        if self._loaded:
+            return
+        cutoff = timezone.now() - timedelta(seconds=self.max_age)
+        latest_ids = (
+            Tracking.objects.filter(timestamp__gte=cutoff)
+            .values('driver_id')
+            .annotate(last_id=Max('id'))
+            .values_list('last_id', flat=True)
+        )
+        points = Tracking.objects.filter(id__in=list(latest_ids))
+        for point in points:
+            if point.driver_id not in self._positions:
+                self.update(point.driver_id, point.latitude, point.longitude, point.timestamp.timestamp())
+        self._loaded = True
+
+    def nearest(self, lat, lng, k=CANDIDATES, max_radius_km=SEARCH_RADIUS_KM, exclude=()):
+        """
+        Up to ``k`` ``(distance_km, driver_id)`` pairs within ``max_radius_km``,
+        nearest first. Rings of cells are scanned outwards until the k-th
+        candidate is closer than any unscanned cell can be.
+        """
+        origin_row, origin_col = self._cell(lat, lng)
+        # Smallest cell side in km around this latitude, so ring r is
+        # guaranteed to cover at least r * cell_km
+        cell_km = self.cell_degrees * KM_PER_DEGREE * max(
+            math.cos(math.radians(min(abs(lat) + self.cell_degrees, 89.9))), 1e-6
+        )
+        max_ring = int(max_radius_km / cell_km) + 1
+        stale_before = time.time() - self.max_age
+
+        found = []
+        stale = []
+        with self._lock:
+            for ring in range(max_ring + 1):
+                ids, lats, lngs = [], [], []
+                for row in range(origin_row - ring, origin_row + ring + 1):
+                    on_edge_row = row in (origin_row - ring, origin_row + ring)
+                    step = 1 if on_edge_row else 2 * ring or 1
+                    for col in range(origin_col - ring, origin_col + ring + 1, step):
+                        for driver_id, (d_lat, d_lng, seen_at) in self._cells.get((row, col), {}).items():
+                            if seen_at < stale_before:
+                                stale.append(driver_id)
+                                continue
+                            if driver_id in exclude:
+                                continue
+                            ids.append(driver_id)
+                            lats.append(d_lat)
+                            lngs.append(d_lng)
+                # One vectorized distance call per ring
+                if ids:
+                    distances = haversine_km(lat, lng, lats, lngs).tolist()
+                    found.extend(
+                        (distance, driver_id) for distance, driver_id in zip(distances, ids)
+                        if distance <= max_radius_km
+                    )
+                if len(found) >= k:
+                    found.sort()
+                    if found[k - 1][0] <= ring * cell_km:
+                        break
+            for driver_id in stale:
+                self._remove(driver_id)
+
+        found.sort()
+        return found[:k]
+
+
+driver_index = DriverIndex()
+
+
+def available_drivers(driver_ids):
+    """Active drivers among ``driver_ids`` with no assignment still in flight."""
+    busy = Assignment.objects.filter(
+        status__in=[Assignment.ASSIGNED, Assignment.ACCEPTED],
+        delivery_request__status__in=[DeliveryRequest.ASSIGNED, DeliveryRequest.IN_PROGRESS],
+    ).values('driver_id')
+    return set(
+        User.objects.filter(id__in=driver_ids, role=User.DRIVER, is_active=True)
+        .exclude(id__in=busy)
+        .values_list('id', flat=True)
+    )
+
+
+def auto_assign(delivery, k=CANDIDATES):
+    """
+    Assign the nearest available driver to a PENDING delivery request.
+    Drivers who already rejected it are skipped. Returns the new Assignment,
+    or None when no driver is available or the delivery was taken meanwhile.
+    """
+    driver_index.ensure_loaded()
+    rejected = set(
+        Assignment.objects.filter(delivery_request=delivery, status=Assignment.REJECTED)
+        .values_list('driver_id', flat=True)
+    )
+    candidates = driver_index.nearest(delivery.pickup_lat, delivery.pickup_lng, k=k, exclude=rejected)
+    if not candidates:
+        return None
+
+    available = available_drivers([driver_id for _, driver_id in candidates])
+    for _, driver_id in candidates:
+        if driver_id not in available:
+            continue
+        try:
+            assignment = state_machine.assign(delivery.pk, driver_id)
+        except state_machine.IllegalTransition:
+            return None
+        delivery.status = DeliveryRequest.ASSIGNED
+        return assignment
+    return None
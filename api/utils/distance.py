@@ -0,0 +1,121 @@
+"""
+Vectorized great-circle and ellipsoidal distances.
+
+All functions take scalars or equally shaped arrays of degrees and return a
+NumPy array of kilometres, so a whole batch of delivery requests is priced in
+one pass instead of one geopy call per row.
+"""
+import numpy as np
+from django.conf import settings
+from geopy.distance import geodesic
+
+HAVERSINE = 'haversine'
+VINCENTY = 'vincenty'
+GEODESIC = 'geodesic'
+METHODS = (HAVERSINE, VINCENTY, GEODESIC)
+
+# Vincenty agrees with geopy's geodesic to well under a metre for anything a
+# delivery covers, so it is the default; GEODESIC keeps the exact Karney solver.
+DEFAULT_METHOD = getattr(settings, 'DISTANCE_METHOD', VINCENTY)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+
+# WGS-84 ellipsoid
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+
+def _as_arrays(*values):
+    return [np.asarray(value, dtype=float) for value in values]
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(np.radians, _as_arrays(lat1, lng1, lat2, lng2))
+    dlat = lat2 - lat1
+    dlng = lng2 - lng1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def geodesic_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = np.broadcast_arrays(*_as_arrays(lat1, lng1, lat2, lng2))
+    distances = np.fromiter(
+        (geodesic((a, b), (c, d)).km for a, b, c, d in zip(lat1.ravel(), lng1.ravel(), lat2.ravel(), lng2.ravel())),
+        dtype=float,
+        count=lat1.size,
+    )
+    return distances.reshape(lat1.shape)
+
+
+def vincenty_km(lat1, lng1, lat2, lng2, max_iterations=50, tolerance=1e-12):
+    """
+    Vincenty's inverse formula on the WGS-84 ellipsoid, iterated on all rows
+    at once. The few rows that do not converge (nearly antipodal points) are
+    handed to geopy's geodesic solver.
+    """
+    lat1, lng1, lat2, lng2 = np.broadcast_arrays(*_as_arrays(lat1, lng1, lat2, lng2))
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    L = np.radians(lng2 - lng1)
+
+    U1 = np.arctan((1 - WGS84_F) * np.tan(phi1))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(phi2))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    delta = np.full(L.shape, np.inf)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Equatorial lines have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            previous = lam
+            lam = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+            delta = np.abs(lam - previous)
+            if not np.any(delta > tolerance):
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (
+            cos_2sigma_m + B / 4 * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+                - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+            )
+        )
+        distances = WGS84_B * A * (sigma - delta_sigma)
+
+    unconverged = ~(delta <= tolerance) | ~np.isfinite(distances)
+    if np.any(unconverged):
+        distances = np.array(distances, copy=True)
+        distances[unconverged] = geodesic_km(
+            lat1[unconverged], lng1[unconverged], lat2[unconverged], lng2[unconverged]
+        )
+    return distances
+
+
+_FUNCTIONS = {
+    HAVERSINE: haversine_km,
+    VINCENTY: vincenty_km,
+    GEODESIC: geodesic_km,
+}
+
+
+def distance_km(lat1, lng1, lat2, lng2, method=None):
+    method = method or DEFAULT_METHOD
+    try:
+        function = _FUNCTIONS[method]
+    except KeyError:
+        raise ValueError(f"Unknown distance method {method!r}, expected one of {', '.join(METHODS)}.")
+    return function(lat1, lng1, lat2, lng2)
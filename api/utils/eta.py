@@ -0,0 +1,117 @@
+"""
+Arrival estimates from live tracking.
+
+Every delivery in flight keeps one cache entry: its dropoff, its latest fix
+and an exponentially weighted moving average of its speed. A tracking point
+updates the entry in O(1) (one get_many and one set_many per batch, plus a
+dropoff lookup the first time a delivery is seen), so an estimate is read
+from the cache without touching the tracking history.
+
+Speed samples are taken between fixes at least MIN_INTERVAL seconds apart:
+buffered fixes uploaded together carry near-identical server timestamps and
+would otherwise read as absurd speeds. The weight of a sample grows with the
+time it covers, 1 - exp(-dt / SMOOTHING), so irregular reporting intervals
+average out.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from api.models import DeliveryRequest
+from api.utils.distance import haversine_km
+
+KEY = 'eta:delivery:{}'
+
+TIMEOUT = getattr(settings, 'TRACKING_CACHE_TIMEOUT', 60 * 60 * 24)
+SMOOTHING = getattr(settings, 'ETA_SMOOTHING_SECONDS', 120)
+MIN_INTERVAL = getattr(settings, 'ETA_MIN_INTERVAL_SECONDS', 5)
+# Faster samples are GPS jumps, not driving
+MAX_SPEED_KMH = getattr(settings, 'ETA_MAX_SPEED_KMH', 150)
+# A driver stuck in traffic still arrives eventually
+MIN_SPEED_KMH = getattr(settings, 'ETA_MIN_SPEED_KMH', 5)
+DEFAULT_SPEED_KMH = getattr(settings, 'ETA_DEFAULT_SPEED_KMH', 25)
+# Roads are longer than the straight line to the dropoff
+ROUTE_FACTOR = getattr(settings, 'ETA_ROUTE_FACTOR', 1.3)
+
+
+def _distance_km(lat1, lng1, lat2, lng2):
+    return float(haversine_km(lat1, lng1, lat2, lng2))
+
+
+def _observe(state, latitude, longitude, at):
+    state['latitude'], state['longitude'], state['at'] = latitude, longitude, at
+    anchor_lat, anchor_lng, anchor_at = state['anchor']
+    elapsed = at - anchor_at
+    if elapsed < MIN_INTERVAL:
+        return
+    speed = _distance_km(anchor_lat, anchor_lng, latitude, longitude) / (elapsed / 3600)
+    if speed <= MAX_SPEED_KMH:
+        if state['speed_kmh'] is None:
+            state['speed_kmh'] = speed
+        else:
+            weight = 1 - math.exp(-elapsed / SMOOTHING)
+            state['speed_kmh'] += weight * (speed - state['speed_kmh'])
+    state['anchor'] = [latitude, longitude, at]
+
+
+def record_positions(points):
+    """Fold freshly inserted tracking points, in arrival order, into the speed estimates."""
+    if not points:
+        return
+    keys = {point.delivery_request_id: KEY.format(point.delivery_request_id) for point in points}
+    cached = cache.get_many(keys.values())
+    states = {delivery_id: cached[key] for delivery_id, key in keys.items() if key in cached}
+    missing = [delivery_id for delivery_id in keys if delivery_id not in states]
+    dropoffs = {
+        delivery_id: [lat, lng]
+        for delivery_id, lat, lng in DeliveryRequest.objects.filter(id__in=missing).values_list(
+            'id', 'dropoff_lat', 'dropoff_lng'
+        )
+    } if missing else {}
+
+    for point in points:
+        at = (point.timestamp or timezone.now()).timestamp()
+        state = states.get(point.delivery_request_id)
+        if state is None:
+            if point.delivery_request_id not in dropoffs:
+                continue
+            state = states[point.delivery_request_id] = {
+                'dropoff': dropoffs[point.delivery_request_id],
+                'anchor': [point.latitude, point.longitude, at],
+                'latitude': point.latitude, 'longitude': point.longitude, 'at': at,
+                'speed_kmh': None,
+            }
+        elif at < state['at']:
+            # Late fix; the newer position already stands
+            continue
+        _observe(state, point.latitude, point.longitude, at)
+
+    cache.set_many({keys[delivery_id]: state for delivery_id, state in states.items()}, TIMEOUT)
+
+
+def estimate(delivery_request_id, now=None):
+    """Remaining distance and expected arrival of a delivery, or None before its first fix."""
+    state = cache.get(KEY.format(delivery_request_id))
+    if state is None:
+        return None
+    now = now or timezone.now()
+    remaining_km = _distance_km(state['latitude'], state['longitude'], *state['dropoff']) * ROUTE_FACTOR
+    speed_kmh = state['speed_kmh']
+    effective_speed = DEFAULT_SPEED_KMH if speed_kmh is None else max(speed_kmh, MIN_SPEED_KMH)
+    last_fix = datetime.fromtimestamp(state['at'], tz=dt_timezone.utc)
+    arrival = last_fix + timedelta(hours=remaining_km / effective_speed)
+    return {
+        'delivery_request': delivery_request_id,
+        'remaining_km': round(remaining_km, 3),
+        'speed_kmh': None if speed_kmh is None else round(speed_kmh, 1),
+        'eta_seconds': max(0, round((arrival - now).total_seconds())),
+        'estimated_arrival': arrival.isoformat(),
+        'last_fix': last_fix.isoformat(),
+    }
+
+
+def forget(delivery_request_id):
+    cache.delete(KEY.format(delivery_request_id))
@@ -0,0 +1,191 @@
+"""
+Delivery lifecycle events.
+
+State changes call record_event inside their own transaction, so an event
+exists exactly when the change committed and costs the request one insert.
+The dispatch_events worker hands each consumer (a sink) the events past its
+stored offset in id order, and only moves the offset once the sink returned:
+delivery is at least once, so sinks must tolerate repeats.
+
+Ids are allocated before commit, so a lower id can become visible after a
+higher one. A batch therefore stops at a gap in the ids until the event after
+it is GAP_TIMEOUT seconds old, which covers ordinary requests. The offset then
+moves past the gap, but the gap is kept on the offset and rechecked on every
+poll: events of a long transaction (a large import chunk) that commit later
+are still delivered, only out of order. A gap is forgotten after
+GAP_RETENTION seconds, when its ids are taken to belong to rolled back
+transactions.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import time
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from api.models import DeliveryEvent, EventConsumerOffset
+from api.utils import live
+
+# consumer name -> dotted path of a callable taking a list of events
+SINKS = getattr(settings, 'EVENT_SINKS', {'log': 'api.utils.events.log_sink'})
+# Every URL is its own consumer, so one slow endpoint does not hold up the others
+WEBHOOK_URLS = getattr(settings, 'EVENT_WEBHOOK_URLS', [])
+WEBHOOK_SECRET = getattr(settings, 'EVENT_WEBHOOK_SECRET', '')
+WEBHOOK_TIMEOUT = getattr(settings, 'EVENT_WEBHOOK_TIMEOUT', 10)
+GAP_TIMEOUT = getattr(settings, 'EVENT_GAP_TIMEOUT', 5)
+GAP_RETENTION = getattr(settings, 'EVENT_GAP_RETENTION', 60 * 60 * 24)
+BATCH_SIZE = 500
+
+logger = logging.getLogger('api.events')
+
+
+def record_event(event_type, delivery_request_id, **payload):
+    """Must run in the transaction of the change it describes."""
+    return DeliveryEvent.objects.create(
+        event_type=event_type, delivery_request_id=delivery_request_id, payload=payload
+    )
+
+
+def record_events(event_type, events):
+    """Bulk record_event for (delivery_request_id, payload) pairs."""
+    return DeliveryEvent.objects.bulk_create([
+        DeliveryEvent(event_type=event_type, delivery_request_id=delivery_request_id, payload=payload)
+        for delivery_request_id, payload in events
+    ])
+
+
+def serialize(event):
+    return {
+        'id': event.id,
+        'type': event.event_type,
+        'delivery_request': event.delivery_request_id,
+        'payload': event.payload,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+def log_sink(events):
+    for event in events:
+        logger.info(json.dumps(serialize(event)))
+
+
+def live_sink(events):
+    """
+    Publish status changes to the live tracking hub. The hub is per process,
+    so this only reaches streams when the dispatcher runs in the web process.
+    """
+    for event in events:
+        if 'status' in event.payload:
+            live.publish_status(event.delivery_request_id, event.payload['status'])
+
+
+class WebhookSink:
+    """POSTs each batch as {"events": [...]}, signed with HMAC-SHA256 when a secret is set."""
+
+    def __init__(self, url, secret=WEBHOOK_SECRET, timeout=WEBHOOK_TIMEOUT):
+        self.url = url
+        self.secret = secret
+        self.timeout = timeout
+
+    def __call__(self, events):
+        body = json.dumps({'events': [serialize(event) for event in events]}).encode()
+        headers = {'Content-Type': 'application/json'}
+        if self.secret:
+            headers['X-Orion-Signature'] = hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+        request = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+        # Raises on connection errors and non-2xx responses, leaving the offset in place
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+def configured_sinks():
+    sinks = {name: import_string(path) for name, path in SINKS.items()}
+    for url in WEBHOOK_URLS:
+        sinks[f"webhook:{hashlib.sha1(url.encode()).hexdigest()[:12]}"] = WebhookSink(url)
+    return sinks
+
+
+def pending(offset, batch_size=BATCH_SIZE, now=None):
+    """Events after ``offset`` that are safe to deliver, in id order."""
+    horizon = (now or timezone.now()) - timedelta(seconds=GAP_TIMEOUT)
+    events = []
+    expected = offset + 1
+    for event in DeliveryEvent.objects.filter(id__gt=offset).order_by('id')[:batch_size]:
+        if event.id != expected and event.created_at > horizon:
+            break
+        events.append(event)
+        expected = event.id + 1
+    return events
+
+
+def gaps(offset, events):
+    """(first id, last id) of every id range ``events`` step over after ``offset``."""
+    found = []
+    expected = offset + 1
+    for event in events:
+        if event.id != expected:
+            found.append((expected, event.id - 1))
+        expected = event.id + 1
+    return found
+
+
+def late_events(skipped, batch_size=BATCH_SIZE):
+    """Events that have since committed inside the ``skipped`` ranges, in id order."""
+    if not skipped:
+        return []
+    ranges = Q()
+    for first, last, _ in skipped:
+        ranges |= Q(id__range=(first, last))
+    return list(DeliveryEvent.objects.filter(ranges).order_by('id')[:batch_size])
+
+
+def _remaining(skipped, delivered, now):
+    """``skipped`` without the delivered ids and the expired ranges."""
+    remaining = []
+    for first, last, skipped_at in skipped:
+        if now - skipped_at > GAP_RETENTION:
+            logger.warning("Giving up on events %s-%s, presumed rolled back.", first, last)
+            continue
+        for event_id in sorted(event_id for event_id in delivered if first <= event_id <= last):
+            if event_id > first:
+                remaining.append([first, event_id - 1, skipped_at])
+            first = event_id + 1
+        if first <= last:
+            remaining.append([first, last, skipped_at])
+    return remaining
+
+
+def dispatch(consumer, sink, batch_size=BATCH_SIZE):
+    """Deliver the next batch to ``sink`` and advance the offset. Returns the number delivered."""
+    offset, _ = EventConsumerOffset.objects.get_or_create(consumer=consumer)
+    late = late_events(offset.skipped, batch_size)
+    events = pending(offset.last_event_id, batch_size - len(late)) if len(late) < batch_size else []
+    now = time.time()
+    skipped = _remaining(offset.skipped, {event.id for event in late}, now)
+    skipped += [[first, last, now] for first, last in gaps(offset.last_event_id, events)]
+    if not late and not events:
+        if skipped != offset.skipped:
+            EventConsumerOffset.objects.filter(pk=offset.pk).update(skipped=skipped)
+        return 0
+    sink(late + events)
+    # Conditional, so a concurrent dispatcher of the same consumer never moves it backwards
+    EventConsumerOffset.objects.filter(consumer=consumer, last_event_id=offset.last_event_id).update(
+        last_event_id=events[-1].id if events else offset.last_event_id, skipped=skipped, updated_at=timezone.now()
+    )
+    return len(late) + len(events)
+
+
+def purge_consumed(consumers, older_than):
+    """Delete events every given consumer has processed and that are older than ``older_than``."""
+    offsets = dict(EventConsumerOffset.objects.filter(consumer__in=consumers).values_list('consumer', 'last_event_id'))
+    if not consumers or len(offsets) < len(consumers):
+        return 0
+    return DeliveryEvent.objects.filter(
+        id__lte=min(offsets.values()), created_at__lt=timezone.now() - older_than
+    ).delete()[0]
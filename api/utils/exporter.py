@@ -0,0 +1,156 @@
+"""
+Streaming exports of deliveries and tracking points.
+
+Rows are read as plain tuples with values_list, in (timestamp, id) order on
+the indexes the list endpoints already use, one keyset page of PAGE_SIZE rows
+per query. Each page is encoded and handed to the response (or file) before
+the next is read, so memory stays bounded by a page whatever the size of the
+export. Separate page queries rather than one long cursor keep that true on
+MySQL, whose drivers buffer a whole result set even through iterator(), and
+never hold a transaction open for the length of a download.
+"""
+import csv
+import json
+import zlib
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models import DeliveryRequest, Tracking
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+FORMATS = (NDJSON, CSV)
+CONTENT_TYPES = {NDJSON: 'application/x-ndjson', CSV: 'text/csv'}
+
+PAGE_SIZE = 2000
+
+
+class Dataset:
+    def __init__(self, model, time_field, fields, status_field):
+        self.model = model
+        self.time_field = time_field
+        self.fields = fields
+        self.status_field = status_field
+
+
+DATASETS = {
+    'deliveries': Dataset(
+        DeliveryRequest, 'created_at',
+        ('id', 'customer_id', 'pickup_address', 'dropoff_address', 'package_type',
+         'pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng', 'distance_km', 'price',
+         'status', 'is_paid', 'created_at', 'updated_at'),
+        'status',
+    ),
+    'tracking': Dataset(
+        Tracking, 'timestamp',
+        ('id', 'delivery_request_id', 'driver_id', 'latitude', 'longitude', 'timestamp'),
+        'delivery_request__status',
+    ),
+}
+STATUSES = {value for value, _ in DeliveryRequest.STATUS_CHOICES}
+
+
+class ExportError(Exception):
+    pass
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def queryset(dataset, start=None, end=None, statuses=None):
+    """Rows of ``dataset`` from day ``start`` through day ``end``, optionally of some delivery statuses."""
+    if statuses and not set(statuses) <= STATUSES:
+        raise ExportError(f"Unknown status, expected some of {', '.join(sorted(STATUSES))}.")
+    rows = dataset.model.objects.all()
+    if start is not None:
+        rows = rows.filter(**{f'{dataset.time_field}__gte': _day_start(start)})
+    if end is not None:
+        rows = rows.filter(**{f'{dataset.time_field}__lt': _day_start(end + timedelta(days=1))})
+    if statuses:
+        rows = rows.filter(**{f'{dataset.status_field}__in': statuses})
+    return rows
+
+
+def pages(dataset, rows, page_size=PAGE_SIZE):
+    """Yield lists of value tuples, walking (time_field, id) one keyset page per query."""
+    time_field = dataset.time_field
+    fields = (time_field, 'id') + dataset.fields
+    last = None
+    while True:
+        page = rows
+        if last is not None:
+            page = page.filter(Q(**{f'{time_field}__gt': last[0]}) | Q(**{time_field: last[0], 'id__gt': last[1]}))
+        page = list(page.order_by(time_field, 'id').values_list(*fields)[:page_size])
+        if not page:
+            return
+        last = page[-1][:2]
+        yield [row[2:] for row in page]
+        if len(page) < page_size:
+            return
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    # Decimal prices keep their exact digits
+    return str(value)
+
+
+class _Lines:
+    """File-like sink for csv.writer that collects what it writes."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def take(self):
+        text = ''.join(self.parts)
+        self.parts = []
+        return text
+
+
+def encode(dataset, fmt, row_pages):
+    """Yield text chunks, one per page (plus the CSV header)."""
+    if fmt == NDJSON:
+        for page in row_pages:
+            yield ''.join(
+                json.dumps(dict(zip(dataset.fields, map(_value, row)))) + '\n' for row in page
+            )
+        return
+    lines = _Lines()
+    writer = csv.writer(lines)
+    writer.writerow(dataset.fields)
+    yield lines.take()
+    for page in row_pages:
+        writer.writerows([[_value(value) for value in row] for row in page])
+        yield lines.take()
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(name, fmt, start=None, end=None, statuses=None, compress=False, page_size=PAGE_SIZE):
+    """Bytes chunks of the whole export; filters are validated before the first chunk."""
+    if name not in DATASETS:
+        raise ExportError(f"Unknown dataset, expected one of {', '.join(DATASETS)}.")
+    if fmt not in FORMATS:
+        raise ExportError(f"Unsupported format, expected one of {', '.join(FORMATS)}.")
+    if start is not None and end is not None and start > end:
+        raise ExportError("start must not be after end.")
+    dataset = DATASETS[name]
+    rows = queryset(dataset, start, end, statuses)
+    chunks = (text.encode() for text in encode(dataset, fmt, pages(dataset, rows, page_size)))
+    return gzipped(chunks) if compress else chunks
@@ -0,0 +1,138 @@
+"""
+Geohash encoding and radius covering.
+
+Pickup and dropoff points are stored as geohash strings, so every point
+inside a geohash cell shares the cell's string as a prefix. A radius query is
+turned into the handful of cells covering the circle, which are then looked
+up as index range scans (``prefix <= hash < next prefix``) before the exact
+distance is checked on the few rows that come back.
+"""
+import math
+
+import numpy as np
+
+from api.utils.distance import KM_PER_DEGREE
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# ~5 m x 5 m cells, far finer than any radius a query will use
+PRECISION = 9
+# Index range scans per radius query
+MAX_COVERING_CELLS = 32
+
+_CHARS = np.array(list(BASE32))
+
+
+def _bits(precision):
+    """Number of ``(lat, lng)`` bits in a hash of ``precision`` characters."""
+    total = 5 * precision
+    return total // 2, total - total // 2
+
+
+def cell_size(precision):
+    """``(lat_degrees, lng_degrees)`` spanned by one cell."""
+    lat_bits, lng_bits = _bits(precision)
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def encode_many(lats, lngs, precision=PRECISION):
+    """Vectorized geohash of equally shaped arrays of degrees."""
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lngs = np.atleast_1d(np.asarray(lngs, dtype=float))
+    lat_bits, lng_bits = _bits(precision)
+    # Quantizing to 2**bits buckets gives the same bits as repeated bisection
+    lat_q = np.clip(np.floor((lats + 90.0) / 180.0 * 2 ** lat_bits), 0, 2 ** lat_bits - 1).astype(np.int64)
+    lng_q = np.clip(np.floor((lngs + 180.0) / 360.0 * 2 ** lng_bits), 0, 2 ** lng_bits - 1).astype(np.int64)
+
+    # Interleave, longitude first
+    code = np.zeros(lats.shape, dtype=np.int64)
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            value = (lng_q >> (lng_bits - 1 - bit // 2)) & 1
+        else:
+            value = (lat_q >> (lat_bits - 1 - bit // 2)) & 1
+        code = (code << 1) | value
+
+    chars = [_CHARS[(code >> (5 * (precision - 1 - position))) & 31] for position in range(precision)]
+    return [''.join(row) for row in np.stack(chars, axis=-1).reshape(-1, precision).tolist()]
+
+
+def encode(lat, lng, precision=PRECISION):
+    return encode_many([lat], [lng], precision)[0]
+
+
+def next_prefix(prefix):
+    """
+    Smallest hash prefix sorting after every hash that starts with ``prefix``,
+    or None when there is none. Built from BASE32 characters only, so the
+    order holds under any database collation.
+    """
+    prefix = prefix.rstrip(BASE32[-1])
+    if not prefix:
+        return None
+    return prefix[:-1] + BASE32[BASE32.index(prefix[-1]) + 1]
+
+
+def decode(geohash):
+    """Centre ``(lat, lng)`` of a geohash cell."""
+    code = 0
+    for char in geohash:
+        code = (code << 5) | BASE32.index(char)
+    lat_bits, lng_bits = _bits(len(geohash))
+    lat_q = lng_q = 0
+    for bit in range(5 * len(geohash)):
+        value = (code >> (5 * len(geohash) - 1 - bit)) & 1
+        if bit % 2 == 0:
+            lng_q = (lng_q << 1) | value
+        else:
+            lat_q = (lat_q << 1) | value
+    lat_size, lng_size = cell_size(len(geohash))
+    return -90.0 + (lat_q + 0.5) * lat_size, -180.0 + (lng_q + 0.5) * lng_size
+
+
+def _bounding_box(lat, lng, radius_km):
+    """
+    ``(south, north, west, east)`` degrees around the circle; west and east
+    are None when the box spans every longitude (a pole is within reach).
+    """
+    d_lat = radius_km / KM_PER_DEGREE
+    south, north = max(lat - d_lat, -90.0), min(lat + d_lat, 90.0)
+    widest_lat = max(abs(south), abs(north))
+    if widest_lat >= 90.0:
+        return south, north, None, None
+    d_lng = radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest_lat)))
+    if d_lng >= 180.0:
+        return south, north, None, None
+    # East may pass 180; cells are wrapped when they are listed
+    return south, north, lng - d_lng, lng + d_lng
+
+
+def covering_cells(lat, lng, radius_km, max_cells=MAX_COVERING_CELLS):
+    """
+    Distinct geohash prefixes whose cells cover the circle around a point:
+    every cell overlapping the circle's bounding box, at the finest precision
+    that needs no more than ``max_cells`` of them. The cells are then about
+    the size of the query, so the rows they hold are mostly inside the circle.
+    """
+    south, north, west, east = _bounding_box(lat, lng, radius_km)
+    for precision in range(PRECISION, 0, -1):
+        lat_size, lng_size = cell_size(precision)
+        lat_bits, lng_bits = _bits(precision)
+        first_row = int((south + 90.0) // lat_size)
+        last_row = min(int((north + 90.0) // lat_size), 2 ** lat_bits - 1)
+        if west is None:
+            first_col, columns = 0, 2 ** lng_bits
+        else:
+            first_col = int((west + 180.0) // lng_size)
+            columns = min(int((east + 180.0) // lng_size) - first_col + 1, 2 ** lng_bits)
+        if first_row == 0 and last_row == 2 ** lat_bits - 1 and columns == 2 ** lng_bits:
+            break
+        if (last_row - first_row + 1) * columns > max_cells:
+            continue
+        rows = np.arange(first_row, last_row + 1)
+        cols = (np.arange(first_col, first_col + columns) % 2 ** lng_bits)
+        rows, cols = np.meshgrid(rows, cols)
+        lats = -90.0 + (rows.ravel() + 0.5) * lat_size
+        lngs = -180.0 + (cols.ravel() + 0.5) * lng_size
+        return sorted(set(encode_many(lats, lngs, precision)))
+    # The circle spans a sizeable part of the globe
+    return ['']
@@ -0,0 +1,234 @@
+"""
+Streaming import of delivery requests from CSV or NDJSON manifests.
+
+The file is read row by row, rows are checked by a small hand-written
+validator (no serializer or DB lookups per row), and valid rows are priced and
+inserted one chunk at a time. Invalid rows are reported without stopping the
+import; that includes lines that are not UTF-8 or not well-formed CSV, which
+are decoded and parsed one at a time so a bad byte costs only its own row.
+"""
+import csv
+import json
+import uuid
+
+from django.db import DatabaseError, transaction
+
+from api.models import DeliveryEvent, DeliveryRequest
+from api.utils import events
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = (CSV, NDJSON)
+
+DEFAULT_CHUNK_SIZE = 500
+# Keep the error report bounded even for a completely broken file
+MAX_REPORTED_ERRORS = 1000
+
+ADDRESS_FIELDS = ('pickup_address', 'dropoff_address')
+COORDINATE_LIMITS = {
+    'pickup_lat': 90,
+    'pickup_lng': 180,
+    'dropoff_lat': 90,
+    'dropoff_lng': 180,
+}
+PACKAGE_TYPES = {choice for choice, _ in DeliveryRequest.PACKAGE_TYPE_CHOICES}
+ADDRESS_MAX_LENGTH = DeliveryRequest._meta.get_field('pickup_address').max_length
+
+
+def detect_format(filename):
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl')):
+        return NDJSON
+    return CSV
+
+
+NOT_UTF8 = {'non_field_errors': ['Not valid UTF-8.']}
+
+
+def _text_lines(stream, bad_lines):
+    """
+    Decode ``stream`` line by line. Lines that are not UTF-8 are recorded in
+    ``bad_lines`` and decoded with replacement characters, which keeps their
+    quotes and delimiters for the CSV reader.
+    """
+    for line_number, line in enumerate(stream, start=1):
+        if isinstance(line, bytes):
+            encoding = 'utf-8-sig' if line_number == 1 else 'utf-8'
+            try:
+                line = line.decode(encoding)
+            except UnicodeDecodeError:
+                bad_lines.append(line_number)
+                line = line.decode(encoding, errors='replace')
+        yield line
+
+
+def _csv_rows(lines, bad_lines):
+    reader = csv.reader(lines)
+    fieldnames = None
+    end = 0
+    while True:
+        start = end + 1
+        try:
+            values = next(reader)
+            error = None
+        except StopIteration:
+            break
+        except csv.Error as exc:
+            values, error = None, {'non_field_errors': [f'Malformed CSV: {exc}.']}
+        end = reader.line_num
+
+        # A record spanning an undecodable line is dropped with it
+        broken = [line for line in bad_lines if line >= start]
+        bad_lines.clear()
+        for line in broken:
+            yield line, None, NOT_UTF8
+        if broken:
+            continue
+        if error:
+            yield end, None, error
+        elif not values:
+            continue
+        elif fieldnames is None:
+            fieldnames = values
+        else:
+            yield end, dict(zip(fieldnames, values)), None
+
+
+def iter_rows(stream, fmt):
+    """
+    Yield ``(line_number, row, error)`` for every record in ``stream``, which
+    may be a binary or text file object. Nothing is read ahead of the row
+    being yielded.
+    """
+    bad_lines = []
+    lines = _text_lines(stream, bad_lines)
+
+    if fmt == CSV:
+        yield from _csv_rows(lines, bad_lines)
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        if bad_lines:
+            bad_lines.clear()
+            yield line_number, None, NOT_UTF8
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None, {'non_field_errors': ['Invalid JSON.']}
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, {'non_field_errors': ['Expected a JSON object.']}
+            continue
+        yield line_number, row, None
+
+
+def validate_row(row):
+    """Return ``(cleaned, errors)`` for one raw manifest row."""
+    cleaned = {}
+    errors = {}
+
+    for field in ADDRESS_FIELDS:
+        value = row.get(field)
+        value = value.strip() if isinstance(value, str) else None
+        if not value:
+            errors[field] = ['This field is required.']
+        elif len(value) > ADDRESS_MAX_LENGTH:
+            errors[field] = [f'Ensure this field has no more than {ADDRESS_MAX_LENGTH} characters.']
+        else:
+            cleaned[field] = value
+
+    for field, limit in COORDINATE_LIMITS.items():
+        value = row.get(field)
+        if value in (None, ''):
+            errors[field] = ['This field is required.']
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            errors[field] = ['A valid number is required.']
+            continue
+        if not -limit <= value <= limit:
+            errors[field] = [f'Must be between {-limit} and {limit}.']
+            continue
+        cleaned[field] = value
+
+    package_type = row.get('package_type') or DeliveryRequest.PARCEL
+    if package_type not in PACKAGE_TYPES:
+        errors['package_type'] = [f'"{package_type}" is not a valid choice.']
+    else:
+        cleaned['package_type'] = package_type
+
+    return cleaned, errors
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def _created_ids(chunk):
+    if chunk[0].pk is not None:
+        return [delivery.pk for delivery in chunk]
+    # MySQL does not return primary keys from bulk inserts; read back the chunk's marker
+    return list(
+        DeliveryRequest.objects.filter(import_batch=chunk[0].import_batch).order_by('id').values_list('id', flat=True)
+    )
+
+
+def _write_chunk(chunk, lines, result):
+    DeliveryRequest.populate_derived_fields(chunk)
+    batch = uuid.uuid4()
+    for delivery in chunk:
+        delivery.import_batch = batch
+    try:
+        with transaction.atomic():
+            DeliveryRequest.objects.bulk_create(chunk)
+            events.record_events(DeliveryEvent.DELIVERY_CREATED, [
+                (delivery_id, {'status': DeliveryRequest.PENDING}) for delivery_id in _created_ids(chunk)
+            ])
+    except DatabaseError as exc:
+        for line in lines:
+            result.add_error(line, {'non_field_errors': [f'Could not be saved: {exc}']})
+        return
+    result.created += len(chunk)
+
+
+def import_deliveries(stream, customer, fmt=CSV, chunk_size=DEFAULT_CHUNK_SIZE):
+    result = ImportResult()
+    chunk = []
+    lines = []
+
+    for line, row, errors in iter_rows(stream, fmt):
+        if errors is None:
+            cleaned, errors = validate_row(row)
+        if errors:
+            result.add_error(line, errors)
+            continue
+
+        chunk.append(DeliveryRequest(customer=customer, **cleaned))
+        lines.append(line)
+        if len(chunk) >= chunk_size:
+            _write_chunk(chunk, lines, result)
+            chunk, lines = [], []
+
+    if chunk:
+        _write_chunk(chunk, lines, result)
+    return result
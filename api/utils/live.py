@@ -0,0 +1,130 @@
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+
+from django.core.handlers.asgi import ASGIRequest
+from rest_framework.renderers import BaseRenderer
+
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+
+
+def _offer(queue, message):
+    # Runs on the subscriber's loop. A slow consumer loses its oldest
+    # messages instead of blocking the publisher or growing without bound.
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+class TrackingHub:
+    """
+    In-process fan-out of delivery events to live subscribers.
+
+    Subscribers are asyncio queues living on the event loop of the ASGI
+    server, publishers are the (usually sync) views running in worker threads,
+    so messages are handed over with ``call_soon_threadsafe``. Nothing is
+    persisted and nothing is re-queried: one publish reaches every open stream
+    for that delivery request in this process.
+    """
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    @contextmanager
+    def subscribe(self, delivery_request_id):
+        """Register a queue for ``delivery_request_id`` on the running loop."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        subscriber = (loop, queue)
+        with self._lock:
+            self._subscribers.setdefault(delivery_request_id, set()).add(subscriber)
+        try:
+            yield queue
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(delivery_request_id)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._subscribers[delivery_request_id]
+
+    def publish(self, delivery_request_id, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(delivery_request_id, ()))
+        message = {'event': event, 'data': data}
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # The subscriber's loop is closed; its stream is going away
+                pass
+
+    def subscriber_count(self, delivery_request_id):
+        with self._lock:
+            return len(self._subscribers.get(delivery_request_id, ()))
+
+
+hub = TrackingHub()
+
+
+def publish_positions(points):
+    for point in points:
+        hub.publish(point.delivery_request_id, 'position', {
+            'delivery_request': point.delivery_request_id,
+            'driver': point.driver_id,
+            'latitude': point.latitude,
+            'longitude': point.longitude,
+            'timestamp': point.timestamp.isoformat() if point.timestamp else None,
+        })
+
+
+def publish_status(delivery_request_id, status):
+    hub.publish(delivery_request_id, 'status', {
+        'delivery_request': delivery_request_id,
+        'status': status,
+    })
+
+
+def can_stream(request):
+    """
+    Streams are only served through the ASGI application. Under WSGI the
+    endless stream would hold a worker for as long as the client listens.
+    """
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def event_stream(delivery_request_id, initial=None):
+    """
+    Server-Sent Events body for one delivery request. Must be served through
+    the ASGI application (see can_stream).
+    """
+    with hub.subscribe(delivery_request_id) as queue:
+        if initial is not None:
+            yield format_event('position', initial)
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_event(message['event'], message['data'])
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets DRF negotiate ``Accept: text/event-stream``; errors are sent as JSON."""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data).encode(self.charset)
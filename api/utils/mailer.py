@@ -0,0 +1,115 @@
+"""
+Email outbox.
+
+Views only enqueue an OutboundEmail row; the send_queued_mail worker claims
+due rows in batches, sends them over one reused backend connection and
+retries failures with exponential backoff. A claim is a lease: rows of a
+worker that died mid-batch become due again after CLAIM_TIMEOUT seconds.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from api.models import OutboundEmail
+
+MAX_ATTEMPTS = getattr(settings, 'MAIL_OUTBOX_MAX_ATTEMPTS', 5)
+# Attempt n waits RETRY_DELAY * 2 ** (n - 1) seconds, at most MAX_RETRY_DELAY
+RETRY_DELAY = getattr(settings, 'MAIL_OUTBOX_RETRY_DELAY', 60)
+MAX_RETRY_DELAY = getattr(settings, 'MAIL_OUTBOX_MAX_RETRY_DELAY', 3600)
+CLAIM_TIMEOUT = getattr(settings, 'MAIL_OUTBOX_CLAIM_TIMEOUT', 300)
+
+
+def enqueue(subject, body, to, from_email=None, sensitive=False):
+    """``sensitive`` bodies (e.g. temporary passwords) are wiped once no longer needed for delivery."""
+    return OutboundEmail.objects.create(
+        subject=subject, body=body, to=list(to), from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        sensitive=sensitive,
+    )
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY))
+
+
+def _due(now):
+    return Q(status__in=[OutboundEmail.PENDING, OutboundEmail.SENDING], next_attempt_at__lte=now)
+
+
+def claim(batch_size, now=None):
+    """Lease up to batch_size due emails to this worker and return them."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        rows = OutboundEmail.objects.filter(_due(now)).order_by('next_attempt_at', 'id')
+        # Concurrent workers skip each other's rows where the database allows it
+        rows = rows.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+        emails = list(rows[:batch_size])
+        OutboundEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            status=OutboundEmail.SENDING, next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT)
+        )
+    return emails
+
+
+def send_batch(batch_size=100):
+    """Send one batch of due emails. Returns the sent, retrying and failed counts."""
+    emails = claim(batch_size)
+    counts = {'sent': 0, 'retrying': 0, 'failed': 0}
+    if not emails:
+        return counts
+
+    backend = get_connection(fail_silently=False)
+    try:
+        backend.open()
+        open_error = None
+    except Exception as error:
+        # Still counts as an attempt for every claimed email
+        open_error = error
+
+    try:
+        for email in emails:
+            error = open_error
+            if open_error is None:
+                message = EmailMessage(email.subject, email.body, email.from_email, email.to, connection=backend)
+                try:
+                    backend.send_messages([message])
+                except Exception as send_error:
+                    error = send_error
+
+            now = timezone.now()
+            email.attempts += 1
+            if error is None:
+                email.status, email.sent_at, email.last_error = OutboundEmail.SENT, now, ''
+                counts['sent'] += 1
+            else:
+                email.last_error = f'{type(error).__name__}: {error}'
+                if email.attempts >= MAX_ATTEMPTS:
+                    email.status = OutboundEmail.FAILED
+                    counts['failed'] += 1
+                else:
+                    email.status, email.next_attempt_at = OutboundEmail.PENDING, now + retry_delay(email.attempts)
+                    counts['retrying'] += 1
+            if email.sensitive and email.status in (OutboundEmail.SENT, OutboundEmail.FAILED):
+                email.body = ''
+    finally:
+        if open_error is None:
+            backend.close()
+
+    OutboundEmail.objects.bulk_update(
+        emails, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at', 'body']
+    )
+    return counts
+
+
+def status_counts():
+    counts = dict(OutboundEmail.objects.values_list('status').annotate(count=Count('id')))
+    counts = {status: counts.get(status, 0) for status, _ in OutboundEmail.STATUS_CHOICES}
+    counts['due'] = OutboundEmail.objects.filter(_due(timezone.now())).count()
+    return counts
+
+
+def purge_sent(older_than):
+    """Delete sent emails older than the given timedelta."""
+    return OutboundEmail.objects.filter(status=OutboundEmail.SENT, sent_at__lt=timezone.now() - older_than).delete()[0]
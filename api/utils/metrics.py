@@ -0,0 +1,249 @@
+"""
+In-process request metrics.
+
+Latencies and query counts are recorded into log-linear histograms in the
+HdrHistogram style: every power of two is split into a fixed number of linear
+sub-buckets, so recording is O(1), memory stays bounded, and any percentile is
+known to within about 6%. Each process keeps its own registry; a Prometheus
+scraper hitting every worker sees each one separately.
+"""
+import cProfile
+import io
+import pstats
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import lru_cache
+
+from django.conf import settings
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Opt-in cProfile sampling: fraction of requests profiled, and the wall time
+# above which a sampled profile is kept
+PROFILE_SAMPLE_RATE = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+PROFILE_THRESHOLD = getattr(settings, 'PROFILING_THRESHOLD_MS', 500) / 1000
+PROFILE_KEEP = getattr(settings, 'PROFILING_KEEP', 20)
+PROFILE_TOP = 30
+
+# Seconds spent in serializer .data during the current request
+serializer_time = ContextVar('serializer_time', default=None)
+
+
+def _bucket(value):
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+
+def _bucket_upper(index):
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    top = index % SUB_BUCKETS + SUB_BUCKETS
+    return ((top + 1) << shift) - 1
+
+
+class Histogram:
+    """Log-linear histogram of non-negative values, stored as integers of ``1 / scale``."""
+
+    def __init__(self, scale=1):
+        self.scale = scale
+        self._lock = threading.Lock()
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0
+
+    def record(self, value):
+        scaled = max(int(value * self.scale), 0)
+        index = _bucket(scaled)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.count += 1
+            self.sum += value
+            if scaled > self.max:
+                self.max = scaled
+
+    def percentile(self, quantile):
+        with self._lock:
+            if not self.count:
+                return 0.0
+            target = quantile * self.count
+            seen = 0
+            for index in sorted(self.counts):
+                seen += self.counts[index]
+                if seen >= target:
+                    return min(_bucket_upper(index), self.max) / self.scale
+            return self.max / self.scale
+
+
+def _labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._histograms = {}
+        self._counters = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def observe(self, name, labels, value, scale=1_000_000):
+        key = (name, tuple(labels.items()))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(scale))
+        histogram.record(value)
+
+    def increment(self, name, labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self):
+        """Prometheus text exposition format; histograms are exported as summaries."""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        current = None
+        for (name, labels), histogram in histograms:
+            if name != current:
+                current = name
+                lines.append(f'# HELP {name} {self._help.get(name, name)}')
+                lines.append(f'# TYPE {name} summary')
+            for quantile in QUANTILES:
+                quantile_labels = _labels(labels + (('quantile', quantile),))
+                lines.append(f'{name}{{{quantile_labels}}} {histogram.percentile(quantile):.6g}')
+            lines.append(f'{name}_sum{{{_labels(labels)}}} {histogram.sum:.6g}')
+            lines.append(f'{name}_count{{{_labels(labels)}}} {histogram.count}')
+
+        current = None
+        for (name, labels), value in counters:
+            if name != current:
+                current = name
+                lines.append(f'# HELP {name} {self._help.get(name, name)}')
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{{{_labels(labels)}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+registry.describe('orion_request_duration_seconds', 'Wall time per request.')
+registry.describe('orion_db_duration_seconds', 'Time spent in SQL per request.')
+registry.describe('orion_db_queries', 'SQL queries per request.')
+registry.describe('orion_serializer_duration_seconds', 'Time spent building serializer output per request.')
+registry.describe('orion_requests_total', 'Requests by response status.')
+
+
+class QueryTimer:
+    """``connection.execute_wrapper`` hook accumulating SQL time and count."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class _TimedData:
+    @property
+    def data(self):
+        spent = serializer_time.get()
+        if spent is None:
+            return super().data
+        started = time.perf_counter()
+        try:
+            return super().data
+        finally:
+            spent[0] += time.perf_counter() - started
+
+
+@lru_cache(maxsize=None)
+def timed_serializer(serializer_class):
+    """
+    Subclass of ``serializer_class`` whose ``.data``, for one instance or
+    with ``many=True``, adds its time to the request's ``serializer_time``.
+    Nested serializers are covered by the outer ``.data``.
+    """
+    from rest_framework.serializers import ListSerializer
+
+    meta = getattr(serializer_class, 'Meta', object)
+    list_class = getattr(meta, 'list_serializer_class', ListSerializer)
+    attrs = {'__module__': serializer_class.__module__, '__qualname__': serializer_class.__qualname__}
+    timed_list = type(list_class.__name__, (_TimedData, list_class), dict(attrs, __qualname__=list_class.__qualname__))
+    attrs['Meta'] = type('Meta', (meta,), {'list_serializer_class': timed_list})
+    # Same name as the original, so schema components and browsable API titles are unchanged
+    return type(serializer_class.__name__, (_TimedData, serializer_class), attrs)
+
+
+class SerializerTimingMixin:
+    """
+    For generic views: serializers from ``get_serializer`` report their
+    ``.data`` time to ProfilingMiddleware. Other serializers are untouched.
+    """
+
+    def get_serializer_class(self):
+        return timed_serializer(super().get_serializer_class())
+
+
+class ProfileSampler:
+    """Keeps the cProfile output of the most recent slow sampled requests."""
+
+    def __init__(self, keep=PROFILE_KEEP):
+        # Only one cProfile can be active per process at a time
+        self._active = threading.Lock()
+        self.profiles = deque(maxlen=keep)
+
+    def start(self):
+        if not self._active.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            self._active.release()
+            return None
+        return profiler
+
+    def stop(self, profiler):
+        profiler.disable()
+        self._active.release()
+
+    def keep(self, profiler, view, method, path, duration):
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        self.profiles.append({
+            'view': view,
+            'method': method,
+            'path': path,
+            'duration_ms': round(duration * 1000, 1),
+            'recorded_at': time.time(),
+            'stats': output.getvalue(),
+        })
+
+
+sampler = ProfileSampler()
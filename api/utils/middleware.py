@@ -0,0 +1,58 @@
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from api.utils import metrics
+
+
+class ProfilingMiddleware:
+    """
+    Records wall time, SQL time, query count and serializer time (of views
+    using SerializerTimingMixin) per route (the URL name) into the metrics
+    registry. With PROFILING_SAMPLE_RATE set,
+    that fraction of requests also runs under cProfile and the stats of
+    those slower than PROFILING_THRESHOLD_MS are kept for inspection.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = metrics.QueryTimer()
+        serializer_time = [0.0]
+        token = metrics.serializer_time.set(serializer_time)
+
+        profiler = None
+        if metrics.PROFILE_SAMPLE_RATE and random.random() < metrics.PROFILE_SAMPLE_RATE:
+            profiler = metrics.sampler.start()
+
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timer))
+                response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - started
+            if profiler is not None:
+                metrics.sampler.stop(profiler)
+            metrics.serializer_time.reset(token)
+
+        match = getattr(request, 'resolver_match', None)
+        labels = {'view': (match and match.view_name) or 'unmatched', 'method': request.method}
+        registry = metrics.registry
+        registry.observe('orion_request_duration_seconds', labels, duration)
+        registry.observe('orion_db_duration_seconds', labels, timer.duration)
+        registry.observe('orion_db_queries', labels, timer.count, scale=1)
+        registry.observe('orion_serializer_duration_seconds', labels, serializer_time[0])
+        registry.increment('orion_requests_total', dict(labels, status=response.status_code))
+
+        if profiler is not None and duration >= metrics.PROFILE_THRESHOLD:
+            metrics.sampler.keep(profiler, labels['view'], request.method, request.path, duration)
+        return response
@@ -0,0 +1,61 @@
+"""
+Radius search over open delivery requests.
+
+The circle is expanded to covering geohash cells about the size of the
+query, candidates are fetched with index range scans on (status,
+pickup_geohash), and the exact distance is only computed for those
+candidates. At most MAX_CANDIDATES rows are read, however dense the area.
+"""
+from django.conf import settings
+from django.db.models import Q
+
+from api.models import DeliveryRequest
+from api.utils import geohash
+from api.utils.distance import haversine_km
+
+DEFAULT_RADIUS_KM = getattr(settings, 'NEARBY_DEFAULT_RADIUS_KM', 5)
+MAX_RADIUS_KM = getattr(settings, 'NEARBY_MAX_RADIUS_KM', 50)
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+# In an area denser than this the answer comes from an arbitrary subset of the candidates
+MAX_CANDIDATES = getattr(settings, 'NEARBY_MAX_CANDIDATES', 5000)
+
+
+def cells_filter(cells, field='pickup_geohash'):
+    """OR of prefix ranges, written as >=/< so every database can use the index."""
+    condition = Q()
+    for cell in cells:
+        if not cell:
+            return Q()
+        cell_range = Q(**{f'{field}__gte': cell})
+        upper = geohash.next_prefix(cell)
+        if upper is not None:
+            cell_range &= Q(**{f'{field}__lt': upper})
+        condition |= cell_range
+    return condition
+
+
+def nearby_pending(lat, lng, radius_km=DEFAULT_RADIUS_KM, limit=DEFAULT_LIMIT):
+    """
+    ``(distance_km, delivery)`` pairs for PENDING requests whose pickup lies
+    within ``radius_km``, nearest first.
+    """
+    cells = geohash.covering_cells(lat, lng, radius_km)
+    candidates = list(
+        DeliveryRequest.objects.filter(status=DeliveryRequest.PENDING)
+        .filter(cells_filter(cells))
+        .values_list('id', 'pickup_lat', 'pickup_lng')[:MAX_CANDIDATES]
+    )
+    if not candidates:
+        return []
+
+    ids, lats, lngs = zip(*candidates)
+    distances = haversine_km(lat, lng, lats, lngs)
+    within = sorted(
+        (distance, delivery_id)
+        for delivery_id, distance in zip(ids, distances.tolist())
+        if distance <= radius_km
+    )[:limit]
+
+    deliveries = DeliveryRequest.objects.in_bulk([delivery_id for _, delivery_id in within])
+    return [(distance, deliveries[delivery_id]) for distance, delivery_id in within if delivery_id in deliveries]
@@ -0,0 +1,131 @@
+"""
+Keyset pagination for list endpoints.
+
+Pages are addressed by an opaque cursor holding the whole sort key of the
+row at the page edge, e.g. (created_at, id), so the next page is fetched with
+
+    WHERE created_at < :t OR (created_at = :t AND id < :id)
+
+on the matching index instead of ``OFFSET``. Every page costs the same as the
+first, however many rows share a timestamp.
+"""
+import json
+import operator
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from functools import reduce
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+def _flipped(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def _text(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on the view's ``cursor_ordering``, newest first by
+    default. The last field must be unique (the primary key) so the order is
+    total; the cursor carries every field, so no offset is ever needed.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = getattr(settings, 'API_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', self.ordering)
+        return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        reverse, position = self.cursor = self.decode_cursor(request, queryset.model)
+
+        if position is not None:
+            queryset = queryset.filter(self._beyond(position, reverse))
+        queryset = queryset.order_by(*(map(_flipped, self.ordering) if reverse else self.ordering))
+
+        # One extra row tells whether there is a page after this one
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def _beyond(self, position, reverse):
+        """Rows after ``position`` in the ordering, or before it when ``reverse``."""
+        conditions = []
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') != reverse else 'gt'
+            conditions.append(equal & Q(**{f'{name}__{lookup}': value}))
+            equal &= Q(**{name: value})
+        return reduce(operator.or_, conditions)
+
+    def _position(self, instance):
+        return [_text(getattr(instance, field.lstrip('-'))) for field in self.ordering]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        # Past the end of a reversed walk the next page is the first one
+        return self.encode_cursor((False, self._position(self.page[-1]) if self.page else None))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        # Past the end of a forward walk the previous page is the last one
+        return self.encode_cursor((True, self._position(self.page[0]) if self.page else None))
+
+    def decode_cursor(self, request, model=None):
+        """Return ``(reverse, position)``, position being the sort key values or None."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return False, None
+        try:
+            tokens = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            reverse = bool(tokens.get('r', False))
+            position = tokens.get('p')
+            if position is not None:
+                if len(position) != len(self.ordering):
+                    raise ValueError
+                position = [
+                    model._meta.get_field(field.lstrip('-')).to_python(value)
+                    for field, value in zip(self.ordering, position)
+                ]
+        except (AttributeError, TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
+
+    def encode_cursor(self, cursor):
+        reverse, position = cursor
+        tokens = {}
+        if reverse:
+            tokens['r'] = 1
+        if position is not None:
+            tokens['p'] = position
+        encoded = urlsafe_b64encode(json.dumps(tokens, separators=(',', ':')).encode()).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
@@ -0,0 +1,221 @@
+"""
+Payment provider callbacks.
+
+Providers retry a callback until they get a 2xx, often many copies at once,
+so ingestion is idempotent. (provider, transaction_id) is unique on Payment,
+and a callback whose transaction is already recorded on its payment counts
+as a duplicate without touching any row: a retry storm costs one indexed
+SELECT per batch and takes no locks. The rest of a batch is applied with one
+conditional UPDATE per target status, plus one for DeliveryRequest.is_paid,
+in one short transaction. The WHERE clause only lets legal transitions
+through, so a concurrent copy of the same batch matches nothing.
+"""
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, CharField, Value, When
+from django.utils import timezone
+
+from api.models import DeliveryEvent, DeliveryRequest, Payment
+from api.utils import events
+
+# provider name -> shared secret signing its callbacks
+SECRETS = getattr(settings, 'PAYMENT_WEBHOOK_SECRETS', {})
+MAX_BATCH_SIZE = getattr(settings, 'PAYMENT_WEBHOOK_MAX_BATCH_SIZE', 1000)
+MANUAL = 'manual'
+# Provider recorded on cash payments collected by the driver
+ON_DELIVERY = 'on_delivery'
+
+# target status -> statuses a callback may move a payment from
+TRANSITIONS = {
+    Payment.SUCCESS: (Payment.PENDING, Payment.FAILED),
+    Payment.FAILED: (Payment.PENDING,),
+}
+
+
+class InvalidCallback(Exception):
+    pass
+
+
+def verify_signature(provider, body, signature):
+    """``signature`` must be the hex HMAC-SHA256 of the raw body under the provider's secret."""
+    secret = SECRETS.get(provider)
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def parse(payload):
+    """Accepts one callback object or {"events": [...]}; returns a list of clean callbacks."""
+    items = payload.get('events', [payload]) if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        raise InvalidCallback("Expected a callback object or a non-empty 'events' list.")
+    if len(items) > MAX_BATCH_SIZE:
+        raise InvalidCallback(f"At most {MAX_BATCH_SIZE} callbacks per request.")
+
+    callbacks = []
+    for index, item in enumerate(items):
+        try:
+            payment_id = int(item['payment_id'])
+            transaction_id = str(item['transaction_id'])
+            status = item['status']
+        except (KeyError, TypeError, ValueError):
+            raise InvalidCallback(f"Callback {index} needs payment_id, transaction_id and status.")
+        if not isinstance(status, str) or status not in TRANSITIONS:
+            raise InvalidCallback(f"Callback {index} has invalid status {status!r}.")
+        if not transaction_id or len(transaction_id) > 255:
+            raise InvalidCallback(f"Callback {index} has an invalid transaction_id.")
+        callbacks.append({'payment_id': payment_id, 'transaction_id': transaction_id, 'status': status})
+    return callbacks
+
+
+def apply_callbacks(provider, callbacks):
+    """
+    Apply parsed callbacks. Returns counts of applied, duplicate and ignored
+    callbacks; ignored ones reference unknown payments, reuse another
+    payment's transaction id or ask for an illegal transition.
+    """
+    try:
+        return _apply_callbacks(provider, callbacks)
+    except IntegrityError:
+        # A concurrent request recorded one of these transactions first; read again and classify
+        try:
+            return _apply_callbacks(provider, callbacks)
+        except IntegrityError:
+            return {'applied': 0, 'duplicates': len(callbacks), 'ignored': 0}
+
+
+def _apply_callbacks(provider, callbacks):
+    summary = {'applied': 0, 'duplicates': 0, 'ignored': 0}
+    # Within a batch the last callback per payment wins
+    latest = {}
+    for callback in callbacks:
+        if callback['payment_id'] in latest:
+            summary['duplicates'] += 1
+        latest[callback['payment_id']] = callback
+
+    payments = {
+        payment['id']: payment
+        for payment in Payment.objects.filter(id__in=latest).values(
+            'id', 'status', 'transaction_id', 'amount', 'delivery_request_id'
+        )
+    }
+    owners = dict(
+        Payment.objects.filter(
+            provider=provider, transaction_id__in={callback['transaction_id'] for callback in latest.values()}
+        ).values_list('transaction_id', 'id')
+    )
+
+    updates = {status: {} for status in TRANSITIONS}
+    for payment_id, callback in latest.items():
+        payment = payments.get(payment_id)
+        owner = owners.setdefault(callback['transaction_id'], payment_id)
+        if payment is None or owner != payment_id:
+            summary['ignored'] += 1
+        elif payment['status'] == callback['status'] and payment['transaction_id'] == callback['transaction_id']:
+            summary['duplicates'] += 1
+        elif payment['status'] not in TRANSITIONS[callback['status']]:
+            summary['ignored'] += 1
+        else:
+            updates[callback['status']][payment_id] = callback['transaction_id']
+
+    if not any(updates.values()):
+        return summary
+
+    applied = []
+    with transaction.atomic():
+        for status, transaction_ids in updates.items():
+            if not transaction_ids:
+                continue
+            count = Payment.objects.filter(id__in=sorted(transaction_ids), status__in=TRANSITIONS[status]).update(
+                status=status,
+                provider=provider,
+                transaction_id=Case(
+                    *[When(id=payment_id, then=Value(value)) for payment_id, value in transaction_ids.items()],
+                    output_field=CharField(),
+                ),
+            )
+            changed = set(transaction_ids)
+            if count != len(transaction_ids):
+                # A concurrent request got to some rows first. Rows carrying our transaction may
+                # have been written by an identical retry, so sinks can see those events twice.
+                changed = {
+                    payment_id for payment_id, value in Payment.objects.filter(
+                        id__in=transaction_ids, status=status
+                    ).values_list('id', 'transaction_id')
+                    if value == transaction_ids[payment_id]
+                }
+            summary['applied'] += count
+            summary['duplicates'] += len(transaction_ids) - count
+            applied += [(payment_id, status) for payment_id in sorted(changed)]
+
+        paid = [payments[payment_id]['delivery_request_id'] for payment_id, status in applied
+                if status == Payment.SUCCESS]
+        _mark_paid(paid)
+        events.record_events(DeliveryEvent.PAYMENT_UPDATED, [
+            (payments[payment_id]['delivery_request_id'], {
+                'payment': payment_id, 'payment_status': status, 'provider': provider,
+                'amount': str(payments[payment_id]['amount']), 'transaction_id': updates[status][payment_id],
+            })
+            for payment_id, status in applied
+        ])
+    return summary
+
+
+def _mark_paid(delivery_request_ids):
+    if delivery_request_ids:
+        DeliveryRequest.objects.filter(id__in=delivery_request_ids, is_paid=False).update(
+            is_paid=True, updated_at=timezone.now()
+        )
+
+
+def record(payment, status, transaction_id=None):
+    """
+    An admin's manual result for ``payment``: any status, with or without a
+    transaction id. Raises IntegrityError if the transaction id is already
+    recorded on another payment.
+    """
+    fields = {'status': status}
+    if transaction_id:
+        fields.update(provider=MANUAL, transaction_id=transaction_id)
+    with transaction.atomic():
+        Payment.objects.filter(pk=payment.pk).update(**fields)
+        if status == Payment.SUCCESS:
+            _mark_paid([payment.delivery_request_id])
+        elif not Payment.objects.filter(delivery_request_id=payment.delivery_request_id, status=Payment.SUCCESS).exists():
+            DeliveryRequest.objects.filter(id=payment.delivery_request_id, is_paid=True).update(
+                is_paid=False, updated_at=timezone.now()
+            )
+        events.record_event(
+            DeliveryEvent.PAYMENT_UPDATED, payment.delivery_request_id,
+            payment=payment.pk, payment_status=status, provider=MANUAL, amount=str(payment.amount),
+            transaction_id=transaction_id or payment.transaction_id,
+        )
+
+
+def settle_on_delivery(delivery_request_id):
+    """
+    Record the delivery's pending cash-on-delivery payments as collected by
+    the driver. Runs in the transaction completing the delivery.
+    """
+    collected = list(
+        Payment.objects.filter(
+            delivery_request_id=delivery_request_id, payment_method=Payment.ON_DELIVERY, status=Payment.PENDING
+        ).values_list('id', 'amount')
+    )
+    if not collected:
+        return 0
+    Payment.objects.filter(id__in=[payment_id for payment_id, _ in collected], status=Payment.PENDING).update(
+        status=Payment.SUCCESS, provider=ON_DELIVERY
+    )
+    _mark_paid([delivery_request_id])
+    events.record_events(DeliveryEvent.PAYMENT_UPDATED, [
+        (delivery_request_id, {
+            'payment': payment_id, 'payment_status': Payment.SUCCESS, 'provider': ON_DELIVERY, 'amount': str(amount),
+        })
+        for payment_id, amount in collected
+    ])
+    return len(collected)
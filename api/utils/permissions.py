@@ -6,8 +6,12 @@ class DeliveryRequestPermission(BasePermission):
         user = request.user
         if user.role == 'ADMIN':
             return True
-        if user.role == 'CUSTOMER' and obj.customer == user:
+        if user.role == 'CUSTOMER' and obj.customer_id == user.id:
             return True
         if user.role == 'DRIVER':
-            return Assignment.objects.filter(driver=user, delivery_request=obj).exists()
+            # Set by the driver queryset of DeliveryRequestViewSet
+            assigned = getattr(obj, 'assigned_to_user', None)
+            if assigned is not None:
+                return assigned
+            return Assignment.objects.filter(driver_id=user.id, delivery_request_id=obj.id).exists()
         return False
@@ -0,0 +1,176 @@
+"""
+Tariff-based pricing.
+
+Tariffs, distance bands and time-of-day surcharges live in the database but
+are compiled into an in-process lookup table, so quoting a price is a pure
+in-memory computation. The table is rebuilt lazily after a tariff changes:
+saving or deleting any tariff row bumps a version number in the shared cache,
+and each process compares against it at most every VERSION_CHECK_INTERVAL
+seconds.
+"""
+import threading
+import time
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Rule applied to package types without an active tariff
+DEFAULT_PRICE_PER_KM = 1.5
+
+VERSION_KEY = 'pricing:tariff-version'
+VERSION_CHECK_INTERVAL = getattr(settings, 'PRICING_VERSION_CHECK_INTERVAL', 5)
+
+
+class CompiledTariff:
+    """Piecewise-linear price curve for one package type."""
+
+    def __init__(self, base_fare=0.0, minimum_price=0.0, breakpoints=(0.0,), rates=(DEFAULT_PRICE_PER_KM,)):
+        self.base_fare = float(base_fare)
+        self.minimum_price = float(minimum_price)
+        self.breakpoints = np.asarray(breakpoints, dtype=float)
+        self.rates = np.asarray(rates, dtype=float)
+        # Cost accumulated up to each breakpoint
+        widths = np.diff(self.breakpoints)
+        self.cumulative = np.concatenate(([0.0], np.cumsum(widths * self.rates[:-1])))
+
+    def distance_cost(self, distances):
+        band = np.searchsorted(self.breakpoints, distances, side='right') - 1
+        band = np.clip(band, 0, len(self.breakpoints) - 1)
+        return self.cumulative[band] + (distances - self.breakpoints[band]) * self.rates[band]
+
+    def price(self, distances):
+        return np.maximum(self.base_fare + self.distance_cost(distances), self.minimum_price)
+
+
+DEFAULT_TARIFF = CompiledTariff()
+
+
+class PricingTable:
+    def __init__(self, tariffs=None, multipliers=None, version=None):
+        self.tariffs = tariffs or {}
+        # package_type (None for all types) -> 24 hourly multipliers
+        self.multipliers = multipliers or {}
+        self.version = version
+
+    def hourly_multipliers(self, package_type):
+        specific = self.multipliers.get(package_type)
+        general = self.multipliers.get(None)
+        if specific is None and general is None:
+            return None
+        if specific is None:
+            return general
+        if general is None:
+            return specific
+        return np.maximum(specific, general)
+
+    def quote(self, distances, package_types, hours):
+        distances = np.asarray(distances, dtype=float)
+        package_types = np.asarray(package_types, dtype=object)
+        hours = np.asarray(hours, dtype=int)
+        prices = np.empty_like(distances)
+
+        for package_type in set(package_types.tolist()):
+            rows = package_types == package_type
+            tariff = self.tariffs.get(package_type, DEFAULT_TARIFF)
+            prices[rows] = tariff.price(distances[rows])
+            multipliers = self.hourly_multipliers(package_type)
+            if multipliers is not None:
+                prices[rows] *= multipliers[hours[rows]]
+
+        return np.round(prices, 2)
+
+
+def _hours(start_hour, end_hour):
+    if end_hour > start_hour:
+        return range(start_hour, end_hour)
+    # Window wraps past midnight, e.g. 22 -> 6
+    return list(range(start_hour, 24)) + list(range(0, end_hour))
+
+
+def load_table(version=None):
+    """Compile every active tariff with three queries."""
+    from api.models import Tariff, TariffDistanceBand, TariffSurcharge
+
+    bands = {}
+    for band in TariffDistanceBand.objects.filter(tariff__is_active=True).order_by('tariff_id', 'from_km'):
+        bands.setdefault(band.tariff_id, []).append((band.from_km, float(band.price_per_km)))
+
+    tariffs = {}
+    for tariff in Tariff.objects.filter(is_active=True):
+        breakpoints = [0.0]
+        rates = [float(tariff.price_per_km)]
+        for from_km, rate in bands.get(tariff.id, []):
+            if from_km <= 0:
+                rates[0] = rate
+                continue
+            breakpoints.append(from_km)
+            rates.append(rate)
+        tariffs[tariff.package_type] = CompiledTariff(
+            base_fare=tariff.base_fare,
+            minimum_price=tariff.minimum_price,
+            breakpoints=breakpoints,
+            rates=rates,
+        )
+
+    # Surcharges follow package types; those of a type whose tariff was retired are dropped with it
+    retired = Tariff.objects.filter(is_active=False).exclude(package_type__in=list(tariffs)).values('package_type')
+    multipliers = {}
+    for surcharge in TariffSurcharge.objects.exclude(package_type__in=retired):
+        hourly = multipliers.setdefault(surcharge.package_type or None, np.ones(24))
+        for hour in _hours(surcharge.start_hour, surcharge.end_hour):
+            hourly[hour] = max(hourly[hour], float(surcharge.multiplier))
+
+    return PricingTable(tariffs, multipliers, version)
+
+
+class PricingEngine:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._table = None
+        self._checked_at = 0.0
+
+    def table(self):
+        table = self._table
+        now = time.monotonic()
+        if table is not None and now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return table
+
+        version = cache.get(VERSION_KEY, 0)
+        if table is not None and table.version == version:
+            self._checked_at = now
+            return table
+
+        with self._lock:
+            if self._table is None or self._table.version != version:
+                self._table = load_table(version)
+            self._checked_at = now
+            return self._table
+
+    def clear(self):
+        self._table = None
+
+    def quote_many(self, distances, package_types, hours):
+        """Vectorized prices (floats rounded to cents) for parallel arrays."""
+        return self.table().quote(distances, package_types, hours)
+
+    def quote(self, distance, package_type, hour):
+        price = self.quote_many([distance], [package_type], [hour])[0]
+        return Decimal(f'{price:.2f}')
+
+
+engine = PricingEngine()
+
+
+def invalidate():
+    """Drop compiled tariffs here and, via the version key, in every other process."""
+    def bump():
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, None)
+        engine.clear()
+
+    transaction.on_commit(bump)
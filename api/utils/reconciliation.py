@@ -0,0 +1,150 @@
+"""
+Payment reconciliation.
+
+Compares every delivery request with its payments: a delivery is paid
+exactly when it has one SUCCESS payment, and that payment's amount equals
+the price. Both tables are read in delivery id order, payments through the
+delivery_request index, and merge-joined, one window of WINDOW deliveries at
+a time. Each window is its own pair of ranged queries (MySQL drivers buffer
+a whole result set, even through iterator()), so memory stays bounded by the
+window whatever the table size, and the end of each window is a checkpoint.
+"""
+import json
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import DeliveryRequest, Payment, PaymentDiscrepancy
+
+WINDOW = 10000
+CHUNK_SIZE = 2000
+
+
+def delivery_rows(start, stop, chunk_size=CHUNK_SIZE):
+    return (
+        DeliveryRequest.objects.filter(id__gt=start, id__lte=stop).order_by('id')
+        .values_list('id', 'price', 'is_paid').iterator(chunk_size=chunk_size)
+    )
+
+
+def payment_rows(start, stop, chunk_size=CHUNK_SIZE):
+    return (
+        Payment.objects.filter(
+            delivery_request_id__gt=start, delivery_request_id__lte=stop, status=Payment.SUCCESS
+        ).order_by('delivery_request_id', 'id')
+        .values_list('delivery_request_id', 'id', 'amount').iterator(chunk_size=chunk_size)
+    )
+
+
+def merge_join(deliveries, payments):
+    """Yield (delivery, [its successful payments]) from two streams sorted by delivery id."""
+    payment = next(payments, None)
+    for delivery in deliveries:
+        matched = []
+        while payment is not None and payment[0] <= delivery[0]:
+            # Payments of deliveries outside the stream (none with the cascade) are skipped
+            if payment[0] == delivery[0]:
+                matched.append(payment)
+            payment = next(payments, None)
+        yield delivery, matched
+
+
+def check(delivery, payments):
+    """Discrepancies of one delivery, as (kind, payment_id, detail) tuples."""
+    delivery_id, price, is_paid = delivery
+    found = []
+    if is_paid and not payments:
+        found.append((PaymentDiscrepancy.PAID_WITHOUT_PAYMENT, None, {}))
+    if payments and not is_paid:
+        found.append((PaymentDiscrepancy.PAYMENT_NOT_RECORDED, payments[0][1], {}))
+    if len(payments) > 1:
+        found.append((PaymentDiscrepancy.DUPLICATE_PAYMENT, payments[1][1], {
+            'payments': [payment_id for _, payment_id, _ in payments],
+        }))
+    for _, payment_id, amount in payments:
+        if price is None or Decimal(amount) != Decimal(price):
+            found.append((PaymentDiscrepancy.AMOUNT_MISMATCH, payment_id, {
+                'amount': str(amount), 'price': None if price is None else str(price),
+            }))
+    return found
+
+
+def window_end(start, window=WINDOW):
+    """Id of the last delivery in the next window, or None when nothing is left."""
+    ids = DeliveryRequest.objects.filter(id__gt=start).order_by('id').values_list('id', flat=True)
+    stop = ids[window - 1:window].first()
+    if stop is None:
+        stop = ids.last()
+    return stop
+
+
+class TableReport:
+    """Stores discrepancies as PaymentDiscrepancy rows, committed with the checkpoint."""
+
+    def __init__(self, run):
+        self.run = run
+        self.pending = []
+
+    def add(self, delivery_id, kind, payment_id, detail):
+        self.pending.append(PaymentDiscrepancy(
+            run=self.run, delivery_request_id=delivery_id, payment_id=payment_id, kind=kind, detail=detail
+        ))
+
+    def flush(self):
+        if self.pending:
+            PaymentDiscrepancy.objects.bulk_create(self.pending)
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+class NDJSONReport:
+    """
+    Appends one JSON line per discrepancy. Lines are flushed before the
+    checkpoint moves, so a resumed run may repeat the last window's lines
+    but never loses any.
+    """
+
+    def __init__(self, run, path):
+        self.run = run
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def add(self, delivery_id, kind, payment_id, detail):
+        self.file.write(json.dumps({
+            'run': self.run.id, 'delivery_request': delivery_id, 'payment': payment_id, 'kind': kind, 'detail': detail,
+        }) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def reconcile(run, report, window=WINDOW, chunk_size=CHUNK_SIZE):
+    """Continue ``run`` from its checkpoint to the end, yielding the run after every window."""
+    while True:
+        start = run.last_delivery_id
+        stop = window_end(start, window)
+        if stop is None:
+            break
+        checked = found = 0
+        for delivery, payments in merge_join(delivery_rows(start, stop, chunk_size),
+                                             payment_rows(start, stop, chunk_size)):
+            checked += 1
+            for kind, payment_id, detail in check(delivery, payments):
+                report.add(delivery[0], kind, payment_id, detail)
+                found += 1
+
+        with transaction.atomic():
+            report.flush()
+            run.last_delivery_id = stop
+            run.checked += checked
+            run.discrepancies += found
+            run.save(update_fields=['last_delivery_id', 'checked', 'discrepancies'])
+        yield run
+
+    run.finished_at = timezone.now()
+    run.save(update_fields=['finished_at'])
@@ -0,0 +1,154 @@
+"""
+Revoked refresh token lookups.
+
+simplejwt checks every refresh token against the BlacklistedToken table,
+which only ever grows. Here the blacklisted jtis are mirrored into an
+in-process Bloom filter: a token that is not in the filter is certainly not
+revoked and costs no query, and only filter hits (real revocations plus a
+false positive rate of REVOCATION_FALSE_POSITIVE_RATE) are confirmed in the
+database. The filter is kept current by reading blacklist rows newer than the
+last one seen, at most every REVOCATION_SYNC_INTERVAL seconds.
+"""
+import hashlib
+import math
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+CAPACITY = getattr(settings, 'REVOCATION_BLOOM_CAPACITY', 1_000_000)
+FALSE_POSITIVE_RATE = getattr(settings, 'REVOCATION_FALSE_POSITIVE_RATE', 0.001)
+SYNC_INTERVAL = getattr(settings, 'REVOCATION_SYNC_INTERVAL', 1)
+SYNC_CHUNK_SIZE = 10000
+# Ids are handed out before commit, so a row may become visible after rows
+# with higher ids. Each sync re-reads this many ids below the last one seen.
+SYNC_LOOKBACK = 1000
+
+
+class BloomFilter:
+    def __init__(self, capacity=CAPACITY, false_positive_rate=FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: two 64-bit halves of one digest give all k positions
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        if all(self.bits[position >> 3] & (1 << (position & 7)) for position in positions):
+            return
+        for position in positions:
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationRegistry:
+    def __init__(self, capacity=CAPACITY, sync_interval=SYNC_INTERVAL):
+        self.capacity = capacity
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.filter = BloomFilter(self.capacity)
+        self._last_id = 0
+        self._synced_at = None
+
+    def sync(self, force=False):
+        """Add blacklist rows created since the last sync to the filter."""
+        now = time.monotonic()
+        if not force and self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+        with self._lock:
+            if self.filter.count > self.capacity:
+                # Saturated; start over; compact_tokens keeps the table itself small
+                self._reset()
+            start = max(self._last_id - SYNC_LOOKBACK, 0)
+            while True:
+                rows = list(
+                    BlacklistedToken.objects.filter(id__gt=start)
+                    .order_by('id')
+                    .values_list('id', 'token__jti')[:SYNC_CHUNK_SIZE]
+                )
+                for row_id, jti in rows:
+                    self.filter.add(jti)
+                if rows:
+                    start = rows[-1][0]
+                    self._last_id = max(self._last_id, start)
+                if len(rows) < SYNC_CHUNK_SIZE:
+                    break
+            self._synced_at = now
+
+    def revoke(self, jti):
+        with self._lock:
+            self.filter.add(jti)
+
+    def is_revoked(self, jti):
+        self.sync()
+        if jti not in self.filter:
+            return False
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+
+registry = RevocationRegistry()
+
+
+class RevocableRefreshToken(RefreshToken):
+    """RefreshToken checking the blacklist through the revocation registry."""
+
+    def check_blacklist(self):
+        if registry.is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        result = super().blacklist()
+        jti = self.payload[api_settings.JTI_CLAIM]
+        registry.revoke(jti)
+        return result
+
+
+def purge_expired(batch_size=5000, now=None):
+    """
+    Delete expired outstanding tokens, and through the cascade their blacklist
+    rows, walking the primary key in ranges of ``batch_size`` so each delete
+    is short. Returns the deleted row counts per model.
+    """
+    now = now or timezone.now()
+    deleted = {'outstanding': 0, 'blacklisted': 0}
+    bounds = OutstandingToken.objects.aggregate(first=Min('id'), last=Max('id'))
+    if bounds['first'] is None:
+        return deleted
+    lower = bounds['first'] - 1
+    while lower < bounds['last']:
+        upper = lower + batch_size
+        with transaction.atomic():
+            _, per_model = OutstandingToken.objects.filter(
+                id__gt=lower, id__lte=upper, expires_at__lt=now
+            ).delete()
+        deleted['outstanding'] += per_model.get(OutstandingToken._meta.label, 0)
+        deleted['blacklisted'] += per_model.get(BlacklistedToken._meta.label, 0)
+        lower = upper
+    return deleted
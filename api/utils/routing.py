@@ -0,0 +1,284 @@
+"""
+Multi-stop route planning for a driver's accepted deliveries.
+
+Every in-progress delivery contributes a pickup and a dropoff stop. A tour
+is built by nearest neighbour from the driver's last known position, always
+respecting pickup-before-dropoff and vehicle capacity, and then improved
+with 2-opt and Or-opt moves until no move helps or the time budget runs out.
+The route is open: it ends at the last dropoff.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from api.models import Assignment, DeliveryRequest
+from api.utils import tracking_cache
+from api.utils.distance import haversine_km
+
+# Parcels a vehicle can carry at once
+VEHICLE_CAPACITY = getattr(settings, 'ROUTE_VEHICLE_CAPACITY', 10)
+TIME_BUDGET = getattr(settings, 'ROUTE_TIME_BUDGET', 0.5)
+PLAN_TIMEOUT = getattr(settings, 'ROUTE_PLAN_TIMEOUT', 10 * 60)
+PLAN_KEY = 'route:plan:driver:{}'
+
+PICKUP = 'PICKUP'
+DROPOFF = 'DROPOFF'
+
+_MATRIX_CACHE_SIZE = 256
+_matrix_cache = OrderedDict()
+_matrix_lock = threading.Lock()
+
+
+def stop_matrix(coordinates):
+    """
+    Pairwise distances between stops. The stops of a driver only change when
+    an assignment is accepted or completed, so matrices are kept in a small
+    LRU keyed by the coordinates, shared by every request thread.
+    """
+    key = tuple(coordinates)
+    with _matrix_lock:
+        matrix = _matrix_cache.get(key)
+        if matrix is not None:
+            _matrix_cache.move_to_end(key)
+            return matrix
+    # Computed outside the lock; two threads may both compute the same matrix
+    points = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    matrix = haversine_km(points[:, :1], points[:, 1:], points[:, 0][None, :], points[:, 1][None, :])
+    with _matrix_lock:
+        _matrix_cache[key] = matrix
+        _matrix_cache.move_to_end(key)
+        while len(_matrix_cache) > _MATRIX_CACHE_SIZE:
+            _matrix_cache.popitem(last=False)
+    return matrix
+
+
+class RoutePlanner:
+    """
+    ``stops`` are dicts with ``type``, ``delivery_request``, ``latitude`` and
+    ``longitude``. Node 0 of the distance matrix is the start position, node
+    i + 1 is ``stops[i]``.
+    """
+
+    def __init__(self, start, stops, capacity=VEHICLE_CAPACITY, on_board=()):
+        self.stops = stops
+        self.capacity = capacity
+        self.initial_load = len(on_board)
+
+        self.pickup_of = {}
+        for index, stop in enumerate(stops):
+            if stop['type'] == PICKUP:
+                self.pickup_of[stop['delivery_request']] = index
+
+        between = stop_matrix([(stop['latitude'], stop['longitude']) for stop in stops])
+        size = len(stops) + 1
+        self.distances = np.zeros((size, size))
+        self.distances[1:, 1:] = between
+        if start is not None:
+            lats = np.array([stop['latitude'] for stop in stops])
+            lngs = np.array([stop['longitude'] for stop in stops])
+            self.distances[0, 1:] = haversine_km(start[0], start[1], lats, lngs)
+        self._matrix = self.distances.tolist()
+
+    def cost(self, route):
+        d = self._matrix
+        total = 0.0
+        previous = 0
+        for stop in route:
+            total += d[previous][stop + 1]
+            previous = stop + 1
+        return total
+
+    def feasible(self, route):
+        load = self.initial_load
+        picked = set()
+        for index in route:
+            stop = self.stops[index]
+            if stop['type'] == PICKUP:
+                load += 1
+                if load > self.capacity:
+                    return False
+                picked.add(stop['delivery_request'])
+            else:
+                if stop['delivery_request'] in self.pickup_of and stop['delivery_request'] not in picked:
+                    return False
+                load -= 1
+        return True
+
+    def nearest_neighbour(self):
+        d = self._matrix
+        remaining = set(range(len(self.stops)))
+        picked = set()
+        load = self.initial_load
+        route = []
+        current = 0
+        while remaining:
+            best, best_distance = None, None
+            for index in remaining:
+                stop = self.stops[index]
+                if stop['type'] == PICKUP:
+                    if load >= self.capacity:
+                        continue
+                elif stop['delivery_request'] in self.pickup_of and stop['delivery_request'] not in picked:
+                    continue
+                distance = d[current][index + 1]
+                if best is None or distance < best_distance:
+                    best, best_distance = index, distance
+            if best is None:
+                # Only possible when the load on board already exceeds capacity
+                best = min(remaining)
+            stop = self.stops[best]
+            if stop['type'] == PICKUP:
+                load += 1
+                picked.add(stop['delivery_request'])
+            else:
+                load -= 1
+            route.append(best)
+            remaining.remove(best)
+            current = best + 1
+        return route
+
+    def _two_opt(self, route, deadline):
+        d = self._matrix
+        n = len(route)
+        for i in range(n - 1):
+            before = route[i - 1] + 1 if i else 0
+            for j in range(i + 1, n):
+                after = route[j + 1] + 1 if j + 1 < n else None
+                first, last = route[i] + 1, route[j] + 1
+                delta = d[before][last] - d[before][first]
+                if after is not None:
+                    delta += d[first][after] - d[last][after]
+                if delta < -1e-9:
+                    candidate = route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+                    if self.feasible(candidate):
+                        return candidate
+            if time.monotonic() > deadline:
+                break
+        return None
+
+    def _or_opt(self, route, deadline):
+        """Move a run of one to three consecutive stops elsewhere in the route."""
+        d = self._matrix
+        n = len(route)
+        for length in (1, 2, 3):
+            for i in range(n - length + 1):
+                segment = route[i:i + length]
+                rest = route[:i] + route[i + length:]
+                first, last = segment[0] + 1, segment[-1] + 1
+                before = route[i - 1] + 1 if i else 0
+                after = route[i + length] + 1 if i + length < n else None
+                removed = d[before][first] - (d[before][after] if after is not None else 0.0)
+                if after is not None:
+                    removed += d[last][after]
+                for position in range(len(rest) + 1):
+                    if position == i:
+                        continue
+                    a = rest[position - 1] + 1 if position else 0
+                    b = rest[position] + 1 if position < len(rest) else None
+                    added = d[a][first]
+                    if b is not None:
+                        added += d[last][b] - d[a][b]
+                    if added - removed < -1e-9:
+                        candidate = rest[:position] + segment + rest[position:]
+                        if self.feasible(candidate):
+                            return candidate
+                if time.monotonic() > deadline:
+                    return None
+        return None
+
+    def plan(self, time_budget=TIME_BUDGET):
+        if not self.stops:
+            return []
+        deadline = time.monotonic() + time_budget
+        route = self.nearest_neighbour()
+        while time.monotonic() < deadline:
+            improved = self._two_opt(route, deadline) or self._or_opt(route, deadline)
+            if improved is None:
+                break
+            route = improved
+        return route
+
+
+def driver_stops(driver_id, on_board=()):
+    deliveries = (
+        DeliveryRequest.objects.filter(
+            status=DeliveryRequest.IN_PROGRESS,
+            assignments__driver_id=driver_id,
+            assignments__status=Assignment.ACCEPTED,
+        )
+        .distinct()
+        .order_by('id')
+        .values('id', 'pickup_address', 'pickup_lat', 'pickup_lng',
+                'dropoff_address', 'dropoff_lat', 'dropoff_lng')
+    )
+    stops = []
+    for delivery in deliveries:
+        if delivery['id'] not in on_board:
+            stops.append({
+                'type': PICKUP,
+                'delivery_request': delivery['id'],
+                'address': delivery['pickup_address'],
+                'latitude': delivery['pickup_lat'],
+                'longitude': delivery['pickup_lng'],
+            })
+        stops.append({
+            'type': DROPOFF,
+            'delivery_request': delivery['id'],
+            'address': delivery['dropoff_address'],
+            'latitude': delivery['dropoff_lat'],
+            'longitude': delivery['dropoff_lng'],
+        })
+    return stops
+
+
+def plan_route(driver_id, on_board=(), refresh=False):
+    """
+    Ordered stop list for a driver. Plans are cached per driver and the set
+    of parcels on board until an assignment of that driver changes (see
+    invalidate) or ``refresh`` is requested.
+    """
+    on_board = frozenset(on_board)
+    key = PLAN_KEY.format(driver_id)
+    cached = None if refresh else cache.get(key)
+    if cached is not None and cached.get('on_board') == sorted(on_board):
+        return cached
+
+    stops = driver_stops(driver_id, on_board)
+    position = tracking_cache.get_driver_position(driver_id)
+    start = (position['latitude'], position['longitude']) if position else None
+    # Parcels reported on board but no longer in progress take no room
+    in_progress = {stop['delivery_request'] for stop in stops}
+    planner = RoutePlanner(start, stops, on_board=on_board & in_progress)
+
+    started = time.perf_counter()
+    route = planner.plan()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    ordered = []
+    cumulative = 0.0
+    previous = 0 if start is not None else None
+    for sequence, index in enumerate(route, start=1):
+        leg = planner.distances[previous][index + 1] if previous is not None else 0.0
+        cumulative += leg
+        ordered.append(dict(planner.stops[index], sequence=sequence,
+                            leg_km=round(float(leg), 3), cumulative_km=round(float(cumulative), 3)))
+        previous = index + 1
+
+    plan = {
+        'driver': driver_id,
+        'start': {'latitude': start[0], 'longitude': start[1]} if start else None,
+        'on_board': sorted(on_board),
+        'total_km': round(float(cumulative), 3),
+        'planning_ms': round(elapsed_ms, 1),
+        'stops': ordered,
+    }
+    cache.set(key, plan, PLAN_TIMEOUT)
+    return plan
+
+
+def invalidate(driver_id):
+    cache.delete(PLAN_KEY.format(driver_id))
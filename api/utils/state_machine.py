@@ -0,0 +1,117 @@
+"""
+Delivery state machine.
+
+Every transition is a set of conditional UPDATEs run in one transaction:
+
+    accept    assignment ASSIGNED -> ACCEPTED, delivery ASSIGNED -> IN_PROGRESS
+    reject    assignment ASSIGNED -> REJECTED, delivery ASSIGNED -> PENDING
+    complete  (assignment ACCEPTED), delivery IN_PROGRESS -> COMPLETED,
+              pending cash-on-delivery payments -> SUCCESS
+    assign    delivery PENDING (or CANCELLED for admins) -> ASSIGNED, new assignment,
+              earlier open assignments of the delivery -> CANCELLED
+
+The WHERE clause carries the allowed source states, and the driver's
+transitions also require their assignment to be the delivery's newest, so
+a driver replaced by a reassignment can no longer move it. A transition that
+lost a race or starts from the wrong state matches no row and raises
+IllegalTransition, rolling back whatever it had already changed. Nothing is
+decided from a status read earlier in the request.
+"""
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from api.models import Assignment, DeliveryEvent, DeliveryRequest
+from api.utils import events, payments
+
+ASSIGNABLE = (DeliveryRequest.PENDING,)
+ADMIN_ASSIGNABLE = (DeliveryRequest.PENDING, DeliveryRequest.CANCELLED)
+OPEN = (Assignment.ASSIGNED, Assignment.ACCEPTED)
+
+
+class IllegalTransition(Exception):
+    pass
+
+
+def _update_delivery(delivery_request_id, from_statuses, to_status, *conditions, **fields):
+    return DeliveryRequest.objects.filter(
+        *conditions, pk=delivery_request_id, status__in=from_statuses
+    ).update(status=to_status, updated_at=timezone.now(), **fields)
+
+
+def _current(assignment):
+    """Condition on the delivery: no assignment newer than ``assignment``."""
+    return ~Exists(Assignment.objects.filter(delivery_request=OuterRef('pk'), pk__gt=assignment.pk))
+
+
+def accept(assignment):
+    with transaction.atomic():
+        if not Assignment.objects.filter(pk=assignment.pk, status=Assignment.ASSIGNED).update(
+            status=Assignment.ACCEPTED
+        ):
+            raise IllegalTransition("Only assigned assignments can be accepted.")
+        if not _update_delivery(
+            assignment.delivery_request_id, [DeliveryRequest.ASSIGNED], DeliveryRequest.IN_PROGRESS,
+            _current(assignment),
+        ):
+            raise IllegalTransition("The delivery is no longer waiting for this driver.")
+        events.record_event(
+            DeliveryEvent.ASSIGNMENT_ACCEPTED, assignment.delivery_request_id,
+            assignment=assignment.pk, driver=assignment.driver_id, status=DeliveryRequest.IN_PROGRESS,
+        )
+    assignment.status = Assignment.ACCEPTED
+
+
+def reject(assignment, reason):
+    with transaction.atomic():
+        if not Assignment.objects.filter(pk=assignment.pk, status=Assignment.ASSIGNED).update(
+            status=Assignment.REJECTED, rejection_reason=reason
+        ):
+            raise IllegalTransition("Only assigned assignments can be rejected.")
+        if not _update_delivery(
+            assignment.delivery_request_id, [DeliveryRequest.ASSIGNED], DeliveryRequest.PENDING, _current(assignment)
+        ):
+            raise IllegalTransition("The delivery is no longer waiting for this driver.")
+        events.record_event(
+            DeliveryEvent.ASSIGNMENT_REJECTED, assignment.delivery_request_id,
+            assignment=assignment.pk, driver=assignment.driver_id, reason=reason, status=DeliveryRequest.PENDING,
+        )
+    assignment.status = Assignment.REJECTED
+    assignment.rejection_reason = reason
+
+
+def complete(assignment):
+    accepted = Assignment.objects.filter(
+        pk=assignment.pk, delivery_request=OuterRef('pk'), status=Assignment.ACCEPTED
+    )
+    with transaction.atomic():
+        # One statement: the delivery moves only while this assignment is still the accepted one.
+        # is_paid is left alone unless the driver collected a cash payment; only a
+        # successful payment sets it (see api.utils.payments).
+        if not _update_delivery(
+            assignment.delivery_request_id, [DeliveryRequest.IN_PROGRESS], DeliveryRequest.COMPLETED,
+            Exists(accepted), _current(assignment),
+        ):
+            raise IllegalTransition("Only accepted assignments of deliveries in progress can be completed.")
+        events.record_event(
+            DeliveryEvent.DELIVERY_COMPLETED, assignment.delivery_request_id,
+            assignment=assignment.pk, driver=assignment.driver_id, status=DeliveryRequest.COMPLETED,
+        )
+        payments.settle_on_delivery(assignment.delivery_request_id)
+
+
+def assign(delivery_request_id, driver_id, from_statuses=ASSIGNABLE):
+    """Claim the delivery for ``driver_id`` and return the new Assignment."""
+    with transaction.atomic():
+        if not _update_delivery(delivery_request_id, from_statuses, DeliveryRequest.ASSIGNED):
+            raise IllegalTransition("This delivery is not available for assignment.")
+        # A reassignment closes whatever the previous driver still held
+        Assignment.objects.filter(delivery_request_id=delivery_request_id, status__in=OPEN).update(
+            status=Assignment.CANCELLED
+        )
+        assignment = Assignment.objects.create(delivery_request_id=delivery_request_id, driver_id=driver_id)
+        events.record_event(
+            DeliveryEvent.ASSIGNMENT_CREATED, delivery_request_id,
+            assignment=assignment.pk, driver=driver_id, status=DeliveryRequest.ASSIGNED,
+        )
+    return assignment
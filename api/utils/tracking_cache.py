@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.cache import cache
+
+DELIVERY_KEY = 'tracking:latest:delivery:{}'
+DRIVER_KEY = 'tracking:latest:driver:{}'
+
+# Entries are refreshed by every fix, so the timeout only bounds abandoned ones
+TIMEOUT = getattr(settings, 'TRACKING_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _entry(point):
+    return {
+        'delivery_request': point.delivery_request_id,
+        'driver': point.driver_id,
+        'latitude': point.latitude,
+        'longitude': point.longitude,
+        'timestamp': point.timestamp.isoformat() if point.timestamp else None,
+    }
+
+
+def record_positions(points):
+    """
+    Write-through the last known position of every delivery request and
+    driver in ``points``. Points are expected in arrival order, so later
+    points overwrite earlier ones and the whole batch is a single set_many.
+    """
+    latest = {}
+    for point in points:
+        entry = _entry(point)
+        latest[DELIVERY_KEY.format(point.delivery_request_id)] = entry
+        latest[DRIVER_KEY.format(point.driver_id)] = entry
+    if latest:
+        cache.set_many(latest, TIMEOUT)
+
+
+def get_delivery_position(delivery_request_id):
+    return cache.get(DELIVERY_KEY.format(delivery_request_id))
+
+
+def get_driver_position(driver_id):
+    return cache.get(DRIVER_KEY.format(driver_id))
+
+
+def forget_delivery(delivery_request_id):
+    """Drop the cached position once a delivery is no longer in flight."""
+    cache.delete(DELIVERY_KEY.format(delivery_request_id))
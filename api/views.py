@@ -1,3 +1,6 @@
+import json
+from datetime import date, timedelta
+
 from rest_framework import viewsets, permissions
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.exceptions import PermissionDenied
@@ -7,13 +10,15 @@ from rest_framework.views import APIView
 from rest_framework import status
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
-from .models import DeliveryRequest, Assignment, Payment, Tracking
+from .models import DeliveryRequest, Assignment, Payment, Tracking, DeliveryEvent
 from .serializers import (
     UserSerializer,
     DeliveryRequestSerializer,
+    DeliveryQuoteSerializer,
     AssignmentSerializer,
     PaymentSerializer,
     TrackingSerializer, 
+    TrackingBulkSerializer,
     RegisterSerializer, 
     CustomTokenObtainPairSerializer, 
     LogoutSerializer,
@@ -21,22 +26,40 @@ from .serializers import (
 )
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.core.mail import send_mail
 from django.shortcuts import get_object_or_404
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.parsers import MultiPartParser
 from rest_framework.decorators import action
 from api.utils.permissions import DeliveryRequestPermission
+from api.utils import (
+    tracking_cache, live, importer, dispatch, batch_dispatch, routing, nearby, metrics, mailer, state_machine, payments,
+    events, analytics, eta, exporter,
+)
 
 
 User = get_user_model()
 
 
+def _record_tracking(points):
+    """Fan freshly inserted tracking points out to the cache and live streams."""
+    tracking_cache.record_positions(points)
+    eta.record_positions(points)
+    live.publish_positions(points)
+    dispatch.driver_index.record_positions(points)
+
 
 # --------------------
 # User ViewSet
 # --------------------
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(metrics.SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    cursor_ordering = ('-id',)
 
     def get_permissions(self):
         # only admin can register admin and driver users
@@ -57,10 +80,11 @@ class UserViewSet(viewsets.ModelViewSet):
 # --------------------
 # DeliveryRequest ViewSet
 # --------------------
-class DeliveryRequestViewSet(viewsets.ModelViewSet):
+class DeliveryRequestViewSet(metrics.SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = DeliveryRequest.objects.all()
     serializer_class = DeliveryRequestSerializer
     permission_classes = [permissions.IsAuthenticated, DeliveryRequestPermission]
+    cursor_ordering = ('-created_at', '-id')
     
     def get_queryset(self):
         user = self.request.user
@@ -71,12 +95,16 @@ class DeliveryRequestViewSet(viewsets.ModelViewSet):
 
         # Customers can only see their own delivery requests
         elif user.role == 'CUSTOMER':
-            return DeliveryRequest.objects.filter(customer=user)
+            return DeliveryRequest.objects.filter(customer_id=user.id)
 
-        # Drivers can only see delivery requests assigned to them
+        # Drivers can only see delivery requests assigned to them. The
+        # annotation lets DeliveryRequestPermission skip its own lookup.
         elif user.role == 'DRIVER':
-            assigned_requests = Assignment.objects.filter(driver=user).values_list('delivery_request_id', flat=True)
-            return DeliveryRequest.objects.filter(id__in=assigned_requests)
+            return DeliveryRequest.objects.annotate(
+                assigned_to_user=Exists(
+                    Assignment.objects.filter(driver_id=user.id, delivery_request_id=OuterRef('pk'))
+                )
+            ).filter(assigned_to_user=True)
 
         # If none of the above (shouldn’t happen)
         return DeliveryRequest.objects.none()
@@ -85,7 +113,144 @@ class DeliveryRequestViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if user.role != 'CUSTOMER':
             raise PermissionDenied("Only customers can create delivery requests.")
-        serializer.save(customer=user)
+        with transaction.atomic():
+            delivery = serializer.save(customer=user)
+            events.record_event(DeliveryEvent.DELIVERY_CREATED, delivery.id, status=delivery.status)
+
+    @action(detail=False, methods=['post'], url_path='quote')
+    def quote(self, request):
+        """Price a delivery from its coordinates and package type without creating it."""
+        serializer = DeliveryQuoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'], url_path='nearby')
+    def nearby(self, request):
+        """
+        PENDING deliveries whose pickup is within ``radius_km`` of ``lat``/``lng``
+        (the driver's last reported position by default), nearest first.
+        """
+        user = request.user
+        if user.role not in [User.DRIVER, User.ADMIN]:
+            raise PermissionDenied("Only drivers can browse open deliveries.")
+
+        params = request.query_params
+        try:
+            radius_km = float(params.get('radius_km', nearby.DEFAULT_RADIUS_KM))
+            limit = int(params.get('limit', nearby.DEFAULT_LIMIT))
+            if 'lat' in params or 'lng' in params:
+                lat, lng = float(params['lat']), float(params['lng'])
+            else:
+                position = tracking_cache.get_driver_position(user.id)
+                if position is None:
+                    return Response({'detail': 'No position has been reported, pass lat and lng.'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                lat, lng = position['latitude'], position['longitude']
+        except (KeyError, ValueError):
+            return Response({'detail': 'lat, lng, radius_km and limit must be numbers.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return Response({'detail': 'Coordinates are out of range.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < radius_km <= nearby.MAX_RADIUS_KM:
+            return Response({'detail': f'radius_km must be between 0 and {nearby.MAX_RADIUS_KM}.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        limit = min(max(limit, 1), nearby.MAX_LIMIT)
+
+        results = []
+        for distance, delivery in nearby.nearby_pending(lat, lng, radius_km, limit):
+            data = DeliveryRequestSerializer(delivery).data
+            data['pickup_distance_km'] = round(distance, 3)
+            results.append(data)
+        return Response(results)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_requests(self, request):
+        """
+        Bulk import from a CSV or NDJSON manifest uploaded as ``file``. Rows are
+        validated, priced and inserted in chunks; invalid rows are reported
+        back without aborting the rest of the file.
+        """
+        if request.user.role != 'CUSTOMER':
+            raise PermissionDenied("Only customers can create delivery requests.")
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'detail': 'A manifest file is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        fmt = request.data.get('format') or importer.detect_format(upload.name)
+        if fmt not in importer.FORMATS:
+            return Response({'detail': f"Unsupported format, expected one of {', '.join(importer.FORMATS)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        result = importer.import_deliveries(upload, customer=request.user, fmt=fmt)
+        return Response(result.as_dict(), status=status.HTTP_201_CREATED if result.created else status.HTTP_400_BAD_REQUEST)
+
+    def perform_update(self, serializer):
+        previous_status = serializer.instance.status
+        with transaction.atomic():
+            delivery = serializer.save()
+            events.record_event(DeliveryEvent.DELIVERY_UPDATED, delivery.id, status=delivery.status)
+        if delivery.status != previous_status:
+            live.publish_status(delivery.id, delivery.status)
+        if delivery.status in [DeliveryRequest.COMPLETED, DeliveryRequest.CANCELLED]:
+            tracking_cache.forget_delivery(delivery.id)
+            eta.forget(delivery.id)
+
+    def perform_destroy(self, instance):
+        delivery_id = instance.id
+        with transaction.atomic():
+            instance.delete()
+            events.record_event(DeliveryEvent.DELIVERY_DELETED, delivery_id)
+        tracking_cache.forget_delivery(delivery_id)
+        eta.forget(delivery_id)
+
+    @action(detail=True, methods=['get'], url_path='location')
+    def location(self, request, pk=None):
+        """Last known position of the delivery, served from the tracking cache."""
+        delivery = self.get_object()
+        position = tracking_cache.get_delivery_position(delivery.id)
+        if position is None:
+            return Response({'detail': 'No position has been reported for this delivery.'},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(position)
+
+    @action(detail=True, methods=['get'], url_path='eta')
+    def eta(self, request, pk=None):
+        """Estimated arrival from the delivery's recent speed and remaining distance, served from the cache."""
+        delivery = self.get_object()
+        if delivery.status in [DeliveryRequest.COMPLETED, DeliveryRequest.CANCELLED]:
+            return Response({'detail': 'This delivery is no longer in flight.'}, status=status.HTTP_404_NOT_FOUND)
+        estimate = eta.estimate(delivery.id)
+        if estimate is None:
+            return Response({'detail': 'No position has been reported for this delivery.'},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(estimate)
+
+    @action(
+        detail=True,
+        methods=['get'],
+        url_path='events',
+        renderer_classes=[live.EventStreamRenderer, JSONRenderer]
+    )
+    def events(self, request, pk=None):
+        """
+        Server-Sent Events stream of tracking points and status changes for one
+        delivery. Requires the ASGI entry point (orionProject.asgi).
+        """
+        delivery = self.get_object()
+        if not live.can_stream(request):
+            return Response({'detail': 'Live streams are only served by the ASGI application (orionProject.asgi).'},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+        initial = tracking_cache.get_delivery_position(delivery.id)
+        response = StreamingHttpResponse(
+            live.event_stream(delivery.id, initial=initial),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -96,10 +261,21 @@ class DeliveryRequestViewSet(viewsets.ModelViewSet):
 # --------------------
 # Assignment ViewSet
 # --------------------
-class AssignmentViewSet(viewsets.ModelViewSet):
-    queryset = Assignment.objects.all()
+class AssignmentViewSet(metrics.SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = Assignment.objects.select_related('driver')
     serializer_class = AssignmentSerializer
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('-assigned_at', '-id')
+
+    def get_queryset(self):
+        # Admins see every assignment, drivers their own, customers those of their deliveries
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.role == User.ADMIN:
+            return queryset
+        if user.role == User.DRIVER:
+            return queryset.filter(driver_id=user.id)
+        return queryset.filter(delivery_request__customer_id=user.id)
 
     @action(
         detail=True,
@@ -108,13 +284,15 @@ class AssignmentViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated]
     )
     def accept(self, request, pk=None):
-        assignment = get_object_or_404(Assignment, pk=pk, driver=request.user)
-        assignment.status = Assignment.ACCEPTED
-        assignment.save()
-
-        # Update delivery request status
-        assignment.delivery_request.status = DeliveryRequest.IN_PROGRESS
-        assignment.delivery_request.save()
+        assignment = get_object_or_404(
+            Assignment.objects.only('driver', 'delivery_request'), pk=pk, driver=request.user
+        )
+        try:
+            state_machine.accept(assignment)
+        except state_machine.IllegalTransition as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        live.publish_status(assignment.delivery_request_id, DeliveryRequest.IN_PROGRESS)
+        routing.invalidate(assignment.driver_id)
 
         return Response({'detail': 'Assignment accepted successfully.'})
 
@@ -125,21 +303,31 @@ class AssignmentViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated]
     )
     def reject(self, request, pk=None):
-        assignment = get_object_or_404(Assignment, pk=pk, driver=request.user)
+        assignment = get_object_or_404(
+            Assignment.objects.only('driver', 'delivery_request'), pk=pk, driver=request.user
+        )
 
         reason = request.data.get('reason')
         if not reason:
             return Response({'detail': 'Rejection reason is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Mark assignment as rejected
-        assignment.status = Assignment.REJECTED
-        assignment.rejection_reason = reason
-        assignment.save()
-
-        # Set delivery back to pending so it can be reassigned
-        delivery = assignment.delivery_request
-        delivery.status = DeliveryRequest.PENDING
-        delivery.save()
+        # Sets the delivery back to pending so it can be reassigned
+        try:
+            state_machine.reject(assignment, reason)
+        except state_machine.IllegalTransition as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        live.publish_status(assignment.delivery_request_id, DeliveryRequest.PENDING)
+
+        # Offer the delivery to the next nearest driver straight away
+        if dispatch.AUTO_REASSIGN:
+            delivery = DeliveryRequest.objects.get(pk=assignment.delivery_request_id)
+            reassignment = dispatch.auto_assign(delivery)
+            if reassignment is not None:
+                live.publish_status(delivery.id, DeliveryRequest.ASSIGNED)
+                return Response({
+                    'detail': 'Assignment rejected successfully. Delivery was reassigned to the next nearest driver.',
+                    'assignment': AssignmentSerializer(reassignment).data,
+                })
 
         return Response({'detail': 'Assignment rejected successfully. Delivery is now available for reassignment.'})
 
@@ -151,27 +339,82 @@ class AssignmentViewSet(viewsets.ModelViewSet):
     )
     def assign_driver(self, request, pk=None):
         """Admin manually assigns a driver to a delivery request."""
-        delivery = get_object_or_404(DeliveryRequest, pk=pk)
-
-        # Check if delivery is available for assignment
-        if delivery.status not in [DeliveryRequest.PENDING, DeliveryRequest.CANCELLED]:
-            return Response({'detail': 'This delivery is not available for assignment.'},
-                            status=status.HTTP_400_BAD_REQUEST)
+        delivery = get_object_or_404(DeliveryRequest.objects.only('id'), pk=pk)
 
         driver_id = request.data.get('driver_id')
         if not driver_id:
             return Response({'detail': 'Driver ID is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Create assignment
-        assignment = Assignment.objects.create(
-            delivery_request=delivery,
-            driver_id=driver_id
-        )
+        # Fails unless the delivery is still pending or cancelled when the update runs
+        try:
+            assignment = state_machine.assign(delivery.id, driver_id, from_statuses=state_machine.ADMIN_ASSIGNABLE)
+        except state_machine.IllegalTransition as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        live.publish_status(delivery.id, DeliveryRequest.ASSIGNED)
+
+        return Response(AssignmentSerializer(assignment).data, status=status.HTTP_201_CREATED)
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path=r'(?P<pk>\d+)/auto-assign',
+        permission_classes=[IsAdminUser]
+    )
+    def auto_assign(self, request, pk=None):
+        """Assign the nearest available driver to a pending delivery request."""
+        delivery = get_object_or_404(DeliveryRequest, pk=pk)
+        if delivery.status != DeliveryRequest.PENDING:
+            return Response({'detail': 'This delivery is not available for assignment.'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        delivery.status = DeliveryRequest.ASSIGNED
-        delivery.save()
+        assignment = dispatch.auto_assign(delivery)
+        if assignment is None:
+            return Response({'detail': 'No available driver nearby.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        live.publish_status(delivery.id, DeliveryRequest.ASSIGNED)
         return Response(AssignmentSerializer(assignment).data, status=status.HTTP_201_CREATED)
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='dispatch',
+        permission_classes=[IsAdminUser]
+    )
+    def dispatch_pending(self, request):
+        """Match the whole PENDING queue to idle drivers in one optimal batch."""
+        summary = batch_dispatch.dispatch_pending()
+        for assignment in summary['assignments']:
+            live.publish_status(assignment['delivery_request'], DeliveryRequest.ASSIGNED)
+        return Response(summary, status=status.HTTP_201_CREATED if summary['assigned'] else status.HTTP_200_OK)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='route',
+        permission_classes=[IsAuthenticated]
+    )
+    def route(self, request):
+        """
+        Ordered pickup/dropoff stops for the driver's accepted deliveries.
+        Admins pass ?driver_id=. ?on_board=1,2 lists deliveries already picked
+        up and ?refresh=1 re-plans from the driver's current position.
+        """
+        driver_id = request.user.id
+        if request.user.role == User.ADMIN and request.query_params.get('driver_id'):
+            driver_id = request.query_params['driver_id']
+        elif request.user.role != User.DRIVER:
+            return Response({'detail': 'Only drivers have a route.'}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            driver_id = int(driver_id)
+            on_board = [int(value) for value in request.query_params.get('on_board', '').split(',') if value]
+        except ValueError:
+            return Response({'detail': 'driver_id and on_board must be integers.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        refresh = request.query_params.get('refresh') in ('1', 'true')
+        return Response(routing.plan_route(driver_id, on_board=on_board, refresh=refresh))
+
     @action(
     detail=True,
     methods=['patch'],
@@ -182,38 +425,52 @@ class AssignmentViewSet(viewsets.ModelViewSet):
         """
         Driver marks the delivery as completed.
         """
-        assignment = get_object_or_404(Assignment, pk=pk)
+        assignment = get_object_or_404(Assignment.objects.only('driver', 'delivery_request'), pk=pk)
 
         # Only the assigned driver can complete
-        if request.user != assignment.driver:
+        if request.user.id != assignment.driver_id:
             return Response({'detail': 'You are not authorized to complete this assignment.'},
                             status=status.HTTP_403_FORBIDDEN)
 
-        # Only accepted assignments can be completed
-        if assignment.status != Assignment.ACCEPTED:
-            return Response({'detail': 'Only accepted assignments can be completed.'},
-                            status=status.HTTP_400_BAD_REQUEST)
+        # Only accepted assignments can be completed; the assignment itself stays ACCEPTED
+        try:
+            state_machine.complete(assignment)
+        except state_machine.IllegalTransition as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        tracking_cache.forget_delivery(assignment.delivery_request_id)
+        eta.forget(assignment.delivery_request_id)
+        live.publish_status(assignment.delivery_request_id, DeliveryRequest.COMPLETED)
+        routing.invalidate(assignment.driver_id)
 
-        # Update assignment status
-        assignment.status = Assignment.ACCEPTED  # keep as accepted or optionally create COMPLETED in Assignment
-        assignment.save()
+        return Response({'detail': 'Delivery marked as completed successfully.'}, status=status.HTTP_200_OK)
 
-        # Update delivery request status
-        delivery = assignment.delivery_request
-        delivery.status = DeliveryRequest.COMPLETED
-        delivery.is_paid = True  # Assuming payment is done upon completion
-        delivery.save()
 
-        return Response({'detail': 'Delivery marked as completed successfully.'}, status=status.HTTP_200_OK)
+def _scoped_to_deliveries(queryset, user):
+    """
+    Rows of ``queryset`` (which has a ``delivery_request``) the user may see:
+    admins all, customers those of their own deliveries, drivers those of
+    deliveries assigned to them.
+    """
+    if user.role == User.ADMIN:
+        return queryset
+    if user.role == User.DRIVER:
+        return queryset.filter(Exists(
+            Assignment.objects.filter(driver_id=user.id, delivery_request_id=OuterRef('delivery_request_id'))
+        ))
+    return queryset.filter(delivery_request__customer_id=user.id)
 
 
 # --------------------
 # Payment ViewSet
 # --------------------
-class PaymentViewSet(viewsets.ModelViewSet):
-    queryset = Payment.objects.all()
+class PaymentViewSet(metrics.SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = Payment.objects.select_related('delivery_request')
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        return _scoped_to_deliveries(super().get_queryset(), self.request.user)
 
     def create(self, request, *args, **kwargs):
         delivery_request_id = request.data.get('delivery_request')
@@ -243,8 +500,14 @@ class PaymentViewSet(viewsets.ModelViewSet):
         # Pay on delivery option
         return Response({'payment_id': payment.id, 'message': 'Payment will be collected on delivery'})
 
+    @action(
+        detail=True,
+        methods=['patch'],
+        url_path='status',
+        permission_classes=[IsAdminUser]
+    )
     def update_status(self, request, pk=None):
-        """ Endpoint to update payment status after webhook """
+        """ Admin records a payment result by hand """
         try:
             payment = Payment.objects.get(pk=pk)
         except Payment.DoesNotExist:
@@ -252,18 +515,16 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
         status_ = request.data.get('status')
         transaction_id = request.data.get('transaction_id')
-        if status_ not in [Payment.PENDING, Payment.SUCCESS, Payment.FAILED]:
+        if not isinstance(status_, str) or status_ not in [Payment.PENDING, Payment.SUCCESS, Payment.FAILED]:
             return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+        if transaction_id is not None and not isinstance(transaction_id, str):
+            return Response({'error': 'Invalid transaction_id'}, status=status.HTTP_400_BAD_REQUEST)
 
-        payment.status = status_
-        if transaction_id:
-            payment.transaction_id = transaction_id
-        payment.save()
-
-        # Mark delivery request as paid if successful
-        if status_ == Payment.SUCCESS:
-            payment.delivery_request.is_paid = True
-            payment.delivery_request.save()
+        try:
+            payments.record(payment, status_, transaction_id)
+        except IntegrityError:
+            return Response({'error': 'This transaction_id is already recorded on another payment'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
         return Response({'message': 'Payment status updated'})
 
@@ -271,10 +532,38 @@ class PaymentViewSet(viewsets.ModelViewSet):
 # --------------------
 # Tracking ViewSet
 # --------------------
-class TrackingViewSet(viewsets.ModelViewSet):
-    queryset = Tracking.objects.all()
+class TrackingViewSet(metrics.SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = Tracking.objects.select_related('delivery_request')
     serializer_class = TrackingSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cursor_ordering = ('-timestamp', '-id')
+
+    def get_queryset(self):
+        return _scoped_to_deliveries(super().get_queryset(), self.request.user)
+
+    def perform_create(self, serializer):
+        point = serializer.save()
+        _record_tracking([point])
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """Ingest a batch of buffered GPS fixes with a single insert."""
+        serializer = TrackingBulkSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        points = serializer.save()
+        _record_tracking(points)
+        return Response({'created': len(points)}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path=r'drivers/(?P<driver_id>\d+)/location')
+    def driver_location(self, request, driver_id=None):
+        """Last known position of a driver. Admins can look up any driver, drivers only themselves."""
+        if request.user.role != User.ADMIN and str(request.user.id) != driver_id:
+            raise PermissionDenied("You can only view your own location.")
+        position = tracking_cache.get_driver_position(driver_id)
+        if position is None:
+            return Response({'detail': 'No position has been reported for this driver.'},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(position)
 
 
 # --------------------
@@ -295,17 +584,8 @@ class LogoutView(generics.GenericAPIView):
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        # The serializer blacklists the token; verifying it again here would fail
         serializer.save()
-        refresh_token = request.data.get("refresh") or request.COOKIES.get("refresh_token")
-
-        if not refresh_token:
-            return Response({"error": "Refresh token missing."}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            token = RefreshToken(refresh_token)
-            token.blacklist()
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         response = Response({"detail": "Successfully logged out."}, status=status.HTTP_200_OK)
         response.delete_cookie("access_token")
@@ -320,15 +600,17 @@ class ForgotPasswordView(APIView):
         user = User.objects.filter(email=email).first()
         if user:
             temp_password = get_random_string(8)
-            user.set_password(temp_password)
-            user.save()
-            send_mail(
-                "Password Reset",
-                f"Your temporary password is: {temp_password}",
-                "noreply@orion.com",
-                [email],
-                fail_silently=False,
-            )
+            # Queued for the send_queued_mail worker; no SMTP round trip here
+            with transaction.atomic():
+                user.set_password(temp_password)
+                user.save()
+                mailer.enqueue(
+                    "Password Reset",
+                    f"Your temporary password is: {temp_password}",
+                    [email],
+                    from_email="noreply@orion.com",
+                    sensitive=True,
+                )
             return Response({"message": "Temporary password sent to your email."})
         return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
     
@@ -375,10 +657,11 @@ class CustomTokenObtainPairView(TokenObtainPairView):
         return response
     
 # Profile ViewSet can be added similarly
-class ProfileViewSet(viewsets.ReadOnlyModelViewSet):
+class ProfileViewSet(metrics.SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = None  # always the caller's own profile
 
     def get_queryset(self):
         return User.objects.filter(id=self.request.user.id)
@@ -392,4 +675,125 @@ class ProfileViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = self.get_serializer(user, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+# --------------------
+# Metrics Views
+# --------------------
+class MetricsView(APIView):
+    """Per-route latency, SQL and serializer histograms of this process, in Prometheus text format."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class ProfileSamplesView(APIView):
+    """cProfile stats of recent slow requests, when PROFILING_SAMPLE_RATE is set."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(list(reversed(metrics.sampler.profiles)))
+
+
+# --------------------
+# Analytics Views
+# --------------------
+class AnalyticsView(APIView):
+    """
+    Dashboard reports over ``start``..``end`` (ISO dates, the last 30 days by
+    default), read from the rollup tables only.
+    """
+    permission_classes = [IsAdminUser]
+    reports = {
+        'revenue': analytics.daily_revenue,
+        'statuses': analytics.status_counts,
+        'package-types': analytics.package_types,
+        'drivers': analytics.driver_completions,
+    }
+
+    def get(self, request, report):
+        if report not in self.reports:
+            return Response({'detail': f"Unknown report, expected one of {', '.join(self.reports)}."},
+                            status=status.HTTP_404_NOT_FOUND)
+        params = request.query_params
+        try:
+            end = date.fromisoformat(params['end']) if 'end' in params else timezone.localdate()
+            start = date.fromisoformat(params['start']) if 'start' in params else end - timedelta(days=29)
+        except ValueError:
+            return Response({'detail': 'start and end must be dates (YYYY-MM-DD).'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({'detail': 'start must not be after end.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'start': start, 'end': end, 'results': self.reports[report](start, end)})
+
+
+# --------------------
+# Export Views
+# --------------------
+class SuffixFormatNegotiation(DefaultContentNegotiation):
+    """
+    For views whose URL picks the format: the Accept header is ignored and
+    the first renderer, used for error responses, is always selected.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class ExportView(APIView):
+    """
+    Full dumps of deliveries or tracking points as NDJSON or CSV, streamed page
+    by page. Filters: ``start``/``end`` (ISO dates, inclusive), ``status``
+    (comma separated delivery statuses) and ``gzip=1`` for a compressed file.
+    """
+    permission_classes = [IsAdminUser]
+    renderer_classes = [JSONRenderer]
+    content_negotiation_class = SuffixFormatNegotiation
+
+    def get(self, request, dataset, fmt):
+        params = request.query_params
+        try:
+            start = date.fromisoformat(params['start']) if 'start' in params else None
+            end = date.fromisoformat(params['end']) if 'end' in params else None
+        except ValueError:
+            return Response({'detail': 'start and end must be dates (YYYY-MM-DD).'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        statuses = [value for value in params.get('status', '').split(',') if value]
+        compress = params.get('gzip') in ('1', 'true')
+        try:
+            chunks = exporter.export(dataset, fmt, start, end, statuses, compress=compress)
+        except exporter.ExportError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        filename = f"{dataset}.{fmt}.gz" if compress else f"{dataset}.{fmt}"
+        response = StreamingHttpResponse(
+            chunks, content_type='application/gzip' if compress else exporter.CONTENT_TYPES[fmt]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+# --------------------
+# Payment Webhook
+# --------------------
+class PaymentWebhookView(APIView):
+    """
+    Callbacks from payment providers, one object or {"events": [...]} per
+    request, signed with X-Webhook-Signature (hex HMAC-SHA256 of the body
+    under PAYMENT_WEBHOOK_SECRETS[provider]). Retries are safe.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, provider):
+        # The signature covers the raw body, so it is parsed here rather than through request.data
+        body = request.body
+        if not payments.verify_signature(provider, body, request.headers.get('X-Webhook-Signature')):
+            return Response({'detail': 'Invalid signature.'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            callbacks = payments.parse(json.loads(body))
+        except (ValueError, payments.InvalidCallback) as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(payments.apply_callbacks(provider, callbacks))
@@ -49,14 +49,47 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # simplejwt's JWTAuthentication with users resolved through a short-TTL cache
+        'api.utils.authentication.CachedJWTAuthentication',
         'api.utils.authentication.CookieJWTAuthentication',
     ),
+    # Keyset pagination, see api/utils/pagination.py
+    'DEFAULT_PAGINATION_CLASS': 'api.utils.pagination.KeysetPagination',
 }
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.TokenRefreshSerializer',
 }
+# Revoked refresh tokens are mirrored into a Bloom filter sized for this many
+# entries; run `manage.py compact_tokens` periodically to purge expired ones.
+REVOCATION_BLOOM_CAPACITY = 1_000_000
+REVOCATION_FALSE_POSITIVE_RATE = 0.001
+REVOCATION_SYNC_INTERVAL = 1
+# Delivery lifecycle events are drained by `manage.py dispatch_events --loop`
+# to every sink below and to each URL in EVENT_WEBHOOK_URLS.
+EVENT_SINKS = {
+    'log': 'api.utils.events.log_sink',
+    # Keeps the dashboard rollups current (see api.utils.analytics)
+    'analytics': 'api.utils.analytics.rollup_sink',
+}
+EVENT_WEBHOOK_URLS = [url for url in os.getenv('EVENT_WEBHOOK_URLS', '').split(',') if url]
+EVENT_WEBHOOK_SECRET = os.getenv('EVENT_WEBHOOK_SECRET', '')
+# Payment providers posting to /api/webhooks/payments/<provider>/, with the
+# secret their callbacks are signed with; providers without one are refused.
+PAYMENT_WEBHOOK_SECRETS = {
+    'flutterwave': os.getenv('FLUTTERWAVE_WEBHOOK_SECRET', ''),
+}
+# Request metrics (GET /api/metrics/). Set PROFILING_SAMPLE_RATE to e.g. 0.01
+# to cProfile that share of requests and keep the ones slower than the threshold.
+METRICS_ENABLED = True
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_THRESHOLD_MS = 500
+# Authenticated users are cached per process for AUTH_USER_CACHE_TTL seconds.
+# Set AUTH_USER_CACHE_SHARED to also keep them in the default cache.
+AUTH_USER_CACHE_TTL = 10
+AUTH_USER_CACHE_SIZE = 10000
+AUTH_USER_CACHE_SHARED = False
 # AUTHENTICATION_BACKENDS = [
 #     'api.backends.EmailBackend',
 #     'django.contrib.auth.backends.ModelBackend',  # fallback
@@ -67,6 +100,8 @@ SIMPLE_JWT = {
 
 
 MIDDLEWARE = [
+    # Outermost, so its timings cover the rest of the stack
+    'api.utils.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -110,6 +145,30 @@ DATABASES = {
     }
 }
 
+# DB_ENGINE=sqlite runs against a local SQLite file instead (benchmarks, local work)
+if os.getenv("DB_ENGINE") == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("DB_NAME") or BASE_DIR / "db.sqlite3",
+        }
+    }
+
+# Cache
+# Holds the latest tracking position per delivery and driver. LocMemCache is
+# per process; point this at a shared backend (Redis, Memcached) when running
+# several workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'orion',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -154,4 +213,8 @@ AUTH_USER_MODEL = 'api.User'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # For production, configure SMTP settings like below:
-# EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
\ No newline at end of file
+# EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Email is queued in the OutboundEmail table and delivered by
+# `manage.py send_queued_mail --loop`; failed sends are retried with backoff.
+MAIL_OUTBOX_MAX_ATTEMPTS = 5
+MAIL_OUTBOX_RETRY_DELAY = 60